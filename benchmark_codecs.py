@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Wire codec benchmark for the hub.
+Moves large task results through one hub process in each codec (JSONL,
+length-prefixed JSON, msgpack if installed) and reports the hub's CPU time
+per MB transferred, read from /proc.
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from kirosu.agent import HubClient
+from kirosu.codec import CODECS
+
+# Typical model output: code with quotes, backslashes and many short lines
+SAMPLE = 'def handler(event):\n    print("got \\"%s\\"" % event["body"])  # naïve\n    return {"ok": True}\n\n'
+
+
+def start_hub(db_path: str) -> tuple[subprocess.Popen, int]:
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "kirosu.cli", "hub", "--port", "0", "--db", db_path],
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    for line in proc.stderr:
+        m = re.search(r"KIRO_SWARM_HUB tcp://[^:]+:(\d+)", line)
+        if m:
+            # Keep draining the hub's log so it never blocks on a full pipe
+            threading.Thread(target=lambda: [None for _ in proc.stderr], daemon=True).start()
+            return proc, int(m.group(1))
+    raise RuntimeError("Hub failed to start")
+
+
+def cpu_seconds(pid: int) -> float:
+    """User + system CPU time of a process."""
+    fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def bench_codec(port: int, pid: int, codec: str, result: str, rounds: int) -> dict:
+    client = HubClient("127.0.0.1", port, codec=codec)
+    mb = len(result.encode("utf-8")) / (1024 * 1024)
+
+    cpu_start, wall_start = cpu_seconds(pid), time.perf_counter()
+    for _ in range(rounds):
+        # Result in (ack) and back out (get_tasks): the hub decodes and encodes it once each
+        task_id = client.call("enqueue", {"prompt": "bench"})["task_id"]
+        client.call("lease", {"worker_id": "bench", "max_tasks": 1})
+        client.call("ack", {"task_id": task_id, "status": "done", "result": result})
+        fetched = client.call("get_tasks", {"task_ids": [task_id]})["tasks"][0]["result"]
+        assert len(fetched) == len(result)
+    wall = time.perf_counter() - wall_start
+    cpu = cpu_seconds(pid) - cpu_start
+    client._disconnect()
+
+    total_mb = mb * 2 * rounds
+    return {
+        "codec": client.codec.name,
+        "mb": total_mb,
+        "cpu_ms_per_mb": cpu * 1000 / total_mb,
+        "mb_per_sec": total_mb / wall,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=float, default=4.0, help="Size of each task result")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--port", type=int, help="Use an already running hub instead of starting one")
+    parser.add_argument("--pid", type=int, help="Pid of that hub, for CPU accounting")
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print("Hub Wire Codec Benchmark")
+    print("=" * 70)
+    if "msgpack" not in CODECS:
+        print("  msgpack not installed (pip install 'kirosu[msgpack]'); skipping it")
+
+    result = SAMPLE * int(args.size_mb * 1024 * 1024 / len(SAMPLE.encode("utf-8")))
+    proc = None
+    db_path = tempfile.mktemp(suffix=".db")
+    try:
+        if args.port:
+            if not args.pid:
+                parser.error("--port needs --pid")
+            port, pid = args.port, args.pid
+        else:
+            proc, port = start_hub(db_path)
+            pid = proc.pid
+
+        print(f"\n{args.rounds} rounds of a {args.size_mb:g} MB result, in via ack and out via get_tasks\n")
+        print(f"  {'codec':<10} {'MB moved':>10} {'hub CPU ms/MB':>15} {'MB/s':>10}")
+        for codec in sorted(CODECS):
+            r = bench_codec(port, pid, codec, result, args.rounds)
+            print(f"  {r['codec']:<10} {r['mb']:>10.1f} {r['cpu_ms_per_mb']:>15.2f} {r['mb_per_sec']:>10.1f}")
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait()
+        for suffix in ("", "-wal", "-shm"):
+            if Path(db_path + suffix).exists():
+                Path(db_path + suffix).unlink()
+
+    print("\n" + "=" * 70)
+    print("Benchmark Complete")
+    print("=" * 70)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Connection load test for the hub.
+Holds N concurrent client connections against one hub process and reports
+the hub's memory and thread count, plus ping latency across all of them.
+"""
+
+import argparse
+import asyncio
+import json
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+
+def raise_fd_limit(wanted: int) -> int:
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = min(max(soft, wanted), hard)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+    return target
+
+
+def start_hub(db_path: str) -> tuple[subprocess.Popen, int]:
+    """Start a hub on a free port; its fd limit is raised by the preexec hook."""
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "kirosu.cli", "hub", "--port", "0", "--db", db_path],
+        stderr=subprocess.PIPE,
+        text=True,
+        preexec_fn=lambda: raise_fd_limit(1 << 20),
+    )
+    for line in proc.stderr:
+        m = re.search(r"KIRO_SWARM_HUB tcp://[^:]+:(\d+)", line)
+        if m:
+            # Keep draining the hub's log so it never blocks on a full pipe
+            threading.Thread(target=lambda: [None for _ in proc.stderr], daemon=True).start()
+            return proc, int(m.group(1))
+    raise RuntimeError("Hub failed to start")
+
+
+def process_stats(pid: int) -> dict[str, str]:
+    out = {}
+    for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+        key, _, value = line.partition(":")
+        if key in ("VmRSS", "Threads"):
+            out[key] = value.strip()
+    return out
+
+
+async def call(reader, writer, req_id: str, method: str, params: dict | None = None):
+    writer.write((json.dumps({"id": req_id, "method": method, "params": params or {}}) + "\n").encode())
+    await writer.drain()
+    while True:
+        resp = json.loads(await reader.readline())
+        if resp.get("id") == req_id:
+            return resp
+
+
+async def open_connections(host: str, port: int, n: int, concurrency: int = 500):
+    sem = asyncio.Semaphore(concurrency)
+    conns = []
+
+    async def one(i: int):
+        async with sem:
+            reader, writer = await asyncio.open_connection(host, port, limit=1 << 24)
+            await call(reader, writer, f"c{i}", "ping")
+            conns.append((reader, writer))
+
+    await asyncio.gather(*(one(i) for i in range(n)))
+    return conns
+
+
+async def ping_all(conns) -> list[float]:
+    async def one(i, reader, writer):
+        start = time.perf_counter()
+        await call(reader, writer, f"p{i}", "ping")
+        return time.perf_counter() - start
+
+    return await asyncio.gather(*(one(i, r, w) for i, (r, w) in enumerate(conns)))
+
+
+def analyze_times(times: list[float], label: str):
+    times = sorted(times)
+    n = len(times)
+    print(f"\n{label}:")
+    print(f"  Samples: {n}")
+    print(f"  p50: {times[n // 2] * 1000:.2f}ms")
+    print(f"  p99: {times[min(n - 1, int(n * 0.99))] * 1000:.2f}ms")
+    print(f"  Max: {times[-1] * 1000:.2f}ms")
+
+
+async def run(host: str, port: int, n: int, hub_pid: int | None):
+    print(f"\n[Test 1] Opening {n} concurrent connections")
+    start = time.perf_counter()
+    conns = await open_connections(host, port, n)
+    print(f"  Connected {len(conns)} clients in {time.perf_counter() - start:.2f}s")
+    if hub_pid:
+        stats = process_stats(hub_pid)
+        print(f"  Hub RSS: {stats['VmRSS']}, threads: {stats['Threads']}")
+
+    print(f"\n[Test 2] One ping on every connection at once")
+    start = time.perf_counter()
+    times = await ping_all(conns)
+    total = time.perf_counter() - start
+    analyze_times(times, "Ping round trip under full fan-in")
+    print(f"  Total time: {total:.2f}s ({len(times) / total:.0f} requests/sec)")
+
+    print(f"\n[Test 3] Enqueue + lease while {n} clients stay connected")
+    reader, writer = conns[0]
+    start = time.perf_counter()
+    for i in range(200):
+        await call(reader, writer, f"e{i}", "enqueue", {"prompt": f"task {i}"})
+    leased = await call(reader, writer, "l", "lease", {"worker_id": "bench", "max_tasks": 200})
+    print(f"  200 enqueues + 1 lease ({len(leased['result']['tasks'])} tasks): {time.perf_counter() - start:.2f}s")
+    if hub_pid:
+        stats = process_stats(hub_pid)
+        print(f"  Hub RSS: {stats['VmRSS']}, threads: {stats['Threads']}")
+
+    for _, writer in conns:
+        writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--connections", type=int, default=10000)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, help="Use an already running hub instead of starting one")
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print("Hub Connection Load Test")
+    print("=" * 70)
+
+    limit = raise_fd_limit(args.connections + 100)
+    if limit < args.connections + 100:
+        print(f"  Open-file limit is {limit}; capping at {limit - 100} connections")
+        args.connections = limit - 100
+
+    proc = None
+    db_path = tempfile.mktemp(suffix=".db")
+    try:
+        if args.port:
+            port, pid = args.port, None
+        else:
+            proc, port = start_hub(db_path)
+            pid = proc.pid
+        asyncio.run(run(args.host, port, args.connections, pid))
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait()
+        for suffix in ("", "-wal", "-shm"):
+            if Path(db_path + suffix).exists():
+                Path(db_path + suffix).unlink()
+
+    print("\n" + "=" * 70)
+    print("Load Test Complete")
+    print("=" * 70)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+JSON microbenchmark for hub payloads.
+Encodes and decodes typical lease, list and ack_many messages with the
+stdlib path the hub used before (dumps to str, then encode) and with the
+kirosu.codec layer, which uses orjson when it is installed.
+"""
+
+import argparse
+import json
+import tempfile
+import timeit
+from dataclasses import asdict
+from pathlib import Path
+
+from kirosu import codec
+from kirosu.db import TaskStore
+
+RESULT = "Here is the summary you asked for:\n- point one, with \"quotes\"\n- point två\n" * 25
+
+
+def build_payloads() -> dict[str, dict]:
+    """Real messages, taken from a scratch store."""
+    db_path = tempfile.mktemp(suffix=".db")
+    store = TaskStore(db_path)
+    try:
+        for i in range(60):
+            store.enqueue(f"Summarise document {i}:\n" + "lorem ipsum " * 40, system_prompt="You are terse.")
+        leased = store.lease("bench", max_tasks=10, lease_seconds=60)
+        for task in leased:
+            store.ack(task.task_id, "done", RESULT, None)
+        listed = store.list(status=None, limit=50)
+        return {
+            "lease (10 tasks)": {"id": "1", "result": {"tasks": [asdict(t) for t in leased]}, "error": None},
+            "list (50 tasks)": {
+                "id": "2",
+                "result": {"tasks": [asdict(t) for t in listed], "stats": store.stats()},
+                "error": None,
+            },
+            "ack_many (20 acks)": {
+                "id": "3",
+                "method": "ack_many",
+                "params": {"acks": [{"task_id": i, "status": "done", "result": RESULT} for i in range(20)]},
+            },
+        }
+    finally:
+        store.close()
+        for suffix in ("", "-wal", "-shm"):
+            Path(db_path + suffix).unlink(missing_ok=True)
+
+
+def stdlib_pack(obj) -> bytes:
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def stdlib_loads(data: bytes):
+    return json.loads(data.decode("utf-8"))
+
+
+def bench(fn, arg, number: int) -> float:
+    """Microseconds per call, best of three."""
+    return min(timeit.repeat(lambda: fn(arg), number=number, repeat=3)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=2000, help="Calls per measurement")
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print("Hub JSON Codec Microbenchmark")
+    print("=" * 70)
+    backend = "orjson" if codec.orjson else "stdlib json (pip install 'kirosu[orjson]' for orjson)"
+    print(f"  kirosu.codec backend: {backend}\n")
+
+    print(f"  {'payload':<20} {'KB':>6} {'encode µs':>18} {'decode µs':>18}")
+    print(f"  {'':<20} {'':>6} {'before':>8} {'codec':>9} {'before':>8} {'codec':>9}")
+    for name, obj in build_payloads().items():
+        wire = stdlib_pack(obj)
+        assert codec.JSONL.loads(codec.JSONL.pack(obj)) == stdlib_loads(wire)
+        print(
+            f"  {name:<20} {len(wire) / 1024:>6.1f}"
+            f" {bench(stdlib_pack, obj, args.number):>8.1f} {bench(codec.JSONL.pack, obj, args.number):>9.1f}"
+            f" {bench(stdlib_loads, wire, args.number):>8.1f} {bench(codec.JSONL.loads, wire, args.number):>9.1f}"
+        )
+
+    print("\n" + "=" * 70)
+    print("Benchmark Complete")
+    print("=" * 70)
+
+
+if __name__ == "__main__":
+    main()
@@ -22,20 +22,10 @@ def start_process(cmd, name):
         env=os.environ.copy()
     )
 
-async def run_agent_task(hub_port, agent_id, system_prompt, user_input):
+async def run_agent_task(client, agent_id, system_prompt, user_input):
     """Helper to run a single task on a specific agent (conceptually)."""
     full_prompt = f"System: {system_prompt}\n\nUser: {user_input}\nOutput:"
-    
-    async with SwarmClient(port=hub_port) as client:
-        task_id = await client.add_task(full_prompt, task_type="chat")
-        
-        # Poll
-        while True:
-            await asyncio.sleep(0.5)
-            status = await client._send_request("list", {"limit": 10}) 
-            for t in status.get('tasks', []):
-                if t['task_id'] == task_id and t['status'] == 'done':
-                    return t['result']
+    return await client.run(full_prompt, task_type="chat")
 
 async def bar_loop():
     # 1. Setup
@@ -85,6 +75,7 @@ async def bar_loop():
     
     bartender_persona = "You are a sober, tired bartender. Summarize what these three crazy people said into one clear, sane sentence for the user."
 
+    client = SwarmClient(port=HUB_PORT)
     while True:
         try:
             topic = input("\n\033[1mThow a topic to the bar\033[0m: ")
@@ -98,8 +89,8 @@ async def bar_loop():
         # 1. Parallel Execution: Run all 3 drunks at once
         tasks = []
         for name, prompt in personas:
-            # Pass HUB_PORT (new client per task) to avoid read-race on single socket
-            tasks.append(run_agent_task(HUB_PORT, name, prompt, topic))
+            # All three share one client; replies are matched to requests by id
+            tasks.append(run_agent_task(client, name, prompt, topic))
         
         # Wait for all 3
         results = await asyncio.gather(*tasks)
@@ -112,12 +103,13 @@ async def bar_loop():
         print("\n... The Bartender (Formatter) is clearing his throat ...")
         
         # 2. Sequential Execution: Bartender cleans it up
-        final_summary = await run_agent_task(HUB_PORT, "Bartender", bartender_persona, f"Here is what they said:\n{patron_output}")
+        final_summary = await run_agent_task(client, "Bartender", bartender_persona, f"Here is what they said:\n{patron_output}")
         
         print(f"🍸 \033[1;32mBartender\033[0m: {final_summary}")
 
     # Cleanup
     print("\n👋 Closing Time!")
+    await client.close()
     hub.terminate()
     for a in agents: a.terminate()
     subprocess.run(["pkill", "-f", f"port {HUB_PORT}"], check=False)
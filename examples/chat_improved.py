@@ -4,6 +4,7 @@ import os
 import sys
 import subprocess
 import time
+import uuid
 from kirosu.client import SwarmClient
 
 # Configure minimal logging
@@ -79,8 +80,10 @@ async def chat_loop():
     print(" Type 'quit' to exit.")
     print("="*50 + "\n")
 
-    # 2. State Management (Client-Side History)
-    history = []
+    # 2. State Management: the hub pins this session to one agent, which keeps
+    # the conversation, so each turn only sends the new message.
+    session_id = f"chat-{uuid.uuid4().hex[:8]}"
+    first_turn = True
     
     async with SwarmClient(port=HUB_PORT) as client:
         while True:
@@ -92,26 +95,17 @@ async def chat_loop():
             if user_text.lower() in ["quit", "exit"]:
                 break
             
-            # 3. Construct Context-Aware Prompt
-            formatted_history = "\n".join([f"{role}: {msg}" for role, msg in history])
-            full_prompt = f"System: You are a helpful, witty AI assistant. Keep answers concise.\n\n{formatted_history}\nUser: {user_text}\nAssistant:"
+            # 3. Persona goes with the first turn; the agent carries it forward
+            full_prompt = user_text
+            if first_turn:
+                full_prompt = f"System: You are a helpful, witty AI assistant. Keep answers concise.\n\n{user_text}"
             
             try:
                 # 4. Execute Task
                 done_event = asyncio.Event()
                 spinner_task = asyncio.create_task(typing_animation(done_event))
 
-                task_id = await client.add_task(full_prompt, task_type="chat")
-                
-                # Poll for result
-                result = None
-                while result is None:
-                    await asyncio.sleep(0.5)
-                    status = await client._send_request("list", {"limit": 1})
-                    for t in status.get('tasks', []):
-                        if t['task_id'] == task_id and t['status'] == 'done':
-                            result = t['result']
-                            break
+                result = await client.run(full_prompt, task_type="chat", session_id=session_id)
                 
                 # Stop spinner
                 done_event.set()
@@ -119,9 +113,7 @@ async def chat_loop():
                 
                 print(f"\033[1mBot\033[0m: {result}\n")
                 
-                # 5. Update State
-                history.append(("User", user_text))
-                history.append(("Assistant", result))
+                first_turn = False
                 
             except Exception as e:
                 print(f"Error: {e}")
@@ -67,12 +67,13 @@ class SieveWorker:
         print(f"[{self.name}] Started (Specialized Data Filter).")
         while True:
             try:
-                # 1. Lease task
-                resp = self.client.call("lease", {"worker_id": self.worker_id, "max_tasks": 1, "lease_seconds": 60})
+                # 1. Lease task (blocks at the hub until work arrives)
+                resp = self.client.call(
+                    "lease", {"worker_id": self.worker_id, "max_tasks": 1, "lease_seconds": 60, "wait_seconds": 20}
+                )
                 tasks = resp.get("tasks", [])
                 
                 if not tasks:
-                    time.sleep(1)
                     continue
                     
                 task = tasks[0]
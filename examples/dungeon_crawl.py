@@ -157,15 +157,8 @@ Current Context: {system_context}
 [RESPONSE]
 (Write the narration or dialogue below)
 """
-    task_id = await client.add_task(full_prompt, task_type="game")
-    
-    # Poll
-    while True:
-        await asyncio.sleep(0.3)
-        status = await client._send_request("list", {"limit": 5}) 
-        for t in status.get('tasks', []):
-            if t['task_id'] == task_id and t['status'] == 'done':
-                return t['result']
+    # One round trip: the hub replies as soon as the Game Master acks
+    return await client.run(full_prompt, task_type="game")
 
 # ---------------- MAIN LOOP ----------------
 
@@ -59,7 +59,8 @@ async def monitor_loop():
                 # Fast Handoff: Enqueue task for the 'Trader' agent
                 task_id = await client.add_task(
                     prompt=f"EXECUTE BUY ORDER: BTC @ {price:.2f}", 
-                    task_type="chat"
+                    task_type="chat",
+                    ttl_seconds=30  # A stale buy signal must never be executed
                 )
                 print(f">> [INTERNAL TOOL] Signal sent! Task ID: {task_id}")
                 return f"OPPORTUNITY DETECTED at {price:.2f}. Handoff to Task {task_id}"
@@ -136,15 +137,12 @@ async def run_demo():
         # This simulates the Monitor Agent deciding to run a tool, or being tasked to run a script.
         # In this demo, we bypass the LLM "writing" the script and just inject it for speed.
         
-        # Note: We must ensure we target the monitor_bot or just rely on first available.
-        # Since we don't have task-affinity yet in Hub (lease filtering), 
-        # we assume probabilistic assignment or just that any agent can do it.
-        # Ideally, we'd have `target_worker_id` in enqueue. 
-        # For now, we utilize the fact that Kiro supports Python tasks.
+        # Targeted at monitor_bot so the Trader never picks up the long-running loop.
         
         monitor_task_id = await client._send_request("enqueue", {
             "prompt": MONITOR_TOOL_CODE,
             "type": "python", # EXECUTE THIS CODE
+            "target_worker": "monitor_bot",
             "context": {}
         })
         logger.info(f"Monitor Task {monitor_task_id['task_id']} enqueued.")
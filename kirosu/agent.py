@@ -1,30 +1,108 @@
 from __future__ import annotations
 
-import json
 import logging
 import os
 import socket
 import subprocess
 import time
 import uuid
-from typing import Any
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
 
+from . import transport
+from .auth import LEGACY_REFUSED, legacy_allowed, sign
+from .backpressure import busy_error
+from .codec import FRAME_HEADER, JSONL, get_codec, offer
 from .config import get_agent_config
 
 
+class HubBatch:
+    """Calls collected by ``HubClient.batch()``; each returns a Future for its result."""
+
+    def __init__(self) -> None:
+        self.calls: list[tuple[str, dict[str, Any] | None, Future]] = []
+
+    def call(self, method: str, params: dict[str, Any] | None = None) -> Future:
+        future: Future = Future()
+        self.calls.append((method, params, future))
+        return future
+
+
 class HubClient:
-    def __init__(self, host: str, port: int):
+    def __init__(self, host: str, port: int, codec: str | None = None, legacy_auth: bool | None = None):
+        """
+        ``codec`` picks the wire format negotiated on connect ("jsonl",
+        "json" or "msgpack"); by default the fastest one installed, or
+        $KIRO_SWARM_CODEC. ``legacy_auth`` (default $KIRO_SWARM_LEGACY_AUTH)
+        lets the client send its key with every request to a hub predating
+        the auth handshake; otherwise such a hub is refused.
+        """
         self.host = host
         self.port = port
         self.sock = None
-        self.f = None
+        self._buf = bytearray()
         self.auth_token = os.environ.get("KIRO_SWARM_KEY")
+        # Token the current connection authenticated with, and whether the
+        # hub predates the auth handshake and wants the token on every request
+        self._connected_token: str | None = None
+        self._legacy_auth = False
+        self.allow_legacy_auth = legacy_allowed() if legacy_auth is None else legacy_auth
+        self.codecs = offer(codec)
+        self.codec = JSONL
+        # Pushed task events (from subscribe) that arrived while reading replies
+        self.events: deque[dict[str, Any]] = deque()
 
     def _connect(self):
+        if self.sock and self.auth_token != self._connected_token:
+            # A connection stays authenticated as whoever it first proved to be
+            self._disconnect()
         if self.sock:
             return
-        self.sock = socket.create_connection((self.host, self.port))
-        self.f = self.sock.makefile("r")
+        self.sock = transport.connect(self.host, self.port)
+        self._buf = bytearray()
+        self.codec = JSONL
+        self._connected_token = self.auth_token
+        self._legacy_auth = False
+        if self.codecs:
+            self._hello()
+        if self.auth_token:
+            self._authenticate()
+
+    def _handshake(self, method: str, params: dict[str, Any]) -> dict[str, Any]:
+        """One request/reply on a fresh connection, before anything else is in flight."""
+        req = {"id": str(uuid.uuid4()), "method": method, "params": params}
+        self.sock.sendall(self.codec.pack(req))
+        while True:
+            resp = self._recv()
+            if resp is None:
+                self._disconnect()
+                raise ConnectionError(f"Hub closed the connection during {method}")
+            if resp.get("id") == req["id"]:
+                return resp
+
+    def _hello(self) -> None:
+        resp = self._handshake("hello", {"codecs": self.codecs})
+        # A hub predating codecs answers "Unknown method"; stay on JSONL
+        if not resp.get("error"):
+            self.codec = get_codec(resp["result"]["codec"])
+
+    def _authenticate(self) -> None:
+        challenge = self._handshake("auth", {})
+        if challenge.get("error"):
+            # A hub predating the handshake only takes the token with each request
+            if not self.allow_legacy_auth:
+                self._disconnect()
+                raise RuntimeError(LEGACY_REFUSED)
+            self._legacy_auth = True
+            return
+        if "nonce" not in challenge["result"]:
+            return  # The hub runs without a key
+        resp = self._handshake("auth", {"mac": sign(self.auth_token, challenge["result"]["nonce"])})
+        if resp.get("error"):
+            self._disconnect()
+            raise RuntimeError(f"Hub error: {resp['error']}")
 
     def _disconnect(self):
         if self.sock:
@@ -33,53 +111,248 @@ class HubClient:
             except Exception:
                 pass
             self.sock = None
-            self.f = None
+            self._buf = bytearray()
 
-    def call(self, method: str, params: dict[str, Any] | None = None) -> Any:
-        req_id = str(uuid.uuid4())
-        params = params or {}
-        if self.auth_token:
-            params["auth_token"] = self.auth_token
-            
-        req = {"id": req_id, "method": method, "params": params}
-        
+    def _fill(self, deadline: float | None) -> bool:
+        """Read more from the hub into the buffer; False once it has closed."""
+        if deadline is not None:
+            self.sock.settimeout(max(deadline - time.monotonic(), 0.001))
+        try:
+            chunk = self.sock.recv(1 << 20)
+        finally:
+            self.sock.settimeout(None)
+        self._buf += chunk
+        return bool(chunk)
+
+    def _recv(self, deadline: float | None = None) -> Any:
+        """Next message from the hub, None once it closes; socket.timeout past ``deadline``."""
+        if not self.codec.framed:
+            scanned = 0
+            while (end := self._buf.find(b"\n", scanned)) < 0:
+                scanned = len(self._buf)
+                if not self._fill(deadline):
+                    return None
+            line = bytes(self._buf[:end])
+            del self._buf[:end + 1]
+            return self.codec.loads(line)
+        while len(self._buf) < FRAME_HEADER.size:
+            if not self._fill(deadline):
+                return None
+        (size,) = FRAME_HEADER.unpack_from(self._buf)
+        end = FRAME_HEADER.size + size
+        while len(self._buf) < end:
+            if not self._fill(deadline):
+                return None
+        payload = bytes(self._buf[FRAME_HEADER.size:end])
+        del self._buf[:end]
+        return self.codec.loads(payload)
+
+    def _exchange(self, payload: Any, is_reply: Callable[[Any], bool]) -> Any:
+        """Send one line and return the first message ``is_reply`` accepts, buffering events."""
         # Simple retry logic for persistent connection
         for attempt in range(2):
             try:
                 self._connect()
-                if not self.sock or not self.f:
+                if not self.sock:
                     raise RuntimeError("Failed to connect")
                     
-                self.sock.sendall((json.dumps(req) + "\n").encode("utf-8"))
-                line = self.f.readline()
-                if not line:
-                    self._disconnect()
-                    if attempt == 0:
-                        continue # Reconnect and retry
-                    raise RuntimeError("Empty response from hub")
-                    
-                resp = json.loads(line)
-                if resp.get("error"):
-                    raise RuntimeError(f"Hub error: {resp['error']}")
-                return resp["result"]
+                self.sock.sendall(self.codec.pack(payload))
+                draining = False
+                while True:
+                    resp = self._recv()
+                    if resp is None:
+                        break
+                    if isinstance(resp, dict) and resp.get("id") is None and "event" in resp:
+                        if resp["event"] == "shutdown":
+                            # The hub still answers what it has read; the next
+                            # call reconnects, to whichever hub replaced it
+                            draining = True
+                        else:
+                            self.events.append(resp)
+                        continue
+                    if is_reply(resp):
+                        if draining:
+                            self._disconnect()
+                        return resp
+                self._disconnect()
+                if attempt == 0:
+                    continue # Reconnect and retry
+                raise ConnectionError("Empty response from hub")
             except (BrokenPipeError, ConnectionResetError):
                 self._disconnect()
                 if attempt == 0:
                     continue
                 raise
 
+    def _request(self, method: str, params: dict[str, Any] | None) -> dict[str, Any]:
+        params = params or {}
+        if self._legacy_auth and self.auth_token:
+            params = {**params, "auth_token": self.auth_token}
+        return {"id": str(uuid.uuid4()), "method": method, "params": params}
+
+    def call(self, method: str, params: dict[str, Any] | None = None) -> Any:
+        self._connect()
+        req = self._request(method, params)
+        resp = self._exchange(req, lambda r: isinstance(r, dict) and r.get("id") == req["id"])
+        if resp.get("error"):
+            raise busy_error(resp["error"], "Hub error") or RuntimeError(f"Hub error: {resp['error']}")
+        return resp["result"]
+
+    @contextmanager
+    def batch(self) -> Iterator[HubBatch]:
+        """
+        Collect calls and send them as one JSON array when the block exits:
+
+            with client.batch() as batch:
+                queued = batch.call("enqueue", {"prompt": "hi"})
+                stats = batch.call("stats")
+            queued.result()["task_id"]
+
+        Store calls in a batch share one hub transaction, but each succeeds
+        or fails on its own; ``result()`` raises that call's error.
+        """
+        batch = HubBatch()
+        yield batch
+        if not batch.calls:
+            return
+        self._connect()
+        reqs = [self._request(method, params) for method, params, _ in batch.calls]
+        resps = self._exchange(reqs, lambda r: isinstance(r, list))
+        by_id = {r.get("id"): r for r in resps}
+        for req, (_, _, future) in zip(reqs, batch.calls):
+            resp = by_id.get(req["id"]) or {"error": "No response in batch"}
+            if resp.get("error"):
+                future.set_exception(busy_error(resp["error"], "Hub error") or RuntimeError(f"Hub error: {resp['error']}"))
+            else:
+                future.set_result(resp["result"])
+
+    def run(self, prompt: str, timeout: float = 300, **params: Any) -> str:
+        """
+        Enqueue a task and block until it finishes, in one round trip; returns
+        its result. Extra ``params`` are enqueue parameters (type, queue,
+        session_id, ...). Raises RuntimeError if the task fails or times out.
+        """
+        task = self.call("run", {**params, "prompt": prompt, "timeout": timeout})["task"]
+        if task["status"] != "done":
+            raise RuntimeError(f"Task {task['task_id']} {task['status']}: {task.get('error')}")
+        return task["result"]
+
+    def subscribe(
+        self,
+        task_ids: list[int] | None = None,
+        job: str | None = None,
+        queue: str | None = None,
+        status: list[str] | None = None,
+    ) -> str:
+        """
+        Ask the hub to push state changes of matching tasks over this
+        connection; read them with ``next_event``. Subscriptions end with the
+        connection, so a reconnect inside ``call`` drops them.
+        """
+        params: dict[str, Any] = {"job": job, "queue": queue, "status": status}
+        if task_ids is not None:
+            params["task_ids"] = list(task_ids)
+        return self.call("subscribe", params)["subscription"]
+
+    def unsubscribe(self, subscription: str) -> None:
+        self.call("unsubscribe", {"subscription": subscription})
+
+    def next_event(self, timeout: float | None = None) -> dict[str, Any] | None:
+        """The next pushed event, or None if none arrives within ``timeout``."""
+        if self.events:
+            return self.events.popleft()
+        if not self.sock:
+            raise RuntimeError("Not subscribed")
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            try:
+                msg = self._recv(deadline)
+            except socket.timeout:
+                return None
+            if msg is None:
+                self._disconnect()
+                raise ConnectionError("Hub closed the connection")
+            if isinstance(msg, dict) and msg.get("id") is None and "event" in msg:
+                if msg["event"] == "shutdown":
+                    self._disconnect()
+                    raise ConnectionError("Hub is shutting down")
+                return msg
+
 
 from .config import get_agent_config, load_mcp_config
 from .providers import get_provider
 
+
+class SessionCache:
+    """
+    Conversation turns per session, least recently used evicted first.
+
+    Each entry records how many turns of the session the hub will have seen
+    finished once this worker's last turn is acked. A lease reports the
+    hub's count (``session_turns``); a higher count means another worker
+    served turns in between (the session failed over and came back), so the
+    entry is stale. Hubs that do not report the count fall back to treating
+    entries idle longer than ``idle_seconds`` as stale.
+    """
+
+    def __init__(self, capacity: int = 64, idle_seconds: float = 30.0, max_turns: int = 20):
+        self.capacity = capacity
+        self.idle_seconds = idle_seconds
+        self.max_turns = max_turns
+        self._data: OrderedDict[str, dict[str, Any]] = OrderedDict()
+
+    def get(self, session_id: str, hub_turns: int | None = None) -> list[tuple[str, str]] | None:
+        entry = self._data.get(session_id)
+        if entry is None:
+            return None
+        if hub_turns is not None and entry["finished"] is not None:
+            stale = hub_turns > entry["finished"]
+        else:
+            stale = time.monotonic() - entry["touched"] > self.idle_seconds
+        if stale:
+            self._data.pop(session_id, None)
+            return None
+        self._data.move_to_end(session_id)
+        return entry["turns"]
+
+    def put(self, session_id: str, turns: list[tuple[str, str]], finished: int | None = None) -> None:
+        """Cache ``turns``; ``finished`` is the hub's turn count once the last of them is acked."""
+        self._data[session_id] = {"turns": turns[-self.max_turns:], "touched": time.monotonic(), "finished": finished}
+        self._data.move_to_end(session_id)
+        while len(self._data) > self.capacity:
+            self._data.popitem(last=False)
+
+
 class KiroAgent:
-    def __init__(self, host: str, port: int, model: str | None = None, workdir: str | None = None, agent_name: str | None = None):
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        model: str | None = None,
+        workdir: str | None = None,
+        agent_name: str | None = None,
+        batch_size: int = 1,
+        groups: list[str] | None = None,
+        lease_wait: float = 20.0,
+        ack_retry_seconds: float = 60.0,
+    ):
         self.client = HubClient(host, port)
-        self.worker_id = f"kiro-{uuid.uuid4().hex[:8]}"
+        # A named agent leases under its name so tasks can be targeted at it
+        self.worker_id = agent_name or f"kiro-{uuid.uuid4().hex[:8]}"
+        # Tasks leased per round trip; results are acked together via ack_many
+        self.batch_size = max(1, batch_size)
+        # Finished results the hub has not accepted yet (e.g. mid restart),
+        # retried for up to ack_retry_seconds per flush and before each lease
+        self.unacked: list[dict[str, Any]] = []
+        self.ack_retry_seconds = ack_retry_seconds
         
         # Load config
         config = get_agent_config(agent_name) if agent_name else {}
         self.mcp_config = load_mcp_config()
+        # Seconds each lease may block at the hub waiting for work (0 = plain polling)
+        self.lease_wait = lease_wait
+        # Worker groups this agent serves, for tasks enqueued with target_group
+        self.groups = list(groups or config.get("groups") or [])
         
         self.model = model or config.get("model") or os.environ.get("MITTELO_KIRO_MODEL", "claude-haiku-4.5")
         self.workdir = workdir or config.get("workdir")
@@ -87,6 +360,10 @@ class KiroAgent:
         # Initialize Provider
         provider_name = os.environ.get("KIRO_PROVIDER")
         self.provider = get_provider(provider_name, self.model)
+        # Reported on lease so the hub can apply per provider/model rate limits
+        self.provider_name = provider_name or "kiro"
+        # Warm conversation state for sessions the hub pins to this worker
+        self.sessions = SessionCache()
 
     def run_loop(self, poll_interval: float = 1.0, log_file: str | None = None, verbose: bool = False):
         level = logging.DEBUG if verbose else logging.INFO
@@ -100,22 +377,85 @@ class KiroAgent:
             handlers=handlers,
             force=True
         )
-        logging.info(f"Agent {self.worker_id} started. Connecting to {self.client.host}:{self.client.port}")
+        logging.info(f"Agent {self.worker_id} started. Connecting to {transport.describe(self.client.host, self.client.port)}")
         while True:
+            # A long-poll lease already waited at the hub; only back off on errors
+            delay = 0.0 if self.lease_wait > 0 else poll_interval
             try:
-                self._tick()
+                started = time.monotonic()
+                leased = self._tick()
+                # ...unless it came back empty early (an older hub ignoring
+                # wait_seconds, or a draining one), which would otherwise spin
+                if not leased and time.monotonic() - started < self.lease_wait / 2:
+                    delay = poll_interval
             except Exception as e:
                 logging.error(f"Error in agent loop: {e}")
-            time.sleep(poll_interval)
+                delay = poll_interval
+            time.sleep(delay)
 
-    def _tick(self):
-        # Lease 1 task
-        resp = self.client.call("lease", {"worker_id": self.worker_id, "max_tasks": 1, "lease_seconds": 300})
+    def _tick(self) -> int:
+        """Lease, run and ack one batch; returns how many tasks were leased."""
+        if self.unacked:
+            self._flush_acks([])  # Results held from a hub that went away come first
+        params: dict[str, Any] = {
+            "worker_id": self.worker_id,
+            "max_tasks": self.batch_size,
+            "lease_seconds": 300,
+            "provider": self.provider_name,
+            "model": self.model,
+        }
+        if self.groups:
+            params["groups"] = self.groups
+        if self.lease_wait > 0:
+            params["wait_seconds"] = self.lease_wait
+        resp = self.client.call("lease", params)
         tasks = resp.get("tasks", [])
         if not tasks:
-            return
+            return 0
 
-        task = tasks[0]
+        acks: list[dict[str, Any]] = []
+        try:
+            for task in tasks:
+                acks.append(self._process(task))
+        finally:
+            # Results first, so a failed release cannot cost finished work a re-run
+            try:
+                self._flush_acks(acks)
+            finally:
+                # Anything we leased but never got to goes straight back to the queue
+                unprocessed = [t["task_id"] for t in tasks[len(acks):]]
+                if unprocessed:
+                    self.client.call("release_many", {"task_ids": unprocessed, "worker_id": self.worker_id})
+                    logging.info(f"Released {len(unprocessed)} unprocessed task(s)")
+        return len(tasks)
+
+    def _flush_acks(self, acks: list[dict[str, Any]]) -> None:
+        """
+        Send results, and any held from earlier, to the hub. While it cannot
+        be reached (a rolling restart) they are retried with backoff over a
+        fresh connection; past ``ack_retry_seconds`` they stay held and the
+        error is raised.
+        """
+        self.unacked.extend(acks)
+        delay = 0.1
+        deadline = time.monotonic() + self.ack_retry_seconds
+        while self.unacked:
+            try:
+                if len(self.unacked) == 1:
+                    self.client.call("ack", self.unacked[0])
+                else:
+                    self.client.call("ack_many", {"acks": self.unacked})
+                self.unacked = []
+            except OSError as e:
+                self.client._disconnect()
+                if time.monotonic() + delay > deadline:
+                    logging.warning(f"Hub unreachable ({e}); holding {len(self.unacked)} result(s)")
+                    raise
+                time.sleep(delay)
+                delay = min(delay * 2, 5.0)
+
+    def _process(self, task: dict[str, Any]) -> dict[str, Any]:
+        """Execute a leased task and return its ack payload."""
         task_id = task["task_id"]
         prompt = task["prompt"]
         system_prompt = task.get("system_prompt")
@@ -134,20 +474,50 @@ class KiroAgent:
         
         logging.info(f"Leased task {task_id} ({task_type}): {prompt[:50]}...")
         
+        session_id = task.get("session_id")
+        timings: dict[str, float] = {"started_at": time.time()}
         try:
             if task_type == "python":
                 result = self._run_python(prompt)
             else:
-                # Use Provider
-                result = self.provider.run(prompt, system_prompt, self.workdir)
+                hub_turns = task.get("session_turns")
+                turns = self._session_turns(session_id, task_id, hub_turns) if session_id else []
+                # Use Provider (timed separately so the hub can split provider latency from overhead)
+                provider_start = time.perf_counter()
+                result = self.provider.run(self._with_history(turns, prompt), system_prompt, self.workdir)
+                timings["provider_time_sec"] = round(time.perf_counter() - provider_start, 6)
+                if session_id:
+                    finished = hub_turns + 1 if hub_turns is not None else None
+                    self.sessions.put(session_id, [*turns, (prompt, result)], finished)
                 
-            self.client.call("ack", {"task_id": task_id, "status": "done", "result": result})
             logging.info(f"Task {task_id} done.")
             logging.debug(f"Task {task_id} result:\n{result}")
+            return {"task_id": task_id, "status": "done", "result": result, **timings}
         except Exception as e:
             error_msg = str(e)
-            self.client.call("ack", {"task_id": task_id, "status": "failed", "error": error_msg})
             logging.error(f"Task {task_id} failed: {error_msg}")
+            return {"task_id": task_id, "status": "failed", "error": error_msg, **timings}
+
+    def _session_turns(self, session_id: str, task_id: int, hub_turns: int | None = None) -> list[tuple[str, str]]:
+        """Prior turns of a session: from the local cache, or rebuilt from the hub when cold or stale."""
+        turns = self.sessions.get(session_id, hub_turns)
+        if turns is not None:
+            return turns
+        history = self.client.call("session_history", {"session_id": session_id, "limit": self.sessions.max_turns + 1})
+        turns = [
+            (t["prompt"], t["result"])
+            for t in history.get("tasks", [])
+            if t["task_id"] < task_id and t["status"] == "done" and t.get("result") is not None
+        ]
+        logging.info(f"Session {session_id}: rebuilt {len(turns)} turn(s) from hub")
+        return turns[-self.sessions.max_turns:]
+
+    @staticmethod
+    def _with_history(turns: list[tuple[str, str]], prompt: str) -> str:
+        if not turns:
+            return prompt
+        transcript = "\n".join(f"User: {user}\nAssistant: {reply}" for user, reply in turns)
+        return f"{transcript}\nUser: {prompt}\nAssistant:"
 
     def _run_python(self, code: str) -> str:
         # DANGEROUS: Runs arbitrary Python code
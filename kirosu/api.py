@@ -1,12 +1,17 @@
+import math
 import os
 import logging
 from typing import Any, Optional
 from fastapi import FastAPI, HTTPException, Header, Depends
+from fastapi.responses import JSONResponse, ORJSONResponse
 from pydantic import BaseModel
 
 from .agent import HubClient
+from .backpressure import HubBusyError
+from .codec import orjson
 
-app = FastAPI(title="Kiro Swarm API")
+# Task lists carry full prompts and results; let orjson render them when installed
+app = FastAPI(title="Kiro Swarm API", default_response_class=ORJSONResponse if orjson else JSONResponse)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -45,13 +50,23 @@ async def create_task(task: TaskRequest, token: str = Depends(verify_token)):
             "type": task.type
         })
         return TaskResponse(task_id=resp["task_id"])
+    except HubBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/tasks")
-async def list_tasks(status: Optional[str] = None, limit: int = 50, token: str = Depends(verify_token)):
+async def list_tasks(
+    status: Optional[str] = None,
+    limit: int = 50,
+    q: Optional[str] = None,
+    cursor: Optional[int] = None,
+    token: str = Depends(verify_token),
+):
     client = get_client()
     try:
+        if q:
+            return client.call("search", {"query": q, "status": status, "limit": limit, "cursor": cursor})
         resp = client.call("list", {"status": status, "limit": limit})
         return resp
     except Exception as e:
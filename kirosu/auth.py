@@ -0,0 +1,47 @@
+"""
+Connection authentication for hubs running with KIRO_SWARM_KEY.
+
+A client authenticates a connection once, by challenge and response: an
+``auth`` request without params returns a fresh ``nonce``; the client
+answers with ``{"mac": sign(key, nonce)}``, an HMAC-SHA256 of the nonce
+under the shared key, so the key itself never crosses the wire. Later
+requests on that connection carry no credentials. Each nonce is good for a
+single attempt, and a failed attempt leaves the connection unauthenticated.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import hmac
+import os
+import secrets
+
+NONCE_BYTES = 32
+
+# Clients only fall back to sending the key with every request (hubs that
+# predate the handshake) when this is set, since the key then travels in clear
+LEGACY_ENV = "KIRO_SWARM_LEGACY_AUTH"
+LEGACY_REFUSED = (
+    f"Hub does not support the auth handshake; set {LEGACY_ENV}=1 to send the key with every request instead"
+)
+
+
+def legacy_allowed() -> bool:
+    return os.environ.get(LEGACY_ENV, "").lower() in {"1", "true", "yes"}
+
+
+def new_nonce() -> str:
+    return secrets.token_hex(NONCE_BYTES)
+
+
+def sign(key: str, nonce: str) -> str:
+    return hmac.new(key.encode("utf-8"), b"kirosu-auth:" + nonce.encode("ascii"), hashlib.sha256).hexdigest()
+
+
+def verify(key: str, nonce: str, mac: object) -> bool:
+    return isinstance(mac, str) and hmac.compare_digest(sign(key, nonce), mac)
+
+
+def token_matches(key: str, token: object) -> bool:
+    """Constant-time check of a legacy per-request ``auth_token``."""
+    return isinstance(token, str) and hmac.compare_digest(key.encode("utf-8"), token.encode("utf-8"))
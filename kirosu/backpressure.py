@@ -0,0 +1,74 @@
+"""
+Backpressure between producers and the hub.
+
+A hub with queue-depth limits refuses enqueues past them with a retryable
+"busy" error carrying a ``retry_after`` hint in seconds, rather than letting
+a runaway producer grow the queue without bound. Clients raise it as
+``HubBusyError`` and pace further submissions with a ``Pacer``.
+"""
+
+from __future__ import annotations
+
+import random
+import time
+from typing import Any, Callable
+
+BUSY = "busy"
+
+
+class HubBusyError(RuntimeError):
+    """The hub refused work for now; try again after ``retry_after`` seconds."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def busy_error(error: Any, prefix: str) -> HubBusyError | None:
+    """The HubBusyError a reply's ``error`` stands for, if it is a busy error."""
+    if isinstance(error, dict) and error.get("code") == BUSY:
+        return HubBusyError(f"{prefix}: {error}", float(error.get("retry_after") or 1.0))
+    return None
+
+
+class Pacer:
+    """
+    Spaces out submissions to a hub that pushes back, AIMD style.
+
+    ``wait()`` returns how long to sleep before the next send, handing out
+    send slots ``interval`` apart so concurrent senders queue up rather than
+    firing together. A busy answer holds every sender until its retry-after
+    hint has passed (plus jitter, so a fleet of producers does not retry in
+    lockstep) and doubles the interval; each accepted send shrinks it again
+    until sends go out unpaced.
+    """
+
+    MIN_INTERVAL = 0.005
+
+    def __init__(
+        self,
+        max_interval: float = 5.0,
+        jitter: float = 0.2,
+        clock: Callable[[], float] = time.monotonic,
+        rng: Callable[[], float] = random.random,
+    ):
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.interval = 0.0
+        self._clock = clock
+        self._rng = rng
+        self._next_slot = 0.0
+
+    def wait(self) -> float:
+        now = self._clock()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+        return slot - now
+
+    def busy(self, retry_after: float) -> None:
+        resume = self._clock() + retry_after * (1 + self.jitter * self._rng())
+        self._next_slot = max(self._next_slot, resume)
+        self.interval = min(self.max_interval, max(self.interval * 2, self.MIN_INTERVAL))
+
+    def ok(self) -> None:
+        self.interval = self.interval * 0.75 if self.interval > self.MIN_INTERVAL else 0.0
@@ -20,12 +20,24 @@ def main() -> NoReturn:
     # Dispatch to handlers
     if args.command == "hub":
         hub.handle(args)
+    elif args.command == "backup":
+        hub.handle_backup(args)
     elif args.command == "agent":
         agent.handle(args)
     elif args.command == "enqueue":
         task.handle_enqueue(args)
     elif args.command == "status":
         task.handle_status(args)
+    elif args.command == "search":
+        task.handle_search(args)
+    elif args.command == "latency":
+        task.handle_latency(args)
+    elif args.command == "deadlines":
+        task.handle_deadlines(args)
+    elif args.command == "tenants":
+        task.handle_tenants(args)
+    elif args.command == "rate-limit":
+        task.handle_rate_limit(args)
     elif args.command == "approve":
         task.handle_approve(args)
     elif args.command == "dashboard":
@@ -1,75 +1,507 @@
 import asyncio
-import json
 import logging
+import os
 import uuid
 import time
-from typing import Dict, Any, Optional
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Any, List, Optional, Tuple
+
+from . import transport
+from .auth import LEGACY_REFUSED, legacy_allowed, sign
+from .backpressure import HubBusyError, Pacer, busy_error
+from .codec import FRAME_HEADER, JSONL, Codec, get_codec, offer
 
 logger = logging.getLogger("SwarmClient")
 
+# Calls that are safe to send again after a reconnect: they only read, or
+# repeating them leaves the hub in the same state
+IDEMPOTENT_METHODS = frozenset({
+    "ping", "get_tasks", "list", "search", "stats", "tenants", "latency_report",
+    "session_history", "deadline_report", "cancel", "release_many",
+    "set_tenant_weight", "set_rate_limit", "set_queue_limit",
+})
+# Calls the hub may refuse as busy; retried with adaptive pacing
+PACED_METHODS = frozenset({"enqueue", "run"})
+RECONNECT_DELAYS = (0.1, 0.5, 2.0)
+# Replies such as a large "list" far exceed asyncio's 64 KiB default
+READ_LIMIT = 64 * 1024 * 1024
+
+# Queued to subscribers when the connection (and so their subscription) is lost
+_LOST = object()
+
+
+class RequestBatch:
+    """Calls collected by ``SwarmClient.batch()``; each returns a future for its result."""
+
+    def __init__(self) -> None:
+        self.calls: List[Tuple[str, Dict[str, Any], asyncio.Future]] = []
+
+    def call(self, method: str, params: Optional[Dict[str, Any]] = None) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self.calls.append((method, params or {}, future))
+        return future
+
+
 class SwarmClient:
     """
-    A simple async client to interact with the Kirosu Hub via TCP/JSONL.
+    An async client to interact with the Kirosu Hub via TCP/JSONL.
+
+    Requests are multiplexed over one connection: a background reader
+    resolves each call by its ``id`` and routes pushed events to their
+    subscription, so any number of coroutines may share a client. If the
+    connection drops, outstanding idempotent calls are resent on a new one
+    and the rest fail with ConnectionError.
+
+    ``codec`` picks the wire format negotiated on connect ("jsonl", "json"
+    or "msgpack"); by default the fastest one installed, or $KIRO_SWARM_CODEC.
+    With ``auth_token`` (default $KIRO_SWARM_KEY) each connection
+    authenticates once on connect, by HMAC challenge. A hub predating the
+    handshake is refused unless ``legacy_auth`` (default
+    $KIRO_SWARM_LEGACY_AUTH) allows sending the key with every request.
+
+    When the hub refuses tasks as busy (queue-depth limits), ``add_task``
+    and ``run`` wait as advised and retry for up to ``busy_timeout``
+    seconds, pacing every coroutine sharing the client, then raise
+    HubBusyError.
     """
-    def __init__(self, host: str = "127.0.0.1", port: int = 8765):
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8765,
+        codec: Optional[str] = None,
+        busy_timeout: float = 60.0,
+        legacy_auth: Optional[bool] = None,
+    ):
+        # host may be unix:///path/to/hub.sock for a hub on a Unix socket
         self.host = host
         self.port = port
+        self.codecs = offer(codec)
+        self.codec: Codec = JSONL
+        self.auth_token: Optional[str] = os.environ.get("KIRO_SWARM_KEY")
+        # Set against a hub predating the auth handshake: token on every request
+        self._legacy_auth = False
+        self.allow_legacy_auth = legacy_allowed() if legacy_auth is None else legacy_auth
+        self.busy_timeout = busy_timeout
+        self.pacer = Pacer()
         self.reader = None
         self.writer = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._connect_lock = asyncio.Lock()
+        # Request id -> (future, method, params) for calls awaiting a reply
+        self._pending: Dict[str, Tuple[asyncio.Future, str, Dict[str, Any]]] = {}
+        # Subscribe calls whose events go to a private queue, by request id
+        self._sinks: Dict[str, asyncio.Queue] = {}
+        self._subscriptions: Dict[str, asyncio.Queue] = {}
+        # Events of subscriptions made through subscribe(), read with next_event
+        self._events: asyncio.Queue = asyncio.Queue()
+        self._closed = False
 
     async def connect(self):
-        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
-        logger.debug("Connected to Hub")
+        async with self._connect_lock:
+            if self.writer is not None:
+                return
+            reader, writer = await transport.open_connection(self.host, self.port, limit=READ_LIMIT)
+            codec = await self._hello(reader, writer) if self.codecs else JSONL
+            legacy_auth = await self._authenticate(reader, writer, codec) if self.auth_token else False
+            self.reader, self.writer, self.codec = reader, writer, codec
+            self._legacy_auth = legacy_auth
+            self._closed = False
+            self._reader_task = asyncio.create_task(self._read_loop(reader, codec))
+            logger.debug(f"Connected to Hub ({codec.name})")
 
-    async def _send_request(self, method: str, params: Dict[str, Any]) -> Any:
-        if not self.writer:
-            await self.connect()
-        
+    @staticmethod
+    async def _read_message(reader: asyncio.StreamReader, codec: Codec) -> Any:
+        """Next message from the hub in ``codec``; None once it closes."""
+        if codec.framed:
+            try:
+                header = await reader.readexactly(FRAME_HEADER.size)
+            except asyncio.IncompleteReadError:
+                return None
+            (size,) = FRAME_HEADER.unpack(header)
+            return codec.loads(await reader.readexactly(size))
+        line = await reader.readline()
+        return codec.loads(line) if line else None
+
+    async def _handshake(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, codec: Codec, method: str, params: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """One request/reply on a fresh connection; runs before the reader task exists."""
         req_id = str(uuid.uuid4())
+        writer.write(codec.pack({"jsonrpc": "2.0", "method": method, "params": params, "id": req_id}))
+        await writer.drain()
+        while True:
+            resp = await self._read_message(reader, codec)
+            if resp is None:
+                writer.close()
+                raise ConnectionError(f"Hub closed the connection during {method}")
+            if resp.get("id") == req_id:
+                return resp
+
+    async def _hello(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> Codec:
+        """Negotiate the wire codec."""
+        resp = await self._handshake(reader, writer, JSONL, "hello", {"codecs": self.codecs})
+        # A hub predating codecs answers "Unknown method"; stay on JSONL
+        return JSONL if resp.get("error") else get_codec(resp["result"]["codec"])
+
+    async def _authenticate(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, codec: Codec) -> bool:
+        """Prove the key to the hub; True if it predates the handshake and wants per-request tokens."""
+        challenge = await self._handshake(reader, writer, codec, "auth", {})
+        if challenge.get("error"):
+            if not self.allow_legacy_auth:
+                writer.close()
+                raise RuntimeError(LEGACY_REFUSED)
+            return True
+        if "nonce" in challenge["result"]:
+            resp = await self._handshake(reader, writer, codec, "auth", {"mac": sign(self.auth_token, challenge["result"]["nonce"])})
+            if resp.get("error"):
+                writer.close()
+                raise RuntimeError(f"RPC Error: {resp['error']}")
+        return False
+
+    def _params(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        if self._legacy_auth:
+            return {**params, "auth_token": self.auth_token}
+        return params
+
+    def _write(self, req_id: str, method: str, params: Dict[str, Any]) -> None:
         req = {
             "jsonrpc": "2.0",
             "method": method,
-            "params": params,
+            "params": self._params(params),
             "id": req_id
         }
-        self.writer.write((json.dumps(req) + "\n").encode())
-        await self.writer.drain()
+        self.writer.write(self.codec.pack(req))
 
-        # Read response
+    async def _send_request(self, method: str, params: Dict[str, Any], _sink: Optional[asyncio.Queue] = None) -> Any:
+        if method not in PACED_METHODS:
+            return await self._send_once(method, params, _sink)
+        deadline = time.monotonic() + self.busy_timeout
         while True:
-            line = await self.reader.readline()
-            if not line:
-                raise ConnectionError("Connection closed")
-            
-            resp = json.loads(line)
-            if resp.get("id") == req_id:
-                if resp.get("error"):
-                    raise RuntimeError(f"RPC Error: {resp['error']}")
-                return resp.get("result")
-            # Ignore unrelated messages (like keepalives if implemented)
+            delay = self.pacer.wait()
+            if delay:
+                await asyncio.sleep(delay)
+            try:
+                result = await self._send_once(method, params)
+            except HubBusyError as e:
+                self.pacer.busy(e.retry_after)
+                if time.monotonic() + e.retry_after > deadline:
+                    raise
+                logger.debug(f"Hub busy, retrying {method} in {e.retry_after}s")
+                continue
+            self.pacer.ok()
+            return result
+
+    async def _send_once(self, method: str, params: Dict[str, Any], _sink: Optional[asyncio.Queue] = None) -> Any:
+        if self.writer is None:
+            await self.connect()
+
+        req_id = str(uuid.uuid4())
+        future = asyncio.get_running_loop().create_future()
+        self._pending[req_id] = (future, method, params)
+        if _sink is not None:
+            self._sinks[req_id] = _sink
+        try:
+            self._write(req_id, method, params)
+            await self.writer.drain()
+        except (ConnectionError, AttributeError):
+            if self._reader_task is None or self._reader_task.done():
+                self._pending.pop(req_id, None)
+                self._sinks.pop(req_id, None)
+                raise ConnectionError(f"Connection closed during {method}")
+            # Otherwise the reader notices the broken connection and settles the future
+        try:
+            resp = await future
+        finally:
+            self._pending.pop(req_id, None)
+            self._sinks.pop(req_id, None)
+        if resp.get("error"):
+            raise busy_error(resp["error"], "RPC Error") or RuntimeError(f"RPC Error: {resp['error']}")
+        return resp.get("result")
 
-    async def add_task(self, prompt: str, task_type: str = "chat") -> str:
-        """Adds a task and returns its ID."""
+    @asynccontextmanager
+    async def batch(self) -> AsyncIterator[RequestBatch]:
+        """
+        Collect calls and send them as one JSON array when the block exits:
+
+            async with client.batch() as batch:
+                queued = batch.call("enqueue", {"prompt": "hi"})
+                stats = batch.call("stats")
+            (await queued)["task_id"]
+
+        Store calls in a batch share one hub transaction, but each succeeds
+        or fails on its own; awaiting a call's future raises its error.
+        """
+        batch = RequestBatch()
+        yield batch
+        if batch.calls:
+            await self._send_batch(batch)
+
+    async def _send_batch(self, batch: RequestBatch) -> None:
+        if self.writer is None:
+            await self.connect()
+        loop = asyncio.get_running_loop()
+        reqs = []
+        for method, params, _ in batch.calls:
+            req_id = str(uuid.uuid4())
+            # Replies come back as one array; the reader resolves them by id like any other
+            self._pending[req_id] = (loop.create_future(), method, params)
+            reqs.append({"jsonrpc": "2.0", "method": method, "params": self._params(params), "id": req_id})
+        try:
+            self.writer.write(self.codec.pack(reqs))
+            await self.writer.drain()
+        except (ConnectionError, AttributeError):
+            if self._reader_task is None or self._reader_task.done():
+                for req in reqs:
+                    self._pending[req["id"]][0].set_exception(ConnectionError("Connection closed during batch"))
+            # Otherwise the reader notices the broken connection and settles the futures
+        try:
+            resps = await asyncio.gather(
+                *(self._pending[r["id"]][0] for r in reqs), return_exceptions=True
+            )
+        finally:
+            for req in reqs:
+                self._pending.pop(req["id"], None)
+        for (_, _, future), resp in zip(batch.calls, resps):
+            if isinstance(resp, BaseException):
+                future.set_exception(resp)
+            elif resp.get("error"):
+                future.set_exception(busy_error(resp["error"], "RPC Error") or RuntimeError(f"RPC Error: {resp['error']}"))
+            else:
+                future.set_result(resp.get("result"))
+
+    async def _read_loop(self, reader: asyncio.StreamReader, codec: Codec) -> None:
+        try:
+            while True:
+                msg = await self._read_message(reader, codec)
+                if msg is None:
+                    break
+                if isinstance(msg, list):
+                    # A batch reply: one response per request
+                    for resp in msg:
+                        self._resolve(resp)
+                elif msg.get("event") == "shutdown":
+                    # Replies to what was sent still follow; once the hub closes
+                    # the connection, _connection_lost reconnects
+                    logger.info("Hub is shutting down")
+                elif msg.get("id") is None and "event" in msg:
+                    self._subscriptions.get(msg.get("subscription"), self._events).put_nowait(msg)
+                else:
+                    self._resolve(msg)
+        except (ConnectionError, EOFError, ValueError) as e:
+            logger.debug(f"Hub connection broke: {e}")
+        if not self._closed:
+            await self._connection_lost()
+
+    def _resolve(self, msg: Dict[str, Any]) -> None:
+        req_id = msg.get("id")
+        pending = self._pending.get(req_id)
+        if pending is None or pending[0].done():
+            return
+        sink = self._sinks.pop(req_id, None)
+        if sink is not None and msg.get("result"):
+            # Registered before any later line is read, so no event of it is misrouted
+            self._subscriptions[msg["result"]["subscription"]] = sink
+        pending[0].set_result(msg)
+
+    async def _connection_lost(self) -> None:
+        writer, self.writer, self.reader = self.writer, None, None
+        if writer is not None:
+            writer.close()
+        # Subscriptions lived on the old connection
+        for queue in {id(q): q for q in self._subscriptions.values()}.values():
+            queue.put_nowait(_LOST)
+        self._subscriptions.clear()
+
+        retry = {rid: p for rid, p in self._pending.items() if p[1] in IDEMPOTENT_METHODS}
+        for req_id, (future, method, _) in self._pending.items():
+            if req_id not in retry and not future.done():
+                future.set_exception(ConnectionError(f"Connection closed during {method}"))
+        if not retry:
+            return
+
+        for delay in RECONNECT_DELAYS:
+            await asyncio.sleep(delay)
+            try:
+                await self.connect()
+            except (OSError, RuntimeError) as e:
+                logger.debug(f"Reconnect failed: {e}")
+                continue
+            logger.info(f"Reconnected to Hub; resending {len(retry)} request(s)")
+            for req_id, (future, method, params) in retry.items():
+                if not future.done():
+                    self._write(req_id, method, params)
+            return
+        for future, method, _ in retry.values():
+            if not future.done():
+                future.set_exception(ConnectionError(f"Connection closed during {method}"))
+
+    async def add_task(
+        self,
+        prompt: str,
+        task_type: str = "chat",
+        tenant: Optional[str] = None,
+        job: Optional[str] = None,
+        ttl_seconds: Optional[float] = None,
+        deadline: Optional[float] = None,
+        target_worker: Optional[str] = None,
+        target_group: Optional[str] = None,
+        fallback_seconds: Optional[float] = None,
+        session_id: Optional[str] = None,
+    ) -> str:
+        """
+        Adds a task and returns its ID. With ttl_seconds the task expires unrun if not picked up in time;
+        deadline (epoch seconds) is when the result is due, honoured by hubs running --schedule edf.
+        target_worker/target_group reserve the task for one agent or group, until fallback_seconds pass.
+        Turns sharing a session_id go to the agent holding that conversation; send only the new turn.
+        """
         resp = await self._send_request("enqueue", {
             "prompt": prompt,
             "type": task_type,
+            "tenant": tenant,
+            "job": job,
+            "ttl_seconds": ttl_seconds,
+            "deadline": deadline,
+            "target_worker": target_worker,
+            "target_group": target_group,
+            "fallback_seconds": fallback_seconds,
+            "session_id": session_id,
             "context": {}
         })
         return resp['task_id']
 
+    async def run(self, prompt: str, task_type: str = "chat", timeout: float = 300, **params: Any) -> str:
+        """
+        Enqueues a task and waits for it hub-side, returning its result in one
+        round trip. Extra params are enqueue parameters (queue, session_id, ...).
+        """
+        resp = await self._send_request("run", {**params, "prompt": prompt, "type": task_type, "timeout": timeout})
+        task = resp["task"]
+        if task["status"] != "done":
+            raise RuntimeError(f"Task {task['task_id']} {task['status']}: {task.get('error')}")
+        return task["result"]
+
     async def get_task(self, task_id: str) -> Dict[str, Any]:
         """Gets task details."""
-        resp = await self._send_request("list", {"limit": 100})
+        resp = await self._send_request("get_tasks", {"task_ids": [task_id]})
         tasks = resp.get("tasks", [])
-        for t in tasks:
-            if t.get('task_id') == task_id:
-                return t
+        if tasks:
+            return tasks[0]
         raise ValueError("Task not found")
 
+    async def lease(self, worker_id: str, max_tasks: int = 1, lease_seconds: int = 300) -> list:
+        """Leases up to max_tasks tasks for this worker."""
+        resp = await self._send_request("lease", {
+            "worker_id": worker_id,
+            "max_tasks": max_tasks,
+            "lease_seconds": lease_seconds
+        })
+        return resp.get("tasks", [])
+
+    async def ack_many(self, acks: list) -> int:
+        """
+        Acks results of several tasks ({task_id, status, result, error}) in one
+        round trip and one hub transaction. A single result uses plain ack.
+        """
+        if not acks:
+            return 0
+        if len(acks) == 1:
+            await self._send_request("ack", acks[0])
+            return 1
+        resp = await self._send_request("ack_many", {"acks": acks})
+        return resp["acked"]
+
+    async def release_many(self, task_ids: list, worker_id: Optional[str] = None) -> int:
+        """Returns leased tasks to the queue immediately."""
+        params: Dict[str, Any] = {"task_ids": task_ids}
+        if worker_id:
+            params["worker_id"] = worker_id
+        resp = await self._send_request("release_many", params)
+        return resp["released"]
+
+    async def session_history(self, session_id: str, limit: int = 50) -> Dict[str, Any]:
+        """Gets a session's recent turns (oldest first) and which worker it is pinned to."""
+        return await self._send_request("session_history", {"session_id": session_id, "limit": limit})
+
+    async def subscribe(
+        self,
+        task_ids: Optional[list] = None,
+        job: Optional[str] = None,
+        queue: Optional[str] = None,
+        status: Optional[list] = None,
+    ) -> str:
+        """Has the hub push matching task state changes on this connection; read them with next_event."""
+        sub_id, _ = await self._subscribe(task_ids, job, queue, status, sink=self._events)
+        return sub_id
+
+    async def _subscribe(self, task_ids, job, queue, status, sink: asyncio.Queue) -> Tuple[str, asyncio.Queue]:
+        params: Dict[str, Any] = {"job": job, "queue": queue, "status": status}
+        if task_ids is not None:
+            params["task_ids"] = list(task_ids)
+        resp = await self._send_request("subscribe", params, _sink=sink)
+        return resp["subscription"], sink
+
+    async def unsubscribe(self, subscription: str) -> None:
+        self._subscriptions.pop(subscription, None)
+        if self.writer is not None:
+            await self._send_request("unsubscribe", {"subscription": subscription})
+
+    async def next_event(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """The next pushed event, or None if none arrives within timeout."""
+        return await self._next_from(self._events, timeout)
+
+    @staticmethod
+    async def _next_from(queue: asyncio.Queue, timeout: Optional[float]) -> Optional[Dict[str, Any]]:
+        try:
+            event = await asyncio.wait_for(queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if event is _LOST:
+            raise ConnectionError("Connection closed")
+        return event
+
+    async def wait_for_task(self, task_id: int, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Waits until a task is done, failed, expired or cancelled, and returns it.
+        Each wait has its own subscription, so many may run at once on one client.
+        """
+        terminal = ("done", "failed", "expired", "cancelled")
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            sub, events = await self._subscribe([task_id], None, None, list(terminal), sink=asyncio.Queue())
+            try:
+                # It may have finished before the subscription existed
+                task = await self.get_task(task_id)
+                while task["status"] not in terminal:
+                    remaining = deadline - time.monotonic() if deadline is not None else None
+                    if remaining is not None and remaining <= 0:
+                        raise asyncio.TimeoutError(f"Task {task_id} still {task['status']}")
+                    event = await self._next_from(events, remaining)
+                    if event is not None and event["task"]["task_id"] == task_id:
+                        task = event["task"]
+                return task
+            except ConnectionError:
+                logger.debug(f"Lost connection while waiting for task {task_id}; resubscribing")
+            finally:
+                try:
+                    await self.unsubscribe(sub)
+                except ConnectionError:
+                    pass
+
     async def close(self):
-        if self.writer:
-            self.writer.close()
-            await self.writer.wait_closed()
+        self._closed = True
+        writer, self.writer, self.reader = self.writer, None, None
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+        for future, method, _ in self._pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(f"Client closed during {method}"))
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
 
     async def __aenter__(self):
         await self.connect()
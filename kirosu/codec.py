@@ -0,0 +1,141 @@
+"""
+Wire codecs for hub connections.
+
+Every connection starts out speaking JSONL: one JSON document per line,
+which is all a worker in another language needs to implement. A client may
+then send ``hello`` with the codecs it supports, in order of preference; the
+hub answers (still in JSONL) with the one it picked, and from the next
+message on both sides use length-prefixed frames: a 4-byte big-endian length
+followed by that many bytes of payload. Frames need no newline scanning, and
+the ``msgpack`` codec (installed with the ``msgpack`` extra) also skips
+JSON's string escaping, which dominates on multi-megabyte results.
+
+JSON itself goes through ``json_dumps``/``json_loads``, which use ``orjson``
+when installed (the ``orjson`` extra) and the standard library otherwise.
+Either way encoding yields UTF-8 bytes ready for the socket.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import struct
+from typing import Any, Callable
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Length prefix of a framed message
+FRAME_HEADER = struct.Struct("!I")
+
+
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+
+def _stdlib_dumps(obj: Any) -> bytes:
+    return _encoder.encode(obj).encode("utf-8")
+
+
+def _stdlib_line(obj: Any) -> bytes:
+    return (_encoder.encode(obj) + "\n").encode("utf-8")
+
+
+def _stdlib_loads(data: bytes | bytearray | str) -> Any:
+    # json.loads detects the UTF encoding of bytes itself
+    return json.loads(data)
+
+
+if orjson is not None:
+    _ORJSON_OPTS = orjson.OPT_NON_STR_KEYS
+
+    def json_dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=_ORJSON_OPTS)
+
+    def _json_line(obj: Any) -> bytes:
+        # Newline appended by orjson itself, saving a copy of the payload
+        return orjson.dumps(obj, option=_ORJSON_OPTS | orjson.OPT_APPEND_NEWLINE)
+
+    json_loads = orjson.loads
+else:
+    json_dumps, _json_line, json_loads = _stdlib_dumps, _stdlib_line, _stdlib_loads
+
+
+class Codec:
+    def __init__(
+        self,
+        name: str,
+        dumps: Callable[[Any], bytes],
+        loads: Callable[[bytes], Any],
+        framed: bool,
+        dumps_line: Callable[[Any], bytes] | None = None,
+    ):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+        self.framed = framed
+        self._dumps_line = dumps_line
+
+    def pack(self, obj: Any) -> bytes:
+        """``obj`` as it goes on the wire, framing included."""
+        if not self.framed and self._dumps_line is not None:
+            return self._dumps_line(obj)
+        payload = self.dumps(obj)
+        if self.framed:
+            return FRAME_HEADER.pack(len(payload)) + payload
+        return payload + b"\n"
+
+    def __repr__(self) -> str:
+        return f"Codec({self.name!r})"
+
+
+JSONL = Codec("jsonl", json_dumps, json_loads, framed=False, dumps_line=_json_line)
+JSON_FRAMES = Codec("json", json_dumps, json_loads, framed=True)
+
+CODECS: dict[str, Codec] = {JSONL.name: JSONL, JSON_FRAMES.name: JSON_FRAMES}
+if msgpack is not None:
+    CODECS["msgpack"] = Codec(
+        "msgpack",
+        lambda obj: msgpack.packb(obj, use_bin_type=True),
+        lambda data: msgpack.unpackb(data, raw=False),
+        framed=True,
+    )
+
+
+def preferred() -> list[str]:
+    """Codecs this process supports, fastest first."""
+    return [name for name in ("msgpack", "json", "jsonl") if name in CODECS]
+
+
+def negotiate(offered: list[str]) -> Codec:
+    """The first of the peer's ``offered`` codecs we support, else JSONL."""
+    for name in offered:
+        if name in CODECS:
+            return CODECS[name]
+    return JSONL
+
+
+def get_codec(name: str) -> Codec:
+    if name not in CODECS:
+        hint = " (pip install msgpack)" if name == "msgpack" else ""
+        raise ValueError(f"Unsupported codec {name!r}{hint}; available: {', '.join(CODECS)}")
+    return CODECS[name]
+
+
+def offer(codec: str | None = None) -> list[str]:
+    """
+    Codecs a client lists in its hello: just ``codec`` (or $KIRO_SWARM_CODEC)
+    if given, else every framed codec available. Empty means stay on JSONL
+    and skip the hello.
+    """
+    name = codec or os.environ.get("KIRO_SWARM_CODEC")
+    if name:
+        get_codec(name)
+        return [] if name == JSONL.name else [name]
+    return [n for n in preferred() if CODECS[n].framed]
@@ -1,18 +1,22 @@
 import argparse
+import os
 import sys
 from ..agent import KiroAgent
 
 def register(subparsers):
     agent_parser = subparsers.add_parser("agent", help="Start a kiro agent")
-    agent_parser.add_argument("--host", default="127.0.0.1", help="Hub host")
+    agent_parser.add_argument("--host", default=os.environ.get("KIRO_SWARM_HOST", "127.0.0.1"), help="Hub host, or unix:///path/to/hub.sock")
     agent_parser.add_argument("--port", type=int, default=8765, help="Hub port")
     agent_parser.add_argument("--model", help="Override Kiro model")
     agent_parser.add_argument("--log-file", help="Path to log file")
     agent_parser.add_argument("--id", help="Worker ID (Agent Name)")
+    agent_parser.add_argument("--batch-size", type=int, default=1, help="Tasks to lease per round trip")
+    agent_parser.add_argument("--lease-wait", type=float, default=20.0, help="Seconds a lease waits at the hub for work (0 = poll)")
+    agent_parser.add_argument("--group", action="append", dest="groups", help="Worker group to serve targeted tasks for (repeatable)")
     agent_parser.add_argument("--verbose", action="store_true", help="Enable verbose logging")
 
 def handle(args):
-    agent = KiroAgent(args.host, args.port, args.model, agent_name=args.id)
+    agent = KiroAgent(args.host, args.port, args.model, agent_name=args.id, batch_size=args.batch_size, groups=args.groups, lease_wait=args.lease_wait)
     try:
         agent.run_loop(log_file=args.log_file, verbose=args.verbose)
     except KeyboardInterrupt:
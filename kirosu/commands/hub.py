@@ -1,5 +1,7 @@
 import argparse
+import os
 import sys
+from ..agent import HubClient
 from ..hub import run_hub
 from ..config import get_db_path
 
@@ -9,6 +11,60 @@ def register(subparsers):
     hub_parser.add_argument("--port", type=int, default=8765, help="Hub port")
     hub_parser.add_argument("--db", default=get_db_path(), help="Database path")
     hub_parser.add_argument("--lease-seconds", type=int, default=300, help="Task lease duration")
+    hub_parser.add_argument("--fts", action="store_true", help="Build the FTS5 full-text search index")
+    hub_parser.add_argument("--checkpoint-interval", type=float, default=5.0, help="Seconds between WAL checkpoint checks (0 = SQLite autocheckpoint)")
+    hub_parser.add_argument("--wal-truncate-mb", type=float, default=64, help="Truncate the WAL once it grows past this size")
+    hub_parser.add_argument("--schedule", choices=["fifo", "edf"], default="fifo", help="Lease order: fair-share FIFO, or earliest deadline first")
+    hub_parser.add_argument("--session-affinity", type=float, default=30.0, help="Seconds a session stays pinned to its worker after a turn")
+    hub_parser.add_argument("--idle-timeout", type=float, default=600, help="Close connections silent this long (0 = never)")
+    hub_parser.add_argument("--max-workers", type=int, default=16, help="Threads serving storage calls")
+    hub_parser.add_argument("--max-in-flight", type=int, default=64, help="Pipelined requests served concurrently per connection")
+    hub_parser.add_argument("--unix", metavar="PATH", help="Also listen on this Unix domain socket (clients use --host unix://PATH)")
+    hub_parser.add_argument("--unix-mode", type=lambda s: int(s, 8), default=0o660, help="Octal permissions of the Unix socket file")
+    hub_parser.add_argument("--no-tcp", action="store_true", help="Listen on the Unix socket only")
+    hub_parser.add_argument("--max-queued", type=int, help="Refuse enqueues (retryable busy error) past this many queued tasks")
+    hub_parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics over HTTP at /metrics on this port")
+    hub_parser.add_argument("--metrics-host", default="127.0.0.1", help="Interface for the metrics listener")
+    hub_parser.add_argument("--backup-dir", help="Directory the backup command may write to (default: backups/ next to the database)")
+    hub_parser.add_argument("--drain-seconds", type=float, default=5.0, help="On shutdown, how long requests in flight get to finish")
+
+    backup_parser = subparsers.add_parser("backup", help="Hot-backup the hub database")
+    backup_parser.add_argument("path", help="Destination file inside the hub's --backup-dir (a bare name goes there)")
+    backup_parser.add_argument("--host", default=os.environ.get("KIRO_SWARM_HOST", "127.0.0.1"), help="Hub host, or unix:///path/to/hub.sock")
+    backup_parser.add_argument("--port", type=int, default=8765, help="Hub port")
 
 def handle(args):
-    sys.exit(run_hub(args.db, args.host, args.port, args.lease_seconds))
+    if args.no_tcp and not args.unix:
+        print("Error: --no-tcp needs --unix PATH", file=sys.stderr)
+        sys.exit(1)
+    sys.exit(run_hub(
+        args.db,
+        args.host,
+        args.port,
+        args.lease_seconds,
+        fts=args.fts,
+        checkpoint_interval=args.checkpoint_interval,
+        wal_truncate_bytes=int(args.wal_truncate_mb * 1024 * 1024),
+        schedule=args.schedule,
+        session_affinity=args.session_affinity,
+        idle_timeout=args.idle_timeout,
+        max_workers=args.max_workers,
+        max_in_flight=args.max_in_flight,
+        unix_path=args.unix,
+        unix_mode=args.unix_mode,
+        tcp=not args.no_tcp,
+        max_queued_total=args.max_queued,
+        metrics_host=args.metrics_host,
+        metrics_port=args.metrics_port,
+        drain_seconds=args.drain_seconds,
+        backup_dir=args.backup_dir,
+    ))
+
+def handle_backup(args):
+    client = HubClient(args.host, args.port)
+    # Bare names are resolved by the hub, in its backup directory; anything
+    # else is relative to where the command runs, not to the hub's cwd
+    path = args.path if os.path.basename(args.path) == args.path else os.path.abspath(args.path)
+    resp = client.call("backup", {"path": path})
+    print(f"Backed up {resp['bytes']} bytes to {resp['path']} in {resp['seconds']}s ({resp['steps']} steps)")
+    sys.exit(0)
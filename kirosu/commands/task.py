@@ -1,28 +1,76 @@
 import argparse
+import os
 import sys
+import time
 from ..agent import HubClient
 
 def register(subparsers):
     # Enqueue command
     enqueue_parser = subparsers.add_parser("enqueue", help="Enqueue a task")
     enqueue_parser.add_argument("prompt", help="The prompt to execute")
-    enqueue_parser.add_argument("--host", default="127.0.0.1", help="Hub host")
+    enqueue_parser.add_argument("--host", default=os.environ.get("KIRO_SWARM_HOST", "127.0.0.1"), help="Hub host, or unix:///path/to/hub.sock")
     enqueue_parser.add_argument("--port", type=int, default=8765, help="Hub port")
+    enqueue_parser.add_argument("--tenant", default=os.environ.get("KIRO_SWARM_TENANT", "default"), help="Submitter for fair-share scheduling")
+    enqueue_parser.add_argument("--job", help="Job tag")
+    enqueue_parser.add_argument("--deadline-in", type=float, metavar="SECONDS", help="Result due this many seconds from now")
+    enqueue_parser.add_argument("--worker", help="Only this worker id may run the task")
+    enqueue_parser.add_argument("--group", help="Only workers in this group may run the task")
+    enqueue_parser.add_argument("--fallback-in", type=float, metavar="SECONDS", help="Let any worker take a targeted task after this long")
 
     # Status command
     status_parser = subparsers.add_parser("status", help="List tasks")
-    status_parser.add_argument("--host", default="127.0.0.1", help="Hub host")
+    status_parser.add_argument("--host", default=os.environ.get("KIRO_SWARM_HOST", "127.0.0.1"), help="Hub host, or unix:///path/to/hub.sock")
     status_parser.add_argument("--port", type=int, default=8765, help="Hub port")
     status_parser.add_argument("--limit", type=int, default=50, help="Limit results")
     status_parser.add_argument("--status", help="Filter by status")
 
+    # Search command
+    search_parser = subparsers.add_parser("search", help="Full-text search over task prompts and results")
+    search_parser.add_argument("query", help="Search query (FTS5 syntax when the hub runs with --fts)")
+    search_parser.add_argument("--host", default=os.environ.get("KIRO_SWARM_HOST", "127.0.0.1"), help="Hub host, or unix:///path/to/hub.sock")
+    search_parser.add_argument("--port", type=int, default=8765, help="Hub port")
+    search_parser.add_argument("--status", help="Filter by status")
+    search_parser.add_argument("--limit", type=int, default=50, help="Limit results")
+    search_parser.add_argument("--cursor", type=int, help="Continue from a previous page's cursor")
+
+    # Latency command
+    latency_parser = subparsers.add_parser("latency", help="Show task latency percentiles")
+    latency_parser.add_argument("--host", default=os.environ.get("KIRO_SWARM_HOST", "127.0.0.1"), help="Hub host, or unix:///path/to/hub.sock")
+    latency_parser.add_argument("--port", type=int, default=8765, help="Hub port")
+    latency_parser.add_argument("--by", choices=["type", "queue", "worker"], default="type", help="Group results by")
+    latency_parser.add_argument("--since", type=float, default=3600, help="Window in seconds (0 = all history)")
+
+    # Deadlines command
+    deadlines_parser = subparsers.add_parser("deadlines", help="Show queued tasks projected to miss their deadline")
+    deadlines_parser.add_argument("--host", default=os.environ.get("KIRO_SWARM_HOST", "127.0.0.1"), help="Hub host, or unix:///path/to/hub.sock")
+    deadlines_parser.add_argument("--port", type=int, default=8765, help="Hub port")
+
+    # Tenants command
+    tenants_parser = subparsers.add_parser("tenants", help="Show per-tenant queue depth, or set a fair-share weight")
+    tenants_parser.add_argument("--host", default=os.environ.get("KIRO_SWARM_HOST", "127.0.0.1"), help="Hub host, or unix:///path/to/hub.sock")
+    tenants_parser.add_argument("--port", type=int, default=8765, help="Hub port")
+    tenants_parser.add_argument("--set-weight", nargs=2, metavar=("TENANT", "WEIGHT"), help="Set a tenant's weight")
+
+    # Rate limit command
+    rate_parser = subparsers.add_parser("rate-limit", help="Show or set per provider/model rate limits")
+    rate_parser.add_argument("key", nargs="?", help="'provider' or 'provider/model'")
+    rate_parser.add_argument("--host", default=os.environ.get("KIRO_SWARM_HOST", "127.0.0.1"), help="Hub host, or unix:///path/to/hub.sock")
+    rate_parser.add_argument("--port", type=int, default=8765, help="Hub port")
+    rate_parser.add_argument("--rpm", type=float, help="Requests per minute (omit both to remove)")
+    rate_parser.add_argument("--tpm", type=float, help="Estimated tokens per minute")
+
     # Approve command
     approve_parser = subparsers.add_parser("approve", help="Approve a human-in-the-loop task")
     approve_parser.add_argument("task_id", type=int, help="ID of the task to approve")
 
 def handle_enqueue(args):
     client = HubClient(args.host, args.port)
-    resp = client.call("enqueue", {"prompt": args.prompt})
+    params = {"prompt": args.prompt, "tenant": args.tenant, "job": args.job}
+    if args.deadline_in:
+        params["deadline"] = time.time() + args.deadline_in
+    if args.worker or args.group:
+        params.update(target_worker=args.worker, target_group=args.group, fallback_seconds=args.fallback_in)
+    resp = client.call("enqueue", params)
     print(f"Task enqueued. ID: {resp['task_id']}")
     sys.exit(0)
 
@@ -33,6 +81,23 @@ def handle_status(args):
     stats = resp.get("stats", {})
     
     print(f"Stats: {stats}")
+    _print_tasks(tasks)
+    sys.exit(0)
+
+def handle_search(args):
+    client = HubClient(args.host, args.port)
+    resp = client.call("search", {
+        "query": args.query,
+        "status": args.status,
+        "limit": args.limit,
+        "cursor": args.cursor,
+    })
+    _print_tasks(resp.get("tasks", []))
+    if resp.get("next_cursor") is not None:
+        print(f"More results: --cursor {resp['next_cursor']}")
+    sys.exit(0)
+
+def _print_tasks(tasks):
     print("-" * 60)
     print(f"{'ID':<5} | {'Status':<10} | {'Prompt':<40}")
     print("-" * 60)
@@ -45,10 +110,80 @@ def handle_status(args):
             print(f"  Result: {t['result'][:100]}...")
         if t['error']:
             print(f"  Error: {t['error']}")
-    sys.exit(0)
 
 def handle_approve(args):
     client = HubClient(args.host, args.port)
     resp = client.call("approve", {"task_id": args.task_id})
     print(f"Task {args.task_id} approved.")
     sys.exit(0)
+
+def handle_latency(args):
+    client = HubClient(args.host, args.port)
+    report = client.call("latency_report", {"group_by": args.by, "since_seconds": args.since or None})
+    groups = report.get("groups", {})
+    if not groups:
+        print("No finished tasks in window.")
+        sys.exit(0)
+
+    print(f"{args.by.capitalize():<20} | {'Metric':<13} | {'Count':>6} | {'p50':>8} | {'p95':>8} | {'p99':>8} | {'Max':>8}")
+    print("-" * 90)
+    for name, metrics in sorted(groups.items()):
+        for metric in ("queue_wait", "run_time", "end_to_end", "provider_time"):
+            m = metrics[metric]
+            if not m["count"]:
+                continue
+            print(
+                f"{name[:20]:<20} | {metric:<13} | {m['count']:>6} | "
+                f"{m['p50']:>8.2f} | {m['p95']:>8.2f} | {m['p99']:>8.2f} | {m['max']:>8.2f}"
+            )
+    sys.exit(0)
+
+def handle_deadlines(args):
+    client = HubClient(args.host, args.port)
+    report = client.call("deadline_report")
+    print(f"Workers: {report['workers']}  Projected misses: {report['projected_misses']}")
+    for task_type, p50 in sorted(report.get("run_time_p50_sec", {}).items()):
+        print(f"  {task_type:<18} p50 run time {p50:.2f}s")
+    if report["at_risk"]:
+        print(f"\n{'ID':<5} | {'Type':<10} | {'Tenant':<12} | {'Due in':>8} | {'Late by':>8}")
+        print("-" * 55)
+        now = time.time()
+        for t in report["at_risk"]:
+            print(
+                f"{t['task_id']:<5} | {t['type']:<10} | {t['tenant'][:12]:<12} | "
+                f"{t['deadline'] - now:>7.0f}s | {t['late_by_sec']:>7.0f}s"
+            )
+    sys.exit(0)
+
+def handle_tenants(args):
+    client = HubClient(args.host, args.port)
+    if args.set_weight:
+        tenant, weight = args.set_weight
+        client.call("set_tenant_weight", {"tenant": tenant, "weight": float(weight)})
+        print(f"Tenant {tenant} weight set to {weight}.")
+        sys.exit(0)
+
+    tenants = client.call("tenants").get("tenants", {})
+    print(f"{'Tenant':<20} | {'Weight':>6} | {'Queued':>8} | {'Leased':>8}")
+    print("-" * 52)
+    for name, t in sorted(tenants.items()):
+        print(f"{name[:20]:<20} | {t['weight']:>6.2f} | {t['queued']:>8} | {t['leased']:>8}")
+    sys.exit(0)
+
+def handle_rate_limit(args):
+    client = HubClient(args.host, args.port)
+    if args.key:
+        limits = client.call("set_rate_limit", {
+            "key": args.key,
+            "requests_per_minute": args.rpm,
+            "tokens_per_minute": args.tpm,
+        })["rate_limits"]
+    else:
+        limits = client.call("stats")["stats"].get("rate_limits", {})
+
+    if not limits:
+        print("No rate limits configured.")
+        sys.exit(0)
+    for key, entry in sorted(limits.items()):
+        print(f"{key}: {entry}")
+    sys.exit(0)
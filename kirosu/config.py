@@ -92,3 +92,26 @@ def get_agent_config(agent_name: str) -> dict[str, Any]:
     """Load specific agent config."""
     config = load_config()
     return config.get("agents", {}).get(agent_name, {})
+
+def get_rate_limits() -> dict[str, dict[str, float]]:
+    """
+    Load per provider/model rate limits, e.g.
+
+        [rate_limits."codex/gpt-5.1-codex-mini"]
+        requests_per_minute = 60
+        tokens_per_minute = 200000
+    """
+    config = load_config()
+    return config.get("rate_limits", {})
+
+def get_queue_limits() -> dict[str, int]:
+    """
+    Load queue-depth limits for enqueue admission control, e.g.
+
+        [queue_limits]
+        hub = 1000000
+        "queue:default" = 100000
+        "tenant:batch-import" = 5000
+    """
+    config = load_config()
+    return config.get("queue_limits", {})
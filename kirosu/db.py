@@ -1,12 +1,21 @@
 from __future__ import annotations
 
+import hashlib
+import logging
+import math
+import os
 import sqlite3
 import threading
 import time
-from dataclasses import dataclass
-from typing import Any
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from typing import Any, Iterator
 from queue import Queue
 
+from .codec import json_dumps, json_loads
+from .scheduling import AdmissionControl, FairShareScheduler, RateLimiter, estimate_tokens
+
 
 @dataclass(frozen=True)
 class Task:
@@ -21,38 +30,291 @@ class Task:
     worker_id: str | None
     result: str | None
     error: str | None
+    queue: str = "default"
+    leased_at: float | None = None
+    started_at: float | None = None
+    finished_at: float | None = None
+    provider_time_sec: float | None = None
+    tenant: str = "default"
+    job: str | None = None
+    expires_at: float | None = None
+    deadline: float | None = None
+    target_worker: str | None = None
+    target_group: str | None = None
+    target_fallback_at: float | None = None
+    session_id: str | None = None
+    # Turns of the session finished so far, reported with a lease (not stored)
+    session_turns: int | None = None
+
+
+# Columns added after the original schema; older databases are migrated in place.
+_MIGRATED_COLUMNS = {
+    "queue": "TEXT NOT NULL DEFAULT 'default'",
+    "leased_at": "REAL",
+    "started_at": "REAL",
+    "finished_at": "REAL",
+    "provider_time_sec": "REAL",
+    "system_prompt_hash": "TEXT",
+    "template_id": "TEXT",
+    "variables": "TEXT",
+    "tenant": "TEXT NOT NULL DEFAULT 'default'",
+    "job": "TEXT",
+    "expires_at": "REAL",
+    "deadline": "REAL",
+    "target_worker": "TEXT",
+    "target_group": "TEXT",
+    "target_fallback_at": "REAL",
+    "session_id": "TEXT",
+}
+
+SCHEDULES = ("fifo", "edf")
+
+# Statuses a task never leaves on its own
+TERMINAL_STATUSES = frozenset({"done", "failed", "expired", "cancelled"})
+
+# Ids per IN (...) list, under SQLite's default host-parameter limit of 999
+_MAX_IDS_PER_QUERY = 900
+
+_LATENCY_GROUPS = {"type": "type", "queue": "queue", "worker": "worker_id"}
+_PERCENTILES = (50, 90, 95, 99)
+
+
+def _percentile(sorted_values: list[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def _summarize(values: list[float]) -> dict[str, float]:
+    values = sorted(values)
+    out = {f"p{p}": round(_percentile(values, p), 3) for p in _PERCENTILES}
+    out["max"] = round(values[-1], 3) if values else 0.0
+    out["count"] = len(values)
+    return out
+
+
+# Full-text index over the searchable task columns. The index is contentless
+# (the text lives only in ``tasks``) and kept in sync by triggers, so writers
+# never have to know about it.
+_FTS_COLUMNS = ("prompt", "system_prompt", "result", "error")
+
+
+# Interned system prompts are resolved from their side table, and templated
+# prompts are indexed by their variables (the shared template text is not).
+def _fts_expressions(prefix: str) -> list[str]:
+    return [
+        f"CASE WHEN {prefix}.template_id IS NULL THEN {prefix}.prompt ELSE {prefix}.variables END",
+        f"COALESCE({prefix}.system_prompt, "
+        f"(SELECT body FROM system_prompts WHERE hash = {prefix}.system_prompt_hash))",
+        f"{prefix}.result",
+        f"{prefix}.error",
+    ]
+
+
+def _fts_values(prefix: str) -> str:
+    return ", ".join(_fts_expressions(prefix))
+
+
+_FTS_TRIGGERS = ("tasks_fts_ai", "tasks_fts_ad", "tasks_fts_au")
+
+_FTS_SCHEMA = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5({', '.join(_FTS_COLUMNS)}, content='')",
+    f"""
+    CREATE TRIGGER IF NOT EXISTS tasks_fts_ai AFTER INSERT ON tasks BEGIN
+        INSERT INTO tasks_fts(rowid, {', '.join(_FTS_COLUMNS)}) VALUES (new.task_id, {_fts_values('new')});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS tasks_fts_ad AFTER DELETE ON tasks BEGIN
+        INSERT INTO tasks_fts(tasks_fts, rowid, {', '.join(_FTS_COLUMNS)}) VALUES ('delete', old.task_id, {_fts_values('old')});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS tasks_fts_au AFTER UPDATE OF {', '.join(_FTS_COLUMNS)} ON tasks BEGIN
+        INSERT INTO tasks_fts(tasks_fts, rowid, {', '.join(_FTS_COLUMNS)}) VALUES ('delete', old.task_id, {_fts_values('old')});
+        INSERT INTO tasks_fts(rowid, {', '.join(_FTS_COLUMNS)}) VALUES (new.task_id, {_fts_values('new')});
+    END
+    """,
+]
+
+
+def _hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class _LruCache:
+    """Small bounded mapping for interned texts looked up on every lease."""
+
+    def __init__(self, capacity: int = 1024):
+        self.capacity = capacity
+        self._data: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: str) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.capacity:
+                self._data.popitem(last=False)
 
 
 class TaskStore:
-    def __init__(self, db_path: str, pool_size: int = 5):
+    def __init__(
+        self,
+        db_path: str,
+        pool_size: int = 5,
+        fts: bool = False,
+        autocheckpoint: bool = True,
+        schedule: str = "fifo",
+        session_affinity: float = 30.0,
+    ):
+        """
+        ``fts`` builds the optional FTS5 index used by ``search``. Once built the
+        index is maintained by triggers, whether or not later opens pass ``fts``.
+
+        ``autocheckpoint=False`` stops committing connections from checkpointing
+        the WAL inline; the owner is then expected to call ``checkpoint``.
+
+        ``schedule="edf"`` leases tasks with a deadline earliest-deadline-first,
+        ahead of best-effort work; otherwise deadlines are informational.
+
+        A session stays pinned to the worker that served its last turn for
+        ``session_affinity`` seconds after the turn completes; after that (or
+        once that worker's lease lapses) any worker may pick it up.
+        """
+        if schedule not in SCHEDULES:
+            raise ValueError(f"schedule must be one of {'|'.join(SCHEDULES)}")
+        self.schedule = schedule
+        self.session_affinity = float(session_affinity)
         self.db_path = db_path
+        self.autocheckpoint = autocheckpoint
         self._pool = Queue(maxsize=pool_size)
         for _ in range(pool_size):
-            conn = sqlite3.connect(self.db_path, check_same_thread=False)
-            conn.row_factory = sqlite3.Row
-            self._pool.put(conn)
-        self._init_db()
+            self._pool.put(self._connect())
+        self.fts_enabled = False
+        self._templates = _LruCache()
+        self._system_prompts = _LruCache()
+        self.scheduler = FairShareScheduler()
+        self.rate_limiter = RateLimiter()
+        self.admission = AdmissionControl()
+        # Serialises lease transactions so scheduler state and the SQLite
+        # write lock are always taken in the same order
+        self._lease_lock = threading.Lock()
+        # Single-flight: one thread recounts queue depths while the rest use the cache
+        self._admission_refresh = threading.Lock()
+        self._last_tenant_refresh = 0.0
+        # Connection pinned to a thread for the duration of a batch()
+        self._local = threading.local()
+        self._init_db(fts)
 
     def close(self) -> None:
         while not self._pool.empty():
             conn = self._pool.get()
             conn.close()
 
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        # Per-connection settings; journal_mode is persisted in the file by _init_db
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        conn.execute("PRAGMA busy_timeout=3000;")
+        if not self.autocheckpoint:
+            conn.execute("PRAGMA wal_autocheckpoint=0;")
+        return conn
+
     def _get_conn(self) -> sqlite3.Connection:
-        """Get connection from pool (blocking if empty)."""
-        return self._pool.get()
+        """Get connection from pool (blocking if empty); inside a batch, the batch's connection."""
+        pinned = getattr(self._local, "conn", None)
+        return pinned if pinned is not None else self._pool.get()
 
     def _return_conn(self, conn: sqlite3.Connection) -> None:
         """Return connection to pool."""
-        self._pool.put(conn)
+        if conn is not getattr(self._local, "conn", None):
+            self._pool.put(conn)
+
+    def _cache_after_commit(self, cache: _LruCache, key: str, body: str) -> None:
+        """
+        Cache a side-table row once it is committed: now, or when the
+        enclosing batch commits, so a rolled-back batch leaves no entry for
+        a row that does not exist.
+        """
+        pending = getattr(self._local, "cached", None)
+        if pending is None:
+            cache.put(key, body)
+        else:
+            pending.append((cache, key, body))
 
-    def _init_db(self) -> None:
+    def _commit(self, conn: sqlite3.Connection) -> None:
+        # A batch commits once, when it ends
+        if conn is not getattr(self._local, "conn", None):
+            conn.commit()
+
+    def _rollback(self, conn: sqlite3.Connection) -> None:
+        if conn is not getattr(self._local, "conn", None):
+            conn.rollback()
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """
+        Run every store call this thread makes inside the block on one
+        connection, committed as a single transaction when the block ends
+        and rolled back if it raises. Wrap individual steps in ``savepoint``
+        to let them fail without losing the rest. Nested batches join the
+        outer one. ``lease`` keeps its own locking and should not be batched.
+        """
+        if getattr(self._local, "conn", None) is not None:
+            yield
+            return
+        conn = self._pool.get()
+        self._local.conn = conn
+        self._local.cached = []
+        try:
+            # Take the write lock up front: a deferred batch that read first
+            # could not upgrade once another connection had committed
+            conn.execute("BEGIN IMMEDIATE")
+            yield
+            conn.commit()
+            for cache, key, body in self._local.cached:
+                cache.put(key, body)
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._local.conn = None
+            self._local.cached = None
+            self._pool.put(conn)
+
+    @contextmanager
+    def savepoint(self) -> Iterator[None]:
+        """Inside ``batch``: if the block raises, undo only its writes."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            raise RuntimeError("savepoint() needs an enclosing batch()")
+        conn.execute("SAVEPOINT batch_step")
+        cached = len(self._local.cached)
+        try:
+            yield
+        except BaseException:
+            conn.execute("ROLLBACK TO batch_step")
+            del self._local.cached[cached:]
+            raise
+        finally:
+            conn.execute("RELEASE batch_step")
+
+    def _init_db(self, fts: bool = False) -> None:
         conn = self._get_conn()
         try:
             cur = conn.cursor()
             cur.execute("PRAGMA journal_mode=WAL;")
-            cur.execute("PRAGMA synchronous=NORMAL;")
-            cur.execute("PRAGMA busy_timeout=3000;")
             cur.execute(
                 """
                 CREATE TABLE IF NOT EXISTS tasks (
@@ -66,7 +328,31 @@ class TaskStore:
                   leased_until REAL,
                   worker_id TEXT,
                   result TEXT,
-                  error TEXT
+                  error TEXT,
+                  queue TEXT NOT NULL DEFAULT 'default',
+                  leased_at REAL,
+                  started_at REAL,
+                  finished_at REAL,
+                  provider_time_sec REAL
+                )
+                """
+            )
+            self._migrate_columns(cur)
+            # Fan-out jobs share a handful of long texts; rows reference them by key
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS system_prompts (
+                  hash TEXT PRIMARY KEY,
+                  body TEXT NOT NULL
+                )
+                """
+            )
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS prompt_templates (
+                  template_id TEXT PRIMARY KEY,
+                  body TEXT NOT NULL,
+                  created_at REAL NOT NULL
                 )
                 """
             )
@@ -77,76 +363,838 @@ class TaskStore:
                 ON tasks(status, leased_until)
                 """
             )
-            conn.commit()
+            # Latency reports scan a recent window of finished tasks
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_finished_at ON tasks(finished_at)")
+            # Per-tenant ready queues for fair-share leasing
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_ready_tenant ON tasks(status, tenant, task_id)")
+            # Queue depths for admission control and the task gauges, counted
+            # without touching the table
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_status_queue ON tasks(status, queue, tenant)")
+            # Earliest-deadline-first leasing walks this in deadline order
+            cur.execute(
+                """
+                CREATE INDEX IF NOT EXISTS idx_deadline
+                ON tasks(queue, deadline) WHERE status = 'queued' AND deadline IS NOT NULL
+                """
+            )
+            # ...and this when the lease names no queue, as agents' leases do;
+            # status leads so the planner prefers it to the per-tenant index
+            cur.execute(
+                """
+                CREATE INDEX IF NOT EXISTS idx_deadline_order
+                ON tasks(status, deadline, task_id) WHERE deadline IS NOT NULL
+                """
+            )
+            # Targeted tasks are claimed through these before the general queue
+            cur.execute(
+                """
+                CREATE INDEX IF NOT EXISTS idx_target_worker
+                ON tasks(status, target_worker, task_id) WHERE target_worker IS NOT NULL
+                """
+            )
+            cur.execute(
+                """
+                CREATE INDEX IF NOT EXISTS idx_target_group
+                ON tasks(status, target_group, task_id) WHERE target_group IS NOT NULL
+                """
+            )
+            # Only tasks with a TTL are indexed, for the expiry reaper
+            cur.execute(
+                """
+                CREATE INDEX IF NOT EXISTS idx_expiry
+                ON tasks(status, expires_at) WHERE expires_at IS NOT NULL
+                """
+            )
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS tenant_weights (
+                  tenant TEXT PRIMARY KEY,
+                  weight REAL NOT NULL
+                )
+                """
+            )
+            cur.execute(
+                """
+                CREATE INDEX IF NOT EXISTS idx_session
+                ON tasks(status, session_id, task_id) WHERE session_id IS NOT NULL
+                """
+            )
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS sessions (
+                  session_id TEXT PRIMARY KEY,
+                  worker_id TEXT,
+                  pinned_until REAL,
+                  turns INTEGER NOT NULL DEFAULT 0,
+                  updated_at REAL
+                )
+                """
+            )
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_sessions_worker ON sessions(worker_id, pinned_until)")
+            for tenant, weight in cur.execute("SELECT tenant, weight FROM tenant_weights").fetchall():
+                self.scheduler.set_weight(tenant, weight)
+            self._refresh_tenants(cur)
+            if fts:
+                self._init_fts(cur)
+            cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='tasks_fts'")
+            self.fts_enabled = cur.fetchone() is not None
+            if self.fts_enabled:
+                self._refresh_fts_triggers(cur)
+            self._commit(conn)
         finally:
             self._return_conn(conn)
 
-    def enqueue(self, prompt: str, system_prompt: str | None = None, task_type: str = "chat") -> int:
+    @staticmethod
+    def _init_fts(cur: sqlite3.Cursor) -> None:
+        cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='tasks_fts'")
+        if cur.fetchone() is not None:
+            return
+        try:
+            for stmt in _FTS_SCHEMA:
+                cur.execute(stmt)
+        except sqlite3.OperationalError as e:
+            logging.warning(f"FTS5 unavailable, search falls back to table scans: {e}")
+            return
+        # Backfill rows written before the index existed
+        cur.execute(
+            f"INSERT INTO tasks_fts(rowid, {', '.join(_FTS_COLUMNS)}) SELECT task_id, {_fts_values('tasks')} FROM tasks"
+        )
+
+    @staticmethod
+    def _refresh_fts_triggers(cur: sqlite3.Cursor) -> None:
+        """Recreate the index triggers so databases built by older versions pick up the current expressions."""
+        for name in _FTS_TRIGGERS:
+            cur.execute(f"DROP TRIGGER IF EXISTS {name}")
+        for stmt in _FTS_SCHEMA[1:]:
+            cur.execute(stmt)
+
+    @staticmethod
+    def _migrate_columns(cur: sqlite3.Cursor) -> None:
+        existing = {r[1] for r in cur.execute("PRAGMA table_info(tasks)").fetchall()}
+        for name, ddl in _MIGRATED_COLUMNS.items():
+            if name not in existing:
+                cur.execute(f"ALTER TABLE tasks ADD COLUMN {name} {ddl}")
+
+    def register_template(self, body: str, template_id: str | None = None) -> str:
+        """
+        Store a prompt template (``str.format`` placeholders) once and return
+        its id. Without an explicit id the template is keyed by its content.
+        Templates are immutable, since queued tasks render theirs at lease
+        time: registering a different body under an existing id raises
+        ValueError.
+        """
+        template_id = template_id or f"tpl-{_hash_text(body)[:16]}"
         conn = self._get_conn()
         try:
-            now = time.time()
             cur = conn.cursor()
             cur.execute(
-                "INSERT INTO tasks (prompt, system_prompt, type, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
-                (prompt, system_prompt, task_type, "queued", now, now),
+                "INSERT INTO prompt_templates (template_id, body, created_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(template_id) DO NOTHING",
+                (template_id, body, time.time()),
             )
-            conn.commit()
-            return cur.lastrowid  # type: ignore
+            if cur.rowcount == 0:
+                cur.execute("SELECT body FROM prompt_templates WHERE template_id = ?", (template_id,))
+                if cur.fetchone()[0] != body:
+                    self._rollback(conn)
+                    raise ValueError(f"Template {template_id} is already registered with a different body")
+            self._commit(conn)
         finally:
             self._return_conn(conn)
+        self._cache_after_commit(self._templates, template_id, body)
+        return template_id
 
-    def lease(self, worker_id: str, max_tasks: int, lease_seconds: int) -> list[Task]:
+    def enqueue(
+        self,
+        prompt: str = "",
+        system_prompt: str | None = None,
+        task_type: str = "chat",
+        queue: str = "default",
+        template_id: str | None = None,
+        variables: dict[str, Any] | None = None,
+        tenant: str = "default",
+        job: str | None = None,
+        ttl_seconds: float | None = None,
+        expires_at: float | None = None,
+        deadline: float | None = None,
+        target_worker: str | None = None,
+        target_group: str | None = None,
+        fallback_seconds: float | None = None,
+        session_id: str | None = None,
+    ) -> int:
         """
-        Optimized lease method using atomic UPDATE...RETURNING (P0) 
-        and connection pooling (P1) to eliminate global lock contention.
+        Insert a queued task. System prompts are interned by hash; with
+        ``template_id`` only ``variables`` are stored and the prompt is
+        rendered when the task is leased. ``tenant`` is the fair-share
+        accounting key and ``job`` a free-form grouping tag.
+
+        A task given ``ttl_seconds`` or an absolute ``expires_at`` is never
+        leased after that time; ``expire_stale`` marks it 'expired'. A
+        ``deadline`` (epoch seconds) is when the result is due; it orders
+        leasing in EDF mode and feeds ``deadline_report``.
+
+        ``target_worker`` / ``target_group`` reserve the task for that worker id
+        or for workers leasing as members of that group. With
+        ``fallback_seconds`` any worker may take it once that long has passed.
+
+        Tasks sharing a ``session_id`` are routed to the worker pinned to that
+        session, so it can keep conversation state between turns.
         """
         conn = self._get_conn()
         try:
             now = time.time()
-            leased_until = now + float(lease_seconds)
+            if ttl_seconds is not None:
+                expires_at = now + float(ttl_seconds)
+            target_fallback_at = None
+            if (target_worker or target_group) and fallback_seconds is not None:
+                target_fallback_at = now + float(fallback_seconds)
             cur = conn.cursor()
-            
-            # P0 Optimization: Single atomic UPDATE...RETURNING
-            # Replaces N+1 query pattern (Select + N Updates + N Selects)
+            variables_json = None
+            if template_id:
+                body = self._lookup(cur, "prompt_templates", "template_id", [template_id], self._templates)
+                if template_id not in body:
+                    raise ValueError(f"Unknown template: {template_id}")
+                variables = variables or {}
+                try:
+                    body[template_id].format(**variables)
+                except (KeyError, IndexError) as e:
+                    raise ValueError(f"Template {template_id} is missing variable {e}") from e
+                variables_json = json_dumps(variables).decode("utf-8")
+                prompt = ""
+            if self.admission.limited():
+                self._admit(cur, queue, tenant)
+            sp_hash = self._intern_system_prompt(cur, system_prompt) if system_prompt else None
             cur.execute(
                 """
+                INSERT INTO tasks (
+                  prompt, system_prompt_hash, type, status, created_at, updated_at, queue,
+                  template_id, variables, tenant, job, expires_at, deadline,
+                  target_worker, target_group, target_fallback_at, session_id
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    prompt, sp_hash, task_type, "queued", now, now, queue,
+                    template_id, variables_json, tenant, job, expires_at, deadline,
+                    target_worker, target_group, target_fallback_at, session_id,
+                ),
+            )
+            self._commit(conn)
+            self.scheduler.activate(tenant)
+            if sp_hash:
+                self._cache_after_commit(self._system_prompts, sp_hash, system_prompt)  # type: ignore[arg-type]
+            return cur.lastrowid  # type: ignore
+        finally:
+            self._return_conn(conn)
+
+    def _admit(self, cur: sqlite3.Cursor, queue: str, tenant: str) -> None:
+        """Apply queue-depth limits; raises HubBusyError when the task would exceed one."""
+        # The hub's reaper keeps the depths fresh off the request path; an
+        # enqueue only recounts when nothing has for a while (e.g. no hub)
+        if self.admission.stale(3 * self.admission.refresh_seconds):
+            self.refresh_admission(cur, max_age=3 * self.admission.refresh_seconds)
+        self.admission.admit(queue, tenant)
+
+    def refresh_admission(self, cur: sqlite3.Cursor | None = None, max_age: float | None = None) -> bool:
+        """
+        Recount queued tasks per queue and tenant for admission control, if
+        limits are set and the cached depths are older than ``max_age``
+        (default: the refresh interval). Returns False when another thread
+        is already recounting.
+        """
+        if not self.admission.limited() or not self.admission.stale(max_age):
+            return True
+        if not self._admission_refresh.acquire(blocking=False):
+            return False
+        conn = None
+        try:
+            if cur is None:
+                conn = self._get_conn()
+                cur = conn.cursor()
+            cur.execute("SELECT queue, tenant, COUNT(*) FROM tasks WHERE status = 'queued' GROUP BY queue, tenant")
+            self.admission.refresh([tuple(r) for r in cur.fetchall()])
+            return True
+        finally:
+            if conn is not None:
+                self._return_conn(conn)
+            self._admission_refresh.release()
+
+    def _intern_system_prompt(self, cur: sqlite3.Cursor, text: str) -> str:
+        key = _hash_text(text)
+        if self._system_prompts.get(key) is None:
+            cur.execute("INSERT OR IGNORE INTO system_prompts (hash, body) VALUES (?, ?)", (key, text))
+        return key
+
+    def _lookup(
+        self, cur: sqlite3.Cursor, table: str, key_col: str, keys: list[str], cache: _LruCache
+    ) -> dict[str, str]:
+        found: dict[str, str] = {}
+        missing = []
+        for key in keys:
+            body = cache.get(key)
+            if body is None:
+                missing.append(key)
+            else:
+                found[key] = body
+        if missing:
+            placeholders = ",".join("?" * len(missing))
+            cur.execute(f"SELECT {key_col}, body FROM {table} WHERE {key_col} IN ({placeholders})", missing)
+            for key, body in cur.fetchall():
+                self._cache_after_commit(cache, key, body)
+                found[key] = body
+        return found
+
+    def lease(
+        self,
+        worker_id: str,
+        max_tasks: int,
+        lease_seconds: int,
+        queue: str | None = None,
+        provider: str | None = None,
+        model: str | None = None,
+        groups: list[str] | None = None,
+    ) -> list[Task]:
+        """
+        Claim up to ``max_tasks`` queued tasks, shared between tenants by
+        weighted deficit round robin and FIFO within a tenant.
+
+        Tasks targeted at ``worker_id`` or one of its ``groups`` are claimed
+        first; tasks targeted elsewhere are skipped until their fallback time.
+        Next come turns of sessions pinned to this worker; sessions pinned to
+        another live worker are left for it.
+
+        Expired leases are first put back in their tenant's queue. Each
+        tenant's claim is a single atomic UPDATE...RETURNING over the
+        (status, tenant, task_id) index. When the worker's ``provider``/``model``
+        has a rate limit, tasks beyond the current budget stay queued.
+        """
+        if max_tasks <= 0:
+            return []
+        conn = self._get_conn()
+        try:
+            with self._lease_lock:
+                return self._lease_locked(
+                    conn, worker_id, max_tasks, lease_seconds, queue, provider, model, groups or []
+                )
+        except Exception:
+            self._rollback(conn)
+            raise
+        finally:
+            self._return_conn(conn)
+
+    def _lease_locked(
+        self,
+        conn: sqlite3.Connection,
+        worker_id: str,
+        max_tasks: int,
+        lease_seconds: int,
+        queue: str | None,
+        provider: str | None,
+        model: str | None,
+        groups: list[str],
+    ) -> list[Task]:
+        now = time.time()
+        leased_until = now + float(lease_seconds)
+        cur = conn.cursor()
+        self._reclaim_expired(cur, now)
+
+        rate_keys = self.rate_limiter.keys_for(provider, model)
+        rate_limited = self.rate_limiter.limited(rate_keys)
+        if rate_limited:
+            max_tasks = self.rate_limiter.allowance(rate_keys, max_tasks)
+            if max_tasks == 0:
+                self._commit(conn)
+                return []
+
+        # Expired-but-not-yet-reaped tasks are skipped, never handed out
+        filters = " AND (expires_at IS NULL OR expires_at > ?)"
+        filter_params: list[Any] = [now]
+        if queue:
+            filters += " AND queue = ?"
+            filter_params.append(queue)
+
+        # Outside the targeted phase, only untargeted or fallen-back tasks, and
+        # no turns of a session another worker is still pinned to
+        open_filters = filters + (
+            " AND ((target_worker IS NULL AND target_group IS NULL) OR target_fallback_at <= ?)"
+            " AND (session_id IS NULL OR session_id NOT IN ("
+            "SELECT session_id FROM sessions WHERE pinned_until > ? AND worker_id != ?))"
+        )
+        open_params = [*filter_params, now, now, worker_id]
+
+        def claim(
+            where: str, params: list[Any], order: str, k: int, targeted: bool = False
+        ) -> list[sqlite3.Row]:
+            extra, extra_params = (filters, filter_params) if targeted else (open_filters, open_params)
+            cur.execute(
+                f"""
                 UPDATE tasks
-                SET status='leased', updated_at=?, leased_until=?, worker_id=?
+                SET status='leased', updated_at=?, leased_until=?, worker_id=?, leased_at=?
                 WHERE task_id IN (
                     SELECT task_id FROM tasks
-                    WHERE status = 'queued' OR (status='leased' AND leased_until IS NOT NULL AND leased_until < ?)
-                    ORDER BY task_id ASC
+                    WHERE status = 'queued' AND {where}{extra}
+                    ORDER BY {order}
                     LIMIT ?
                 )
                 RETURNING *
                 """,
-                (now, leased_until, worker_id, now, max_tasks),
+                (now, leased_until, worker_id, now, *params, *extra_params, k),
             )
-            
-            tasks = [self._row_to_task(r) for r in cur.fetchall()]
-            conn.commit()
-            return tasks
+            return cur.fetchall()
+
+        def take(tenant: str, k: int) -> list[sqlite3.Row]:
+            return sorted(claim("tenant = ?", [tenant], "task_id ASC", k), key=lambda r: r["task_id"])
+
+        def has_work(tenant: str) -> bool:
+            cur.execute("SELECT 1 FROM tasks WHERE status = 'queued' AND tenant = ? LIMIT 1", (tenant,))
+            return cur.fetchone() is not None
+
+        # Work addressed to this worker, then to its groups, comes first. Two
+        # claims rather than an OR so each walks its own partial index.
+        rows = sorted(
+            claim("target_worker = ?", [worker_id], "task_id ASC", max_tasks, targeted=True),
+            key=lambda r: r["task_id"],
+        )
+        if groups and len(rows) < max_tasks:
+            rows += sorted(
+                claim(
+                    f"target_group IN ({','.join('?' * len(groups))})",
+                    groups,
+                    "task_id ASC",
+                    max_tasks - len(rows),
+                    targeted=True,
+                ),
+                key=lambda r: r["task_id"],
+            )
+        if len(rows) < max_tasks:
+            rows += sorted(
+                claim(
+                    "session_id IN (SELECT session_id FROM sessions WHERE worker_id = ? AND pinned_until > ?)",
+                    [worker_id, now],
+                    "task_id ASC",
+                    max_tasks - len(rows),
+                ),
+                key=lambda r: r["task_id"],
+            )
+        if self.schedule == "edf" and len(rows) < max_tasks:
+            # SLA work first, earliest deadline first; best-effort work shares what is left
+            rows += sorted(
+                claim("deadline IS NOT NULL", [], "deadline ASC, task_id ASC", max_tasks - len(rows)),
+                key=lambda r: (r["deadline"], r["task_id"]),
+            )
+        if len(rows) < max_tasks:
+            rows += self.scheduler.pick(max_tasks - len(rows), take, has_work)
+        if len(rows) < max_tasks and (not rows or now - self._last_tenant_refresh > 1.0):
+            # Pick up tenants whose rows arrived behind the scheduler's back
+            # (other processes, bulk retries): always when nothing was found
+            # (an index probe on an empty queue), otherwise once a second.
+            self._refresh_tenants(cur)
+            rows += self.scheduler.pick(max_tasks - len(rows), take, has_work)
+
+        tasks = self._rows_to_tasks(cur, rows)
+        if rate_limited:
+            tasks = self._charge_rate_limits(cur, tasks, rate_keys)
+        self._pin_sessions(cur, tasks, worker_id, leased_until, now)
+        self._commit(conn)
+        return tasks
+
+    def _pin_sessions(
+        self, cur: sqlite3.Cursor, tasks: list[Task], worker_id: str, leased_until: float, now: float
+    ) -> None:
+        """
+        Pin each leased session to this worker for the lease plus the affinity
+        window, and report its finished turns so the worker can tell whether
+        its cached conversation is still complete.
+        """
+        sessions = sorted({t.session_id for t in tasks if t.session_id})
+        if not sessions:
+            return
+        cur.executemany(
+            """
+            INSERT INTO sessions (session_id, worker_id, pinned_until, updated_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(session_id) DO UPDATE SET
+              worker_id=excluded.worker_id, pinned_until=excluded.pinned_until, updated_at=excluded.updated_at
+            """,
+            [(sid, worker_id, leased_until + self.session_affinity, now) for sid in sessions],
+        )
+        cur.execute(
+            f"SELECT session_id, turns FROM sessions WHERE session_id IN ({','.join('?' * len(sessions))})", sessions
+        )
+        turns = {r["session_id"]: int(r["turns"]) for r in cur.fetchall()}
+        for i, task in enumerate(tasks):
+            if task.session_id:
+                tasks[i] = replace(task, session_turns=turns.get(task.session_id))
+
+    def _charge_rate_limits(self, cur: sqlite3.Cursor, tasks: list[Task], rate_keys: list[str]) -> list[Task]:
+        """Charge each claimed task to the token budget; put back what does not fit."""
+        for i, task in enumerate(tasks):
+            if not self.rate_limiter.try_consume(rate_keys, estimate_tokens(task.prompt, task.system_prompt)):
+                over = [t.task_id for t in tasks[i:]]
+                cur.execute(
+                    f"""
+                    UPDATE tasks SET status='queued', leased_until=NULL, worker_id=NULL, leased_at=NULL
+                    WHERE task_id IN ({",".join("?" * len(over))})
+                    """,
+                    over,
+                )
+                return tasks[:i]
+        return tasks
+
+    def _reclaim_expired(self, cur: sqlite3.Cursor, now: float) -> None:
+        cur.execute(
+            """
+            UPDATE tasks
+            SET status='queued', leased_until=NULL, worker_id=NULL, leased_at=NULL
+            WHERE status='leased' AND leased_until IS NOT NULL AND leased_until < ?
+            RETURNING tenant, session_id
+            """,
+            (now,),
+        )
+        rows = cur.fetchall()
+        for tenant in {r["tenant"] for r in rows}:
+            self.scheduler.activate(tenant)
+        # The pinned worker let a turn lapse; fail its sessions over to anyone
+        lapsed = sorted({r["session_id"] for r in rows if r["session_id"]})
+        if lapsed:
+            cur.executemany("UPDATE sessions SET pinned_until = ? WHERE session_id = ?", [(now, s) for s in lapsed])
+
+    def _refresh_tenants(self, cur: sqlite3.Cursor) -> None:
+        self._last_tenant_refresh = time.time()
+        # Skip from tenant to tenant down the ready index: one seek per tenant,
+        # however many tasks each has queued
+        cur.execute(
+            """
+            WITH RECURSIVE ready(tenant) AS (
+              SELECT MIN(tenant) FROM tasks WHERE status = 'queued'
+              UNION ALL
+              SELECT (SELECT MIN(tenant) FROM tasks WHERE status = 'queued' AND tenant > ready.tenant)
+              FROM ready WHERE ready.tenant IS NOT NULL
+            )
+            SELECT tenant FROM ready WHERE tenant IS NOT NULL
+            """
+        )
+        for (tenant,) in cur.fetchall():
+            self.scheduler.activate(tenant)
+
+    def deadline_report(self, limit: int = 1000, window_seconds: float = 3600) -> dict[str, Any]:
+        """
+        Project when each queued deadline task will finish if work proceeds
+        earliest-deadline-first, and flag the ones that will miss.
+
+        Run time per task type is the median measured over ``window_seconds``
+        and capacity is the number of workers seen in that window. Only the
+        ``limit`` most urgent tasks are projected.
+        """
+        conn = self._get_conn()
+        try:
+            now = time.time()
+            since = now - window_seconds
+            cur = conn.cursor()
+            cur.execute(
+                """
+                SELECT type, finished_at - started_at AS run FROM tasks
+                WHERE finished_at >= ? AND started_at IS NOT NULL AND status = 'done'
+                """,
+                (since,),
+            )
+            samples: dict[str, list[float]] = {}
+            for r in cur.fetchall():
+                samples.setdefault(r["type"], []).append(r["run"])
+            run_p50 = {t: _percentile(sorted(v), 50) for t, v in samples.items()}
+            every = sorted(v for vals in samples.values() for v in vals)
+            fallback = _percentile(every, 50) if every else 0.0
+
+            cur.execute(
+                """
+                SELECT COUNT(DISTINCT worker_id) FROM tasks
+                WHERE worker_id IS NOT NULL AND (leased_at >= ? OR finished_at >= ?)
+                """,
+                (since, since),
+            )
+            workers = max(1, int(cur.fetchone()[0] or 0))
+
+            cur.execute(
+                """
+                SELECT task_id, type, deadline, tenant FROM tasks
+                WHERE status = 'queued' AND deadline IS NOT NULL
+                ORDER BY deadline ASC
+                LIMIT ?
+                """,
+                (limit,),
+            )
+            backlog = 0.0
+            at_risk = []
+            for r in cur.fetchall():
+                backlog += run_p50.get(r["type"], fallback)
+                projected = now + backlog / workers
+                if projected > r["deadline"]:
+                    at_risk.append(
+                        {
+                            "task_id": int(r["task_id"]),
+                            "type": r["type"],
+                            "tenant": r["tenant"],
+                            "deadline": r["deadline"],
+                            "projected_finish": round(projected, 3),
+                            "late_by_sec": round(projected - r["deadline"], 3),
+                        }
+                    )
+            return {
+                "workers": workers,
+                "run_time_p50_sec": {t: round(v, 3) for t, v in run_p50.items()},
+                "projected_misses": len(at_risk),
+                "at_risk": at_risk,
+            }
         finally:
             self._return_conn(conn)
 
-    def ack(self, task_id: int, status: str, result: str | None, error: str | None) -> None:
+    def expire_stale(self) -> list[int]:
+        """Mark queued tasks past their ``expires_at`` as 'expired' in one statement; returns their ids."""
         conn = self._get_conn()
         try:
             now = time.time()
-            status_norm = status.lower().strip()
-            if status_norm not in {"done", "failed"}:
-                raise ValueError("status must be done|failed")
-                
             cur = conn.cursor()
             cur.execute(
                 """
                 UPDATE tasks
-                SET status=?, updated_at=?, leased_until=NULL, result=?, error=?
-                WHERE task_id=?
+                SET status='expired', updated_at=?, finished_at=?, error='expired before execution'
+                WHERE status='queued' AND expires_at IS NOT NULL AND expires_at <= ?
+                RETURNING task_id
                 """,
-                (status_norm, now, result, error, task_id),
+                (now, now, now),
             )
-            conn.commit()
+            expired = [int(r["task_id"]) for r in cur.fetchall()]
+            self._commit(conn)
+            return expired
+        finally:
+            self._return_conn(conn)
+
+    def cancel(self, task_ids: list[int]) -> list[int]:
+        """
+        Mark queued or leased tasks 'cancelled'; returns the ids that were.
+        A worker still running one has its later ack ignored.
+        """
+        if not task_ids:
+            return []
+        conn = self._get_conn()
+        try:
+            now = time.time()
+            cur = conn.cursor()
+            ids = [int(t) for t in task_ids]
+            cancelled: list[int] = []
+            for i in range(0, len(ids), _MAX_IDS_PER_QUERY):
+                chunk = ids[i:i + _MAX_IDS_PER_QUERY]
+                cur.execute(
+                    f"""
+                    UPDATE tasks
+                    SET status='cancelled', updated_at=?, finished_at=?, leased_until=NULL, error='cancelled'
+                    WHERE task_id IN ({','.join('?' * len(chunk))}) AND status IN ('queued', 'leased')
+                    RETURNING task_id
+                    """,
+                    (now, now, *chunk),
+                )
+                cancelled.extend(int(r["task_id"]) for r in cur.fetchall())
+            cancelled.sort()
+            self._commit(conn)
+            return cancelled
+        finally:
+            self._return_conn(conn)
+
+    def get_tasks(self, task_ids: list[int]) -> list[Task]:
+        """Fetch specific tasks by id (missing ids are skipped)."""
+        if not task_ids:
+            return []
+        ids = sorted({int(t) for t in task_ids})
+        conn = self._get_conn()
+        try:
+            cur = conn.cursor()
+            rows: list[sqlite3.Row] = []
+            for i in range(0, len(ids), _MAX_IDS_PER_QUERY):
+                chunk = ids[i:i + _MAX_IDS_PER_QUERY]
+                cur.execute(
+                    f"SELECT * FROM tasks WHERE task_id IN ({','.join('?' * len(chunk))}) ORDER BY task_id", chunk
+                )
+                rows.extend(cur.fetchall())
+            return self._rows_to_tasks(cur, rows)
+        finally:
+            self._return_conn(conn)
+
+    def set_tenant_weight(self, tenant: str, weight: float) -> None:
+        """Set a tenant's fair-share weight (default 1.0); persisted across restarts."""
+        self.scheduler.set_weight(tenant, weight)
+        conn = self._get_conn()
+        try:
+            conn.execute("INSERT OR REPLACE INTO tenant_weights (tenant, weight) VALUES (?, ?)", (tenant, float(weight)))
+            self._commit(conn)
+        finally:
+            self._return_conn(conn)
+
+    def tenant_report(self) -> dict[str, Any]:
+        """Queued and leased counts per tenant, with their weights."""
+        conn = self._get_conn()
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                SELECT tenant, status, COUNT(*) AS n FROM tasks
+                WHERE status IN ('queued', 'leased')
+                GROUP BY tenant, status
+                """
+            )
+            tenants: dict[str, dict[str, Any]] = {}
+            for r in cur.fetchall():
+                entry = tenants.setdefault(
+                    r["tenant"], {"queued": 0, "leased": 0, "weight": self.scheduler.weight(r["tenant"])}
+                )
+                entry[r["status"]] = int(r["n"])
+            return tenants
+        finally:
+            self._return_conn(conn)
+
+    _ACK_SQL = """
+        UPDATE tasks
+        SET status=?, updated_at=?, leased_until=NULL, result=?, error=?,
+            started_at=COALESCE(?, leased_at), finished_at=?, provider_time_sec=?
+        WHERE task_id=? AND status != 'cancelled'
+    """
+
+    @staticmethod
+    def _ack_params(
+        now: float,
+        task_id: int,
+        status: str,
+        result: str | None,
+        error: str | None,
+        started_at: float | None = None,
+        provider_time_sec: float | None = None,
+    ) -> tuple[Any, ...]:
+        status_norm = status.lower().strip()
+        if status_norm not in {"done", "failed"}:
+            raise ValueError("status must be done|failed")
+        return (status_norm, now, result, error, started_at, now, provider_time_sec, task_id)
+
+    # A finished turn keeps its session pinned for the affinity window
+    _SESSION_ACK_SQL = """
+        UPDATE sessions SET pinned_until=?, turns=turns+1, updated_at=?
+        WHERE session_id=(SELECT session_id FROM tasks WHERE task_id=?)
+    """
+
+    def ack(
+        self,
+        task_id: int,
+        status: str,
+        result: str | None,
+        error: str | None,
+        started_at: float | None = None,
+        provider_time_sec: float | None = None,
+    ) -> None:
+        """
+        Complete a task. ``started_at`` and ``provider_time_sec`` are optional
+        agent-reported timings; without them run time is measured from the lease.
+        """
+        params = self._ack_params(time.time(), task_id, status, result, error, started_at, provider_time_sec)
+        conn = self._get_conn()
+        try:
+            cur = conn.cursor()
+            cur.execute(self._ACK_SQL, params)
+            cur.execute(self._SESSION_ACK_SQL, (params[1] + self.session_affinity, params[1], task_id))
+            self._commit(conn)
+        finally:
+            self._return_conn(conn)
+
+    def ack_many(self, acks: list[dict[str, Any]]) -> int:
+        """
+        Complete several tasks in a single transaction. Each entry takes the
+        same fields as ``ack``: task_id, status, result, error and the optional
+        timings. Returns the number of tasks updated.
+        """
+        now = time.time()
+        rows = [
+            self._ack_params(
+                now,
+                int(a["task_id"]),
+                str(a["status"]),
+                a.get("result"),
+                a.get("error"),
+                a.get("started_at"),
+                a.get("provider_time_sec"),
+            )
+            for a in acks
+        ]
+        if not rows:
+            return 0
+        conn = self._get_conn()
+        try:
+            cur = conn.cursor()
+            cur.executemany(self._ACK_SQL, rows)
+            count = cur.rowcount
+            cur.executemany(self._SESSION_ACK_SQL, [(now + self.session_affinity, now, r[-1]) for r in rows])
+            self._commit(conn)
+            return count
+        finally:
+            self._return_conn(conn)
+
+    def session_history(self, session_id: str, limit: int = 50) -> dict[str, Any]:
+        """
+        The most recent ``limit`` turns of a session, oldest first, with its
+        current pin. A worker that picks up a session cold rebuilds from this.
+        """
+        conn = self._get_conn()
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT worker_id, pinned_until, turns FROM sessions WHERE session_id = ?", (session_id,)
+            )
+            pin = cur.fetchone()
+            cur.execute(
+                """
+                SELECT * FROM tasks
+                WHERE status IN ('queued', 'leased', 'done', 'failed', 'expired') AND session_id = ?
+                ORDER BY task_id DESC LIMIT ?
+                """,
+                (session_id, int(limit)),
+            )
+            tasks = self._rows_to_tasks(cur, cur.fetchall())
+            return {
+                "session_id": session_id,
+                "worker_id": pin["worker_id"] if pin else None,
+                "pinned_until": pin["pinned_until"] if pin else None,
+                "turns": pin["turns"] if pin else 0,
+                "tasks": tasks[::-1],
+            }
+        finally:
+            self._return_conn(conn)
+
+    def release_many(self, task_ids: list[int], worker_id: str | None = None) -> int:
+        """
+        Put leased tasks straight back to 'queued' instead of waiting for the
+        lease to expire. When ``worker_id`` is given only that worker's leases
+        are released.
+        """
+        if not task_ids:
+            return 0
+        conn = self._get_conn()
+        try:
+            now = time.time()
+            cur = conn.cursor()
+            ids = [int(t) for t in task_ids]
+            worker_filter = "AND worker_id = ?" if worker_id else ""
+            worker_params: tuple[Any, ...] = (worker_id,) if worker_id else ()
+            tenants: list[str] = []
+            for i in range(0, len(ids), _MAX_IDS_PER_QUERY):
+                chunk = ids[i:i + _MAX_IDS_PER_QUERY]
+                cur.execute(
+                    f"""
+                    UPDATE tasks
+                    SET status='queued', updated_at=?, leased_until=NULL, worker_id=NULL, leased_at=NULL
+                    WHERE status='leased' AND task_id IN ({','.join('?' * len(chunk))}) {worker_filter}
+                    RETURNING tenant
+                    """,
+                    (now, *chunk, *worker_params),
+                )
+                tenants.extend(r["tenant"] for r in cur.fetchall())
+            self._commit(conn)
+            for tenant in set(tenants):
+                self.scheduler.activate(tenant)
+            return len(tenants)
         finally:
             self._return_conn(conn)
 
@@ -158,12 +1206,12 @@ class TaskStore:
             cur.execute(
                 """
                 UPDATE tasks
-                SET status='done', updated_at=?, leased_until=NULL, result=?, worker_id=?
+                SET status='done', updated_at=?, leased_until=NULL, result=?, worker_id=?, finished_at=?
                 WHERE task_id=?
                 """,
-                (now, f"Approved by {approver}", approver, task_id),
+                (now, f"Approved by {approver}", approver, now, task_id),
             )
-            conn.commit()
+            self._commit(conn)
         finally:
             self._return_conn(conn)
 
@@ -187,7 +1235,74 @@ class TaskStore:
                 else:
                     cur.execute("SELECT * FROM tasks ORDER BY task_id DESC LIMIT ?", (limit,))
 
-            return [self._row_to_task(r) for r in cur.fetchall()]
+            return self._rows_to_tasks(cur, cur.fetchall())
+        finally:
+            self._return_conn(conn)
+
+    def search(
+        self,
+        query: str,
+        status: str | None = None,
+        limit: int = 50,
+        cursor: int | None = None,
+    ) -> tuple[list[Task], int | None]:
+        """
+        Newest-first search over prompt, system prompt, result and error.
+
+        With the FTS5 index ``query`` uses FTS5 query syntax; without it the
+        query is matched as a plain substring. ``cursor`` is the ``next_cursor``
+        of the previous page.
+        """
+        conn = self._get_conn()
+        try:
+            cur = conn.cursor()
+            status_norm = status.lower().strip() if status else None
+            where: list[str] = []
+            params: list[Any] = []
+            if self.fts_enabled:
+                sql = "SELECT t.* FROM tasks_fts f JOIN tasks t ON t.task_id = f.rowid WHERE tasks_fts MATCH ?"
+                params.append(query)
+                id_col = "f.rowid"
+            else:
+                # The same texts the index would hold
+                expressions = _fts_expressions("t")
+                like = " OR ".join(f"({e}) LIKE ?" for e in expressions)
+                sql = f"SELECT * FROM tasks t WHERE ({like})"
+                params.extend([f"%{query}%"] * len(expressions))
+                id_col = "t.task_id"
+            if status_norm:
+                where.append("t.status = ?")
+                params.append(status_norm)
+            if cursor is not None:
+                where.append(f"{id_col} < ?")
+                params.append(int(cursor))
+            for clause in where:
+                sql += f" AND {clause}"
+            sql += f" ORDER BY {id_col} DESC LIMIT ?"
+            params.append(limit)
+
+            try:
+                cur.execute(sql, params)
+            except sqlite3.OperationalError as e:
+                raise ValueError(f"Invalid search query: {e}") from e
+            tasks = self._rows_to_tasks(cur, cur.fetchall())
+            next_cursor = tasks[-1].task_id if len(tasks) == limit else None
+            return tasks, next_cursor
+        finally:
+            self._return_conn(conn)
+
+    def active_counts(self) -> list[tuple[str, str, int]]:
+        """
+        (queue, status, count) of queued and leased tasks. Still one pass per
+        active task, but over the (status, queue, tenant) index alone.
+        """
+        conn = self._get_conn()
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT queue, status, COUNT(*) FROM tasks WHERE status IN ('queued', 'leased') GROUP BY queue, status"
+            )
+            return [(str(q), str(s), int(n)) for q, s, n in cur.fetchall()]
         finally:
             self._return_conn(conn)
 
@@ -196,7 +1311,7 @@ class TaskStore:
         try:
             cur = conn.cursor()
             cur.execute("SELECT status, COUNT(*) AS n FROM tasks GROUP BY status")
-            out: dict[str, Any] = {"queued": 0, "leased": 0, "done": 0, "failed": 0}
+            out: dict[str, Any] = {"queued": 0, "leased": 0, "done": 0, "failed": 0, "expired": 0, "cancelled": 0}
             total = 0
             for r in cur.fetchall():
                 c = int(r["n"])
@@ -216,6 +1331,17 @@ class TaskStore:
             avg_dur = res_avg[0] if res_avg else None
             out["avg_completion_time_sec"] = round(avg_dur, 2) if avg_dur else 0.0
 
+            # Rich Metrics: split end-to-end time into queue wait and execution
+            cur.execute(
+                """
+                SELECT AVG(leased_at - created_at), AVG(finished_at - started_at)
+                FROM tasks WHERE status='done' AND finished_at IS NOT NULL
+                """
+            )
+            avg_wait, avg_run = cur.fetchone()
+            out["avg_queue_wait_sec"] = round(avg_wait, 2) if avg_wait else 0.0
+            out["avg_run_time_sec"] = round(avg_run, 2) if avg_run else 0.0
+
             # Rich Metrics: Error Rate
             failed = out["failed"]
             done = out["done"]
@@ -236,23 +1362,155 @@ class TaskStore:
             cur.execute(
                 """
                 UPDATE tasks
-                SET status='queued', updated_at=?, leased_until=NULL, worker_id=NULL, result=NULL, error=NULL
+                SET status='queued', updated_at=?, leased_until=NULL, worker_id=NULL, result=NULL, error=NULL,
+                    leased_at=NULL, started_at=NULL, finished_at=NULL, provider_time_sec=NULL
                 WHERE status='failed'
                 """,
                 (now,),
             )
             count = cur.rowcount
-            conn.commit()
+            self._commit(conn)
+            if count:
+                self._refresh_tenants(cur)
             return count
         finally:
             self._return_conn(conn)
 
+    def wal_size_bytes(self) -> int:
+        try:
+            return os.path.getsize(self.db_path + "-wal")
+        except OSError:
+            return 0
+
+    def checkpoint(self, mode: str = "PASSIVE", wait: bool = True) -> dict[str, Any]:
+        """
+        Run a WAL checkpoint on a dedicated connection. PASSIVE copies what it
+        can without waiting on anyone; TRUNCATE also resets the -wal file once
+        readers and writers let it. TRUNCATE holds the write lock while it
+        waits for readers, so ``wait=False`` makes it give up (``busy``) at
+        once rather than stall writers for the busy timeout.
+        """
+        mode = mode.upper()
+        if mode not in {"PASSIVE", "FULL", "RESTART", "TRUNCATE"}:
+            raise ValueError("mode must be PASSIVE|FULL|RESTART|TRUNCATE")
+        conn = self._connect()
+        try:
+            if not wait:
+                conn.execute("PRAGMA busy_timeout=0;")
+            busy, log_frames, checkpointed = conn.execute(f"PRAGMA wal_checkpoint({mode});").fetchone()
+            return {"mode": mode, "busy": bool(busy), "log_frames": log_frames, "checkpointed_frames": checkpointed}
+        finally:
+            conn.close()
+
+    def backup(self, path: str, pages: int = 256, sleep: float = 0.005) -> dict[str, Any]:
+        """
+        Copy the database to ``path`` with the SQLite online backup API,
+        ``pages`` at a time. Steps run back to back: ``sleep`` is only the
+        back-off before retrying a step that hit SQLITE_BUSY/LOCKED. Writers
+        keep moving regardless, since WAL readers do not block them.
+
+        A read transaction is held on the source for the whole copy, so the
+        backup is a consistent snapshot and never restarts because of
+        concurrent writes (WAL readers do not block writers).
+        """
+        live = os.path.realpath(self.db_path)
+        if os.path.realpath(path) in {live, f"{live}-wal", f"{live}-shm"}:
+            raise ValueError("Refusing to back up the database over itself")
+        start = time.perf_counter()
+        steps = 0
+
+        def progress(status: int, remaining: int, total: int) -> None:
+            nonlocal steps
+            steps += 1
+
+        src = self._connect()
+        dest = sqlite3.connect(path)
+        try:
+            src.execute("BEGIN")
+            src.execute("SELECT 1 FROM tasks LIMIT 1").fetchone()
+            src.backup(dest, pages=pages, sleep=sleep, progress=progress)
+            src.rollback()
+            page_count = dest.execute("PRAGMA page_count;").fetchone()[0]
+            page_size = dest.execute("PRAGMA page_size;").fetchone()[0]
+        finally:
+            dest.close()
+            src.close()
+        return {
+            "path": path,
+            "pages": page_count,
+            "bytes": page_count * page_size,
+            "steps": steps,
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+
+    def latency_report(self, group_by: str = "type", since_seconds: float | None = None) -> dict[str, Any]:
+        """
+        Queue-wait, run-time and end-to-end percentiles of finished tasks,
+        grouped by task type, queue or worker. Expired and cancelled tasks
+        never ran and are left out.
+        """
+        column = _LATENCY_GROUPS.get(group_by)
+        if column is None:
+            raise ValueError(f"group_by must be one of {'|'.join(_LATENCY_GROUPS)}")
+
+        conn = self._get_conn()
+        try:
+            cur = conn.cursor()
+            since = time.time() - since_seconds if since_seconds else 0.0
+            cur.execute(
+                f"""
+                SELECT {column} AS grp, created_at, leased_at, started_at, finished_at, provider_time_sec
+                FROM tasks
+                WHERE finished_at IS NOT NULL AND finished_at >= ? AND status IN ('done', 'failed')
+                """,
+                (since,),
+            )
+            samples: dict[str, dict[str, list[float]]] = {}
+            for r in cur.fetchall():
+                grp = samples.setdefault(
+                    str(r["grp"]),
+                    {"queue_wait": [], "run_time": [], "end_to_end": [], "provider_time": []},
+                )
+                grp["end_to_end"].append(r["finished_at"] - r["created_at"])
+                if r["leased_at"] is not None:
+                    grp["queue_wait"].append(r["leased_at"] - r["created_at"])
+                if r["started_at"] is not None:
+                    grp["run_time"].append(r["finished_at"] - r["started_at"])
+                if r["provider_time_sec"] is not None:
+                    grp["provider_time"].append(r["provider_time_sec"])
+
+            groups = {
+                name: {metric: _summarize(values) for metric, values in metrics.items()}
+                for name, metrics in samples.items()
+            }
+            return {"group_by": group_by, "since_seconds": since_seconds, "groups": groups}
+        finally:
+            self._return_conn(conn)
+
+    def _rows_to_tasks(self, cur: sqlite3.Cursor, rows: list[sqlite3.Row]) -> list[Task]:
+        """Materialise templated prompts and interned system prompts."""
+        template_ids = {r["template_id"] for r in rows if r["template_id"]}
+        sp_hashes = {r["system_prompt_hash"] for r in rows if r["system_prompt_hash"]}
+        templates = self._lookup(cur, "prompt_templates", "template_id", list(template_ids), self._templates)
+        system_prompts = self._lookup(cur, "system_prompts", "hash", list(sp_hashes), self._system_prompts)
+
+        tasks = []
+        for row in rows:
+            prompt = str(row["prompt"])
+            if row["template_id"]:
+                prompt = templates[row["template_id"]].format(**json_loads(row["variables"] or "{}"))
+            system_prompt = row["system_prompt"]
+            if system_prompt is None and row["system_prompt_hash"]:
+                system_prompt = system_prompts[row["system_prompt_hash"]]
+            tasks.append(self._row_to_task(row, prompt, system_prompt))
+        return tasks
+
     @staticmethod
-    def _row_to_task(row: sqlite3.Row) -> Task:
+    def _row_to_task(row: sqlite3.Row, prompt: str, system_prompt: str | None) -> Task:
         return Task(
             task_id=int(row["task_id"]),
-            prompt=str(row["prompt"]),
-            system_prompt=row["system_prompt"],
+            prompt=prompt,
+            system_prompt=system_prompt,
             type=row["type"] if "type" in row.keys() else "chat",
             status=str(row["status"]),
             created_at=float(row["created_at"]),
@@ -261,5 +1519,18 @@ class TaskStore:
             worker_id=str(row["worker_id"]) if row["worker_id"] is not None else None,
             result=str(row["result"]) if row["result"] is not None else None,
             error=str(row["error"]) if row["error"] is not None else None,
+            queue=str(row["queue"]),
+            leased_at=row["leased_at"],
+            started_at=row["started_at"],
+            finished_at=row["finished_at"],
+            provider_time_sec=row["provider_time_sec"],
+            tenant=str(row["tenant"]),
+            job=row["job"],
+            expires_at=row["expires_at"],
+            deadline=row["deadline"],
+            target_worker=row["target_worker"],
+            target_group=row["target_group"],
+            target_fallback_at=row["target_fallback_at"],
+            session_id=row["session_id"],
         )
 
@@ -1,91 +1,868 @@
 from __future__ import annotations
 
-import json
+import asyncio
+import functools
 import logging
 import os
-import socketserver
+import signal
+import socket
+import sqlite3
+import stat
 import threading
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import asdict
-from typing import Any
+from typing import Any, Callable
 
-from .db import TaskStore
+from .auth import new_nonce, token_matches, verify
+from .codec import FRAME_HEADER, JSONL, Codec, negotiate, preferred
+from .backpressure import BUSY, HubBusyError
+from .config import get_queue_limits, get_rate_limits
+from .db import TERMINAL_STATUSES, TaskStore
+from .metrics import HubMetrics
 
 
-class _HubState:
-    def __init__(self, store: TaskStore, lease_seconds: int):
+# Parked leases re-run at least this often, to pick up work that becomes
+# eligible by the clock (lapsed leases, target fallbacks, rate-limit refills)
+# or arrives from outside this process.
+LEASE_RECHECK_SECONDS = 5.0
+MAX_LEASE_WAIT_SECONDS = 300.0
+MAX_RUN_SECONDS = 3600.0
+# Largest request line accepted (prompts travel inline)
+MAX_LINE_BYTES = 64 * 1024 * 1024
+# A client this far behind on reading its responses and events is dropped
+MAX_WRITE_BUFFER_BYTES = 64 * 1024 * 1024
+# Requests from one connection dispatched concurrently before reading pauses
+MAX_IN_FLIGHT = 64
+# Methods that wait, or manage the hub itself, rather than run a store call;
+# within a batch they are answered on their own, outside its transaction
+UNBATCHED_METHODS = frozenset({"hello", "auth", "ping", "lease", "run", "backup", "checkpoint", "shutdown"})
+
+
+class UnknownMethodError(ValueError):
+    pass
+
+
+class _Waiter:
+    """A parked lease; signalled from storage threads, awaited on the event loop."""
+
+    __slots__ = ("worker_id", "queue", "groups", "signalled", "_event", "_loop")
+
+    def __init__(self, worker_id: str, queue: str | None, groups: list[str]):
+        self.worker_id = worker_id
+        self.queue = queue
+        self.groups = groups
+        self.signalled = False
+        self._event = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+
+    def set(self) -> None:
+        self.signalled = True
+        self._loop.call_soon_threadsafe(self._event.set)
+
+    def clear(self) -> None:
+        self.signalled = False
+        self._event.clear()
+
+    async def wait(self, timeout: float) -> None:
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class LeaseWaiters:
+    """
+    Long-poll leases parked until matching work arrives. Each enqueued task
+    wakes one eligible waiter, oldest first, rather than the whole herd.
+    """
+
+    def __init__(self) -> None:
+        self._waiters: list[_Waiter] = []
+        self._lock = threading.Lock()
+
+    def park(self, worker_id: str, queue: str | None, groups: list[str]) -> _Waiter:
+        waiter = _Waiter(worker_id, queue, groups)
+        with self._lock:
+            self._waiters.append(waiter)
+        return waiter
+
+    def unpark(self, waiter: _Waiter) -> None:
+        with self._lock:
+            self._waiters.remove(waiter)
+
+    def notify(
+        self,
+        queue: str,
+        target_worker: str | None = None,
+        target_group: str | None = None,
+        count: int = 1,
+    ) -> None:
+        with self._lock:
+            for w in self._waiters:
+                if count <= 0:
+                    break
+                if w.signalled or (w.queue is not None and w.queue != queue):
+                    continue
+                if (target_worker or target_group) and w.worker_id != target_worker and target_group not in w.groups:
+                    continue
+                w.set()
+                count -= 1
+
+    def notify_all(self) -> None:
+        with self._lock:
+            for w in self._waiters:
+                w.set()
+
+    def __len__(self) -> int:
+        return len(self._waiters)
+
+
+class Subscription:
+    __slots__ = ("sub_id", "conn", "task_ids", "job", "queue", "statuses")
+
+    def __init__(
+        self,
+        conn: Any,
+        task_ids: set[int] | None,
+        job: str | None,
+        queue: str | None,
+        statuses: set[str] | None,
+    ):
+        self.sub_id = uuid.uuid4().hex[:12]
+        self.conn = conn
+        self.task_ids = task_ids
+        self.job = job
+        self.queue = queue
+        self.statuses = statuses
+
+    def matches(self, task: dict[str, Any]) -> bool:
+        return (
+            (self.task_ids is None or task["task_id"] in self.task_ids)
+            and (self.job is None or task["job"] == self.job)
+            and (self.queue is None or task["queue"] == self.queue)
+            and (self.statuses is None or task["status"] in self.statuses)
+        )
+
+
+class EventBus:
+    """
+    Pushes task state changes to subscribed connections as JSONL messages
+    without an "id": {"event": "task", "subscription": ..., "task": {...}}.
+    Costs nothing while nobody is subscribed.
+    """
+
+    def __init__(self, store: TaskStore) -> None:
         self.store = store
-        self.lease_seconds = lease_seconds
+        self._subs: dict[str, Subscription] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, conn: Any, **filters: Any) -> str:
+        sub = Subscription(conn, **filters)
+        with self._lock:
+            self._subs[sub.sub_id] = sub
+        return sub.sub_id
+
+    def unsubscribe(self, sub_id: str) -> bool:
+        with self._lock:
+            return self._subs.pop(sub_id, None) is not None
+
+    def has_subscriptions(self, conn: Any) -> bool:
+        with self._lock:
+            return any(sub.conn is conn for sub in self._subs.values())
+
+    def drop_connection(self, conn: Any) -> None:
+        with self._lock:
+            for sub_id in [k for k, sub in self._subs.items() if sub.conn is conn]:
+                del self._subs[sub_id]
+
+    def publish_ids(self, task_ids: list[int]) -> None:
+        if self._subs and task_ids:
+            self.publish(self.store.get_tasks(task_ids))
+
+    def publish(self, tasks: list[Any]) -> None:
+        if not self._subs:
+            return
+        with self._lock:
+            subs = list(self._subs.values())
+        for task in tasks:
+            data = asdict(task)
+            for sub in subs:
+                if not sub.matches(data):
+                    continue
+                try:
+                    sub.conn.send_message({"event": "task", "subscription": sub.sub_id, "task": data})
+                except (OSError, RuntimeError):
+                    self.drop_connection(sub.conn)
+
+
+class _Completion:
+    """EventBus sink resolving a future on the event loop with the first matching task."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+        self.future: asyncio.Future[dict[str, Any]] = loop.create_future()
+
+    def send_message(self, msg: dict[str, Any]) -> None:
+        self._loop.call_soon_threadsafe(self._resolve, msg["task"])
+
+    def _resolve(self, task: dict[str, Any]) -> None:
+        if not self.future.done():
+            self.future.set_result(task)
+
+
+class _HubState:
+    def __init__(
+        self, store: TaskStore, lease_seconds: int, max_workers: int = 16, backup_dir: str | None = None
+    ):
         self.store = store
         self.lease_seconds = lease_seconds
+        # The only place the backup RPC may write; defaults to backups/ beside the database
+        self.backup_dir = os.path.realpath(
+            backup_dir or os.path.join(os.path.dirname(os.path.abspath(store.db_path)), "backups")
+        )
+        # Storage calls run here, off the event loop; its size bounds how many
+        # requests touch SQLite at once however many clients are connected.
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hub-store")
         self._shutdown = threading.Event()
         self.auth_key = os.environ.get("KIRO_SWARM_KEY")
+        self.last_activity = time.monotonic()
+        # Held while a backup reads its snapshot; checkpoints wait their turn
+        self.backup_lock = threading.Lock()
+        self.waiters = LeaseWaiters()
+        self.events = EventBus(store)
+        # Event pushes and lease wake-ups held back while a batch is uncommitted
+        self._deferred = threading.local()
+        self.metrics = HubMetrics()
+        self.metrics.add_collector(self._collect_metrics)
+        # Resolved on the event loop once shutdown is requested, from any thread
+        self.stopping: asyncio.Future | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def _collect_metrics(self) -> None:
+        counts: dict[tuple[str, ...], float] = {}
+        for queue, status, n in self.store.active_counts():
+            counts.setdefault((queue, "queued"), 0)
+            counts.setdefault((queue, "leased"), 0)
+            counts[(queue, status)] = n
+        self.metrics.tasks.replace(counts)
+        self.metrics.wal_size.set(value=self.store.wal_size_bytes())
+
+    def after_commit(self, fn: Callable[..., Any], *args: Any) -> None:
+        """Call ``fn(*args)`` now, or once the batch running in this thread commits."""
+        pending = getattr(self._deferred, "calls", None)
+        if pending is None:
+            fn(*args)
+        else:
+            pending.append((fn, args))
+
+    def run_batch(self, steps: list[Callable[[], Any]]) -> list[tuple[Any, Exception | None]]:
+        """
+        Run ``steps`` in one store transaction, each behind a savepoint so a
+        failing step is undone on its own and its error returned in place of
+        a result. Side effects of the steps that stuck go out after commit.
+        """
+        calls: list[tuple[Callable[..., Any], tuple[Any, ...]]] = []
+        outcomes: list[tuple[Any, Exception | None]] = []
+        self._deferred.calls = calls
+        try:
+            with self.store.batch():
+                for step in steps:
+                    mark = len(calls)
+                    try:
+                        with self.store.savepoint():
+                            outcomes.append((step(), None))
+                    except Exception as e:
+                        del calls[mark:]
+                        outcomes.append((None, e))
+        finally:
+            self._deferred.calls = None
+        for fn, args in calls:
+            fn(*args)
+        return outcomes
+
+    def touch(self) -> None:
+        self.last_activity = time.monotonic()
 
     def shutdown_requested(self) -> bool:
         return self._shutdown.is_set()
 
     def request_shutdown(self) -> None:
+        """Start a drain; callable from any thread or a signal handler."""
         self._shutdown.set()
+        self.waiters.notify_all()
+        loop = self._loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self._resolve_stopping)
+            except RuntimeError:
+                pass  # Loop already closed
 
+    def bind_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.stopping = loop.create_future()
+        self._loop = loop
+        if self.shutdown_requested():
+            self._resolve_stopping()
 
-class JsonlHubHandler(socketserver.StreamRequestHandler):
-    def handle(self) -> None:
-        state: _HubState = self.server.state  # type: ignore[attr-defined]
-        while not state.shutdown_requested():
-            try:
-                line = self.rfile.readline()
-                if not line:
-                    return
-                line = line.strip()
-                if not line:
-                    continue
+    def unbind_loop(self) -> None:
+        self._loop = None
+
+    def _resolve_stopping(self) -> None:
+        if self.stopping is not None and not self.stopping.done():
+            self.stopping.set_result(None)
+
+    async def call(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run a blocking storage call on the executor."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._timed, time.perf_counter(), fn, args, kwargs)
+
+    def _timed(self, submitted: float, fn: Callable[..., Any], args: tuple[Any, ...], kwargs: dict[str, Any]) -> Any:
+        self.metrics.executor_wait.observe(time.perf_counter() - submitted)
+        try:
+            return fn(*args, **kwargs)
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e) or "busy" in str(e):
+                self.metrics.sqlite_busy.inc()
+            raise
+
+    async def lease(
+        self, wait_seconds: float = 0.0, gone: Callable[[], bool] | None = None, **kwargs: Any
+    ) -> list[Any]:
+        """
+        ``store.lease`` that, when nothing is available, parks for up to
+        ``wait_seconds`` and returns as soon as matching work is enqueued.
+        A parked lease holds no thread, and stops claiming once ``gone()``
+        reports the caller has disconnected. A draining hub hands out nothing.
+        """
+        if self.shutdown_requested():
+            return []
+        if wait_seconds <= 0:
+            return await self.call(self.store.lease, **kwargs)
+        deadline = time.monotonic() + min(wait_seconds, MAX_LEASE_WAIT_SECONDS)
+        # Parked before the first attempt so an enqueue in between is not missed
+        waiter = self.waiters.park(kwargs["worker_id"], kwargs.get("queue"), kwargs.get("groups") or [])
+        try:
+            while True:
+                if (gone is not None and gone()) or self.shutdown_requested():
+                    return []
+                waiter.clear()
+                tasks = await self.call(self.store.lease, **kwargs)
+                remaining = deadline - time.monotonic()
+                if tasks or remaining <= 0 or self.shutdown_requested():
+                    return tasks
+                await waiter.wait(min(remaining, LEASE_RECHECK_SECONDS))
+        finally:
+            self.waiters.unpark(waiter)
+
+    async def wait_for_task(self, task_id: int, timeout: float, gone: Callable[[], bool]) -> dict[str, Any]:
+        """
+        Wait until ``task_id`` reaches a terminal status and return it. If
+        ``gone()`` reports the caller has disconnected the task is cancelled;
+        past ``timeout``, or when the hub drains, an error is raised and the
+        task left to run.
+        """
+        sink = _Completion(asyncio.get_running_loop())
+        sub_id = self.events.subscribe(
+            sink, task_ids={task_id}, job=None, queue=None, statuses=set(TERMINAL_STATUSES)
+        )
+        try:
+            # It may have finished before the subscription existed
+            current = await self.call(self.store.get_tasks, [task_id])
+            if current and current[0].status in TERMINAL_STATUSES:
+                return asdict(current[0])
+            deadline = time.monotonic() + timeout
+            while not sink.future.done():
+                if self.shutdown_requested():
+                    raise ConnectionAbortedError(f"Hub shutting down; task {task_id} stays queued for the next one")
+                if gone():
+                    self.events.publish_ids(await self.call(self.store.cancel, [task_id]))
+                    raise ConnectionAbortedError(f"Caller left; task {task_id} cancelled")
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"Task {task_id} did not finish within {timeout:g}s")
+                wake = {sink.future, self.stopping} if self.stopping is not None else {sink.future}
+                await asyncio.wait(wake, timeout=min(remaining, 0.5))
+            return sink.future.result()
+        finally:
+            self.events.unsubscribe(sub_id)
+
+
+def _enable_keepalive(sock: socket.socket) -> None:
+    """TCP keepalive, so peers that vanish without a FIN are noticed and dropped."""
+    if sock.family not in (socket.AF_INET, socket.AF_INET6):
+        return
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for opt, value in (("TCP_KEEPIDLE", 60), ("TCP_KEEPINTVL", 15), ("TCP_KEEPCNT", 4)):
+        if hasattr(socket, opt):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, opt), value)
+
+
+class HubConnection:
+    """
+    One client connection on the hub's event loop: requests in, responses
+    and pushed events out, as JSONL until a ``hello`` negotiates a framed
+    codec (see ``kirosu.codec``). Blocking storage work is handed to the
+    state's executor, so an idle or parked connection costs no thread.
+
+    Requests are pipelined: up to ``max_in_flight`` run concurrently and each
+    response is written as soon as it is ready, so replies can arrive out of
+    order and clients match them by ``id``. A request that depends on an
+    earlier one must wait for that reply before being sent.
+    """
+
+    def __init__(
+        self,
+        state: _HubState,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        idle_timeout: float | None = None,
+        max_in_flight: int = MAX_IN_FLIGHT,
+    ):
+        self.state = state
+        self.reader = reader
+        self.writer = writer
+        self.idle_timeout = idle_timeout
+        self.peer = writer.get_extra_info("peername")
+        self._loop = asyncio.get_running_loop()
+        # Set once the client has gone; parked leases and runs give up on it
+        self.closed = asyncio.Event()
+        self._slots = asyncio.Semaphore(max(1, max_in_flight))
+        self._in_flight: set[asyncio.Task] = set()
+        self.codec: Codec = JSONL
+        # The task running serve(), and drain state: see drain()
+        self.task: asyncio.Task | None = None
+        self._stopping = False
+        self._reading = False
+        # Without a hub key every connection is trusted; see kirosu.auth
+        self.authenticated = not state.auth_key
+        self._nonce: str | None = None
 
-                req_id = None
+    def send_message(self, msg: dict[str, Any]) -> None:
+        """Queue a message for the client; safe to call from any thread."""
+        codec = self.codec
+        self._loop.call_soon_threadsafe(self._write_message, msg, codec, codec.pack(msg))
+
+    def _write_message(self, msg: dict[str, Any], codec: Codec, data: bytes) -> None:
+        # Encoded off the loop, unless a hello switched codecs in the meantime
+        self._write(data if codec is self.codec else self.codec.pack(msg))
+
+    def _write(self, data: bytes) -> None:
+        if self.writer.is_closing():
+            return
+        if self.writer.transport.get_write_buffer_size() > MAX_WRITE_BUFFER_BYTES:
+            logging.warning(f"Dropping {self.peer}: not reading its responses")
+            self.writer.transport.abort()
+            return
+        self.writer.write(data)
+
+    def close(self) -> None:
+        self.writer.close()
+
+    def drain(self, notice: dict[str, Any]) -> None:
+        """
+        Tell the client the hub is going away and stop reading its requests;
+        those already in flight still get their answers before serve() ends.
+        """
+        self._write(self.codec.pack(notice))
+        self._stopping = True
+        if self._reading and self.task is not None:
+            self.task.cancel()
+
+    def abort(self) -> None:
+        """Past the drain deadline: drop in-flight requests and the connection."""
+        for task in list(self._in_flight):
+            task.cancel()
+        self.writer.transport.abort()
+
+    async def serve(self) -> None:
+        sock = self.writer.get_extra_info("socket")
+        if sock is not None:
+            _enable_keepalive(sock)
+        self.state.metrics.connections.inc()
+        self.state.metrics.connections_total.inc()
+        try:
+            while not self._stopping:
+                # Subscribers legitimately sit silent while they wait for events
+                timeout = None if self.state.events.has_subscriptions(self) else self.idle_timeout
+                self._reading = True
+                try:
+                    data = await asyncio.wait_for(self._read_message(), timeout)
+                except asyncio.TimeoutError:
+                    if self._in_flight:
+                        continue  # Silent because it is waiting on us
+                    logging.debug(f"Closing idle connection {self.peer}")
+                    return
+                except ValueError:
+                    self._write(self.codec.pack(self._error(None, f"Request over {MAX_LINE_BYTES} bytes")))
+                    return
+                except asyncio.CancelledError:
+                    if not self._stopping:
+                        raise
+                    # drain() cancelled the read, not the connection (uncancel is 3.11+)
+                    task = asyncio.current_task()
+                    if hasattr(task, "uncancel"):
+                        task.uncancel()
+                    return
+                finally:
+                    self._reading = False
+                if data is None:
+                    return
+                if not self.codec.framed:
+                    data = data.strip()
+                    if not data:
+                        continue
                 try:
-                    req = json.loads(line.decode("utf-8"))
-                    req_id = req.get("id")
-                    method = req["method"]
-                    params = req.get("params") or {}
-                    
-                    # Auth Check
-                    if state.auth_key:
-                        client_key = params.get("auth_token")
-                        if client_key != state.auth_key:
-                            raise PermissionError("Invalid KIRO_SWARM_KEY")
-
-                    result = self._dispatch(state, method, params)
-                    resp = {"id": req_id, "result": result, "error": None}
+                    req = self.codec.loads(data)
                 except Exception as e:
-                    resp = {"id": req_id, "result": None, "error": {"message": str(e)}}
+                    self._write(self.codec.pack(self._error(None, f"Undecodable request: {e}")))
+                    continue
+
+                if isinstance(req, dict) and req.get("method") == "hello":
+                    await self._hello(req)
+                    continue
+                if isinstance(req, dict) and req.get("method") == "auth":
+                    await self._auth(req)
+                    continue
+                # A full window stops reading, which pushes back on the client
+                await self._slots.acquire()
+                task = asyncio.create_task(self._respond(req))
+                self._in_flight.add(task)
+                task.add_done_callback(self._in_flight.discard)
+        except (ConnectionResetError, BrokenPipeError, asyncio.IncompleteReadError):
+            return
+        finally:
+            # A draining client has not left: its parked calls finish, not cancel
+            if not self._stopping:
+                self.closed.set()
+            if self._in_flight:
+                await asyncio.gather(*self._in_flight, return_exceptions=True)
+            self.closed.set()
+            self.state.events.drop_connection(self)
+            self.state.metrics.connections.dec()
+            self.writer.close()
+
+    async def _read_message(self) -> bytes | None:
+        """The next request's bytes in the current codec; None once the client has gone."""
+        if not self.codec.framed:
+            line = await self.reader.readline()
+            return line or None
+        try:
+            header = await self.reader.readexactly(FRAME_HEADER.size)
+        except asyncio.IncompleteReadError:
+            return None
+        (size,) = FRAME_HEADER.unpack(header)
+        if size > MAX_LINE_BYTES:
+            raise ValueError(size)
+        return await self.reader.readexactly(size)
+
+    async def _hello(self, req: dict[str, Any]) -> None:
+        """
+        Negotiate the codec. Handled inline, after every in-flight reply has
+        gone out in the old codec; the answer itself is in the old codec too.
+        """
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+        req_id = req.get("id")
+        try:
+            params = req.get("params") or {}
+            codec = negotiate([str(c) for c in params.get("codecs") or []])
+            resp = {"id": req_id, "result": {"codec": codec.name, "codecs": preferred()}, "error": None}
+        except Exception as e:
+            codec, resp = self.codec, self._error(req_id, str(e))
+        self._write(self.codec.pack(resp))
+        self.codec = codec
+        await self.writer.drain()
+
+    async def _auth(self, req: dict[str, Any]) -> None:
+        """
+        Challenge-response authentication of this connection (see kirosu.auth).
+        Handled inline like hello, so it applies from the next request on.
+        """
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+        req_id = req.get("id")
+        params = req.get("params") or {}
+        key = self.state.auth_key
+        if not key:
+            resp = {"id": req_id, "result": {"authenticated": True}, "error": None}
+        elif "mac" not in params:
+            self._nonce = new_nonce()
+            resp = {"id": req_id, "result": {"nonce": self._nonce}, "error": None}
+        else:
+            nonce, self._nonce = self._nonce, None
+            self.authenticated = nonce is not None and verify(key, nonce, params["mac"])
+            if self.authenticated:
+                resp = {"id": req_id, "result": {"authenticated": True}, "error": None}
+            else:
+                logging.warning(f"Failed authentication from {self.peer}")
+                resp = self._error(req_id, "Invalid KIRO_SWARM_KEY")
+        self._write(self.codec.pack(resp))
+        await self.writer.drain()
+
+    async def _respond(self, req: Any) -> None:
+        try:
+            if isinstance(req, list):
+                resp = await self._handle_batch(req) if req else self._error(None, "Empty batch")
+            else:
+                resp = await self._handle_one(req)
+            self._write(self.codec.pack(resp))
+            await self.writer.drain()
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+        finally:
+            self._slots.release()
+
+    @staticmethod
+    def _error(req_id: Any, message: str) -> dict[str, Any]:
+        return {"id": req_id, "result": None, "error": {"message": message}}
+
+    @classmethod
+    def _failure(cls, req_id: Any, error: BaseException) -> dict[str, Any]:
+        resp = cls._error(req_id, str(error))
+        if isinstance(error, HubBusyError):
+            # Retryable: clients back off for retry_after seconds and resend
+            resp["error"].update(code=BUSY, retry_after=error.retry_after)
+        return resp
+
+    def _unpack(self, req: Any) -> tuple[str, dict[str, Any]]:
+        method = req["method"]
+        params = req.get("params") or {}
+
+        # Authenticated connections skip the check; others may still send
+        # the key itself as auth_token with every request
+        if not self.authenticated and not token_matches(self.state.auth_key, params.get("auth_token")):
+            raise PermissionError("Invalid KIRO_SWARM_KEY")
+        return method, params
 
-                self.wfile.write((json.dumps(resp, ensure_ascii=False) + "\n").encode("utf-8"))
-                self.wfile.flush()
-            except (ConnectionResetError, BrokenPipeError):
+    async def _handle_one(self, req: Any) -> dict[str, Any]:
+        req_id = req.get("id") if isinstance(req, dict) else None
+        metrics = self.state.metrics
+        started = time.perf_counter()
+        metrics.in_flight.inc()
+        method: Any = None
+        try:
+            method, params = self._unpack(req)
+            self.state.touch()
+            result = await self._call(self.state, method, params)
+        except Exception as e:
+            self._record(method, e, started)
+            return self._failure(req_id, e)
+        finally:
+            metrics.in_flight.dec()
+        self._record(method, None, started)
+        return {"id": req_id, "result": result, "error": None}
+
+    def _record(self, method: Any, error: BaseException | None, started: float) -> None:
+        # Method names come from clients; keep the label set bounded
+        if isinstance(error, PermissionError):
+            label = "unauthenticated"
+        elif isinstance(error, UnknownMethodError) or not isinstance(method, str):
+            label = "unknown"
+        else:
+            label = method
+        outcome = "ok" if error is None else "busy" if isinstance(error, HubBusyError) else "error"
+        self.state.metrics.requests.inc(label, outcome)
+        self.state.metrics.request_duration.observe(time.perf_counter() - started, label)
+
+    async def _handle_batch(self, reqs: list[Any]) -> list[dict[str, Any]]:
+        """
+        Answer a JSON array of requests with an array of responses, in order.
+        Consecutive store methods run in one executor call and one
+        transaction, each behind its own savepoint, so a failing request
+        does not undo its neighbours; UNBATCHED_METHODS run on their own.
+        """
+        state = self.state
+        responses: list[dict[str, Any]] = [{}] * len(reqs)
+        pending: list[tuple[int, Any, str, dict[str, Any]]] = []
+
+        async def flush() -> None:
+            if not pending:
                 return
+            steps = [functools.partial(self._dispatch, state, method, params) for _, _, method, params in pending]
+            started = time.perf_counter()
+            try:
+                outcomes = await state.call(state.run_batch, steps)
+            except Exception as e:
+                outcomes = [(None, e)] * len(pending)
+            # Members share one transaction; each is timed as the whole of it
+            for (i, req_id, method, _), (result, error) in zip(pending, outcomes):
+                self._record(method, error, started)
+                responses[i] = self._failure(req_id, error) if error else {"id": req_id, "result": result, "error": None}
+            pending.clear()
 
-    def _dispatch(self, state: _HubState, method: str, params: dict[str, Any]) -> dict[str, Any]:
-        if method == "enqueue":
-            prompt = str(params["prompt"])
-            system_prompt = params.get("system_prompt")
-            task_type = str(params.get("type", "chat"))
-            task_id = state.store.enqueue(prompt, system_prompt=str(system_prompt) if system_prompt else None, task_type=task_type)
-            return {"task_id": task_id}
+        state.touch()
+        for i, req in enumerate(reqs):
+            req_id = req.get("id") if isinstance(req, dict) else None
+            try:
+                method, params = self._unpack(req)
+            except Exception as e:
+                self._record(req.get("method") if isinstance(req, dict) else None, e, time.perf_counter())
+                responses[i] = self._error(req_id, str(e))
+                continue
+            if method in UNBATCHED_METHODS:
+                await flush()
+                responses[i] = await self._handle_one(req)
+            else:
+                pending.append((i, req_id, method, params))
+        await flush()
+        return responses
+
+    async def _call(self, state: _HubState, method: str, params: dict[str, Any]) -> Any:
+        """Methods that wait are awaited on the loop; everything else runs on the executor."""
+        if method == "ping":
+            return {"pong": True, "time": time.time()}
+
+        if method in ("hello", "auth"):
+            raise ValueError(f"{method} must be sent on its own, not in a batch")
 
         if method == "lease":
-            worker_id = str(params.get("worker_id") or "worker")
-            max_tasks = int(params.get("max_tasks") or 1)
-            lease_seconds = int(params.get("lease_seconds") or state.lease_seconds)
-            tasks = state.store.lease(worker_id=worker_id, max_tasks=max_tasks, lease_seconds=lease_seconds)
+            queue = params.get("queue")
+            provider = params.get("provider")
+            model = params.get("model")
+            tasks = await state.lease(
+                wait_seconds=float(params.get("wait_seconds") or 0),
+                gone=self.closed.is_set,
+                worker_id=str(params.get("worker_id") or "worker"),
+                max_tasks=int(params.get("max_tasks") or 1),
+                lease_seconds=int(params.get("lease_seconds") or state.lease_seconds),
+                queue=str(queue) if queue else None,
+                provider=str(provider) if provider else None,
+                model=str(model) if model else None,
+                groups=[str(g) for g in params.get("groups") or []],
+            )
+            state.events.publish(tasks)
             return {"tasks": [asdict(t) for t in tasks]}
 
+        if method == "enqueue" and params.get("wait_seconds"):
+            # Block (off the executor) until admission control lets the task in
+            deadline = time.monotonic() + min(float(params["wait_seconds"]), MAX_RUN_SECONDS)
+            while True:
+                try:
+                    return {"task_id": await state.call(self._enqueue, state, params)}
+                except HubBusyError as e:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or self.closed.is_set():
+                        raise
+                    await asyncio.sleep(min(e.retry_after, remaining))
+
+        if method == "run":
+            timeout = min(float(params.get("timeout") or 300), MAX_RUN_SECONDS)
+            task_id = await state.call(self._enqueue, state, params)
+            task = await state.wait_for_task(task_id, timeout, gone=self.closed.is_set)
+            return {"task": task}
+
+        return await state.call(self._dispatch, state, method, params)
+
+    def _enqueue(self, state: _HubState, params: dict[str, Any]) -> int:
+        template_id = params.get("template_id")
+        prompt = str(params.get("prompt") or "") if template_id else str(params["prompt"])
+        system_prompt = params.get("system_prompt")
+        task_type = str(params.get("type", "chat"))
+        queue = str(params.get("queue") or "default")
+        task_id = state.store.enqueue(
+            prompt,
+            system_prompt=str(system_prompt) if system_prompt else None,
+            task_type=task_type,
+            queue=queue,
+            template_id=str(template_id) if template_id else None,
+            variables=params.get("variables"),
+            tenant=str(params.get("tenant") or "default"),
+            job=str(params["job"]) if params.get("job") else None,
+            ttl_seconds=float(params["ttl_seconds"]) if params.get("ttl_seconds") else None,
+            expires_at=float(params["expires_at"]) if params.get("expires_at") else None,
+            deadline=float(params["deadline"]) if params.get("deadline") else None,
+            target_worker=str(params["target_worker"]) if params.get("target_worker") else None,
+            target_group=str(params["target_group"]) if params.get("target_group") else None,
+            fallback_seconds=float(params["fallback_seconds"]) if params.get("fallback_seconds") is not None else None,
+            session_id=str(params["session_id"]) if params.get("session_id") else None,
+        )
+        if params.get("session_id"):
+            # Only the pinned worker may take it; let every waiter check
+            state.after_commit(state.waiters.notify_all)
+        else:
+            state.after_commit(state.waiters.notify, queue, params.get("target_worker"), params.get("target_group"))
+        state.after_commit(state.events.publish_ids, [task_id])
+        return task_id
+
+    def _dispatch(self, state: _HubState, method: str, params: dict[str, Any]) -> dict[str, Any]:
+        if method == "enqueue":
+            return {"task_id": self._enqueue(state, params)}
+
+        if method == "cancel":
+            cancelled = state.store.cancel([int(t) for t in params.get("task_ids") or []])
+            state.after_commit(state.events.publish_ids, cancelled)
+            return {"cancelled": cancelled}
+
+        if method == "get_tasks":
+            task_ids = [int(t) for t in params.get("task_ids") or []]
+            return {"tasks": [asdict(t) for t in state.store.get_tasks(task_ids)]}
+
+        if method == "set_tenant_weight":
+            tenant = str(params["tenant"])
+            state.store.set_tenant_weight(tenant, float(params["weight"]))
+            return {"ok": True}
+
+        if method == "tenants":
+            return {"tenants": state.store.tenant_report()}
+
+        if method == "register_template":
+            template_id = params.get("template_id")
+            template_id = state.store.register_template(
+                str(params["template"]), template_id=str(template_id) if template_id else None
+            )
+            return {"template_id": template_id}
+
         if method == "ack":
             task_id = int(params["task_id"])
             status = str(params["status"])
             result = params.get("result")
             error = params.get("error")
-            state.store.ack(task_id=task_id, status=status, result=result, error=error)
+            started_at = params.get("started_at")
+            provider_time = params.get("provider_time_sec")
+            state.store.ack(
+                task_id=task_id,
+                status=status,
+                result=result,
+                error=error,
+                started_at=float(started_at) if started_at is not None else None,
+                provider_time_sec=float(provider_time) if provider_time is not None else None,
+            )
+            state.after_commit(state.events.publish_ids, [task_id])
             return {"ok": True}
 
+        if method == "ack_many":
+            acks = list(params.get("acks") or [])
+            acked = state.store.ack_many(acks)
+            state.after_commit(state.events.publish_ids, [int(a["task_id"]) for a in acks])
+            return {"acked": acked}
+
+        if method == "release_many":
+            task_ids = [int(t) for t in params.get("task_ids") or []]
+            worker_id = params.get("worker_id")
+            count = state.store.release_many(task_ids, worker_id=str(worker_id) if worker_id else None)
+            if count:
+                state.after_commit(state.waiters.notify_all)
+                state.after_commit(state.events.publish_ids, task_ids)
+            return {"released": count}
+
+        if method == "subscribe":
+            task_ids = params.get("task_ids")
+            status = params.get("status")
+            if isinstance(status, str):
+                status = [status]
+            sub_id = state.events.subscribe(
+                self,
+                task_ids={int(t) for t in task_ids} if task_ids is not None else None,
+                job=str(params["job"]) if params.get("job") else None,
+                queue=str(params["queue"]) if params.get("queue") else None,
+                statuses={str(s) for s in status} if status else None,
+            )
+            return {"subscription": sub_id}
+
+        if method == "unsubscribe":
+            return {"ok": state.events.unsubscribe(str(params["subscription"]))}
+
         if method == "list":
             status = params.get("status")
             limit_param = params.get("limit")
@@ -93,32 +870,352 @@ class JsonlHubHandler(socketserver.StreamRequestHandler):
             tasks = state.store.list(status=status, limit=limit)
             return {"tasks": [asdict(t) for t in tasks], "stats": state.store.stats()}
 
+        if method == "search":
+            query = str(params["query"])
+            limit = int(params.get("limit") or 50)
+            cursor = params.get("cursor")
+            tasks, next_cursor = state.store.search(
+                query,
+                status=params.get("status"),
+                limit=limit,
+                cursor=int(cursor) if cursor is not None else None,
+            )
+            return {"tasks": [asdict(t) for t in tasks], "next_cursor": next_cursor}
+
         if method == "stats":
-            return {"stats": state.store.stats()}
+            stats = state.store.stats()
+            stats["wal_size_bytes"] = state.store.wal_size_bytes()
+            stats["rate_limits"] = state.store.rate_limiter.snapshot()
+            stats["queue_limits"] = state.store.admission.snapshot()
+            return {"stats": stats}
+
+        if method == "set_queue_limit":
+            max_queued = params.get("max_queued")
+            state.store.admission.set_limit(str(params["key"]), int(max_queued) if max_queued is not None else None)
+            return {"queue_limits": state.store.admission.snapshot()}
+
+        if method == "set_rate_limit":
+            rpm = params.get("requests_per_minute")
+            tpm = params.get("tokens_per_minute")
+            state.store.rate_limiter.set_limit(
+                str(params["key"]),
+                requests_per_minute=float(rpm) if rpm else None,
+                tokens_per_minute=float(tpm) if tpm else None,
+            )
+            return {"rate_limits": state.store.rate_limiter.snapshot()}
+
+        if method == "latency_report":
+            group_by = str(params.get("group_by") or "type")
+            since = params.get("since_seconds")
+            return state.store.latency_report(group_by=group_by, since_seconds=float(since) if since else None)
+
+        if method == "session_history":
+            history = state.store.session_history(str(params["session_id"]), limit=int(params.get("limit") or 50))
+            history["tasks"] = [asdict(t) for t in history["tasks"]]
+            return history
+
+        if method == "deadline_report":
+            return state.store.deadline_report(limit=int(params.get("limit") or 1000))
+
+        if method == "backup":
+            path = _backup_target(state.backup_dir, str(params["path"]))
+            pages = int(params.get("pages") or 256)
+            with state.backup_lock:
+                return state.store.backup(path, pages=pages)
+
+        if method == "checkpoint":
+            mode = str(params.get("mode") or "PASSIVE")
+            with state.backup_lock:
+                return state.store.checkpoint(mode)
 
         if method == "retry_failed":
             count = state.store.retry_all_failed()
+            if count:
+                state.after_commit(state.waiters.notify_all)
             return {"retried": count}
 
         if method == "shutdown":
             state.request_shutdown()
             return {"ok": True}
 
-        if method == "shutdown":
-            state.request_shutdown()
-            return {"ok": True}
-
         if method == "approve":
             task_id = int(params["task_id"])
             state.store.approve_task(task_id)
+            state.after_commit(state.events.publish_ids, [task_id])
             return {"ok": True}
 
-        raise ValueError(f"Unknown method: {method}")
+        raise UnknownMethodError(f"Unknown method: {method}")
+
+
+class WalCheckpointer(threading.Thread):
+    """
+    Hub-managed WAL checkpoints, replacing SQLite's inline autocheckpoint so
+    no lease or ack pays for one. The WAL is checkpointed passively whenever
+    the hub has been idle for ``idle_seconds``, and truncated once it grows
+    past ``truncate_bytes`` and no reader is in the way.
+    """
+
+    def __init__(
+        self,
+        state: _HubState,
+        interval: float = 5.0,
+        idle_seconds: float = 2.0,
+        truncate_bytes: int = 64 * 1024 * 1024,
+    ):
+        super().__init__(name="wal-checkpointer", daemon=True)
+        self.state = state
+        self.interval = interval
+        self.idle_seconds = idle_seconds
+        self.truncate_bytes = truncate_bytes
+
+    def run(self) -> None:
+        while not self.state._shutdown.wait(self.interval):
+            try:
+                self.tick()
+            except Exception as e:
+                logging.warning(f"WAL checkpoint failed: {e}")
+
+    def tick(self) -> dict[str, Any] | None:
+        store = self.state.store
+        wal_size = store.wal_size_bytes()
+        if wal_size == 0:
+            return None
+        if wal_size > self.truncate_bytes:
+            mode = "TRUNCATE"
+        elif time.monotonic() - self.state.last_activity >= self.idle_seconds:
+            mode = "PASSIVE"
+        else:
+            return None
+        # Skip rather than queue up behind a running backup
+        if not self.state.backup_lock.acquire(blocking=False):
+            return None
+        try:
+            # Never make writers wait on a reader: a busy TRUNCATE is retried next tick
+            result = store.checkpoint(mode, wait=False)
+        finally:
+            self.state.backup_lock.release()
+        self.state.metrics.checkpoints.inc(mode, str(result["busy"]).lower())
+        logging.debug(f"WAL checkpoint {result} (wal was {wal_size} bytes)")
+        return result
+
+
+class TaskReaper(threading.Thread):
+    """
+    Periodically moves queued tasks past their TTL to 'expired' in bulk,
+    recounts queue depths for admission control, and every
+    ``deadline_check_interval`` seconds warns about projected deadline misses.
+    """
+
+    def __init__(self, state: _HubState, interval: float = 1.0, deadline_check_interval: float = 60.0):
+        super().__init__(name="task-reaper", daemon=True)
+        self.state = state
+        self.interval = interval
+        self.deadline_check_interval = deadline_check_interval
+        self._last_deadline_check = 0.0
+
+    def run(self) -> None:
+        while not self.state._shutdown.wait(self.interval):
+            try:
+                self.tick()
+            except Exception as e:
+                logging.warning(f"Expiry reaper failed: {e}")
+
+    def tick(self) -> list[int]:
+        self.state.store.refresh_admission(max_age=0)
+        expired = self.state.store.expire_stale()
+        if expired:
+            logging.info(f"Expired {len(expired)} stale task(s)")
+            self.state.events.publish_ids(expired)
+        if time.monotonic() - self._last_deadline_check >= self.deadline_check_interval:
+            self._last_deadline_check = time.monotonic()
+            self.check_deadlines()
+        return expired
+
+    def check_deadlines(self) -> dict[str, Any]:
+        report = self.state.store.deadline_report()
+        if report["projected_misses"]:
+            worst = report["at_risk"][0]
+            logging.warning(
+                f"{report['projected_misses']} queued task(s) projected to miss their deadline "
+                f"with {report['workers']} worker(s); task {worst['task_id']} late by {worst['late_by_sec']:.0f}s"
+            )
+        return report
+
+
+def _backup_target(backup_dir: str, path: str) -> str:
+    """
+    Where a backup RPC may write ``path``: a bare or relative name lands in
+    ``backup_dir``, and an absolute path must already be inside it.
+    """
+    target = os.path.realpath(os.path.join(backup_dir, path))
+    if os.path.commonpath([backup_dir, target]) != backup_dir or target == backup_dir:
+        raise ValueError(f"Backups can only be written inside {backup_dir}")
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    return target
 
 
-class ThreadedTcpServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
-    daemon_threads = True
-    allow_reuse_address = True
+def _clear_stale_socket(path: str) -> None:
+    """Remove a socket file left behind by a hub that died, refusing to steal a live one."""
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise RuntimeError(f"{path} exists and is not a socket")
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise RuntimeError(f"Another hub is already listening on {path}")
+
+
+async def _serve_metrics(state: _HubState, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Answer one HTTP request: ``GET /metrics`` in the Prometheus text format, else 404."""
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 10)
+        while (await asyncio.wait_for(reader.readline(), 10)).strip():
+            pass  # Headers; nothing in them matters here
+        verb, path = (request_line.decode("latin-1").split() + ["", ""])[:2]
+        if verb in ("GET", "HEAD") and path.split("?")[0] == "/metrics":
+            try:
+                await state.call(state.metrics.collect)
+            except Exception as e:
+                logging.warning(f"Collecting metrics failed: {e}")
+            status, body = "200 OK", state.metrics.render().encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            status, body, content_type = "404 Not Found", b"Not found\n", "text/plain"
+        head = f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+        writer.write(head.encode("latin-1") + (body if verb != "HEAD" else b""))
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def _serve(
+    state: _HubState,
+    host: str,
+    port: int,
+    ready_callback: Any | None,
+    idle_timeout: float | None,
+    max_in_flight: int = MAX_IN_FLIGHT,
+    unix_path: str | None = None,
+    unix_mode: int = 0o660,
+    tcp: bool = True,
+    metrics_host: str = "127.0.0.1",
+    metrics_port: int | None = None,
+    drain_seconds: float = 5.0,
+) -> int:
+    connections: set[HubConnection] = set()
+
+    async def on_connect(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        if state.shutdown_requested():
+            writer.close()  # Accepted just before the listeners closed
+            return
+        conn = HubConnection(state, reader, writer, idle_timeout=idle_timeout, max_in_flight=max_in_flight)
+        conn.task = asyncio.current_task()
+        connections.add(conn)
+        try:
+            await conn.serve()
+        finally:
+            connections.discard(conn)
+
+    loop = asyncio.get_running_loop()
+    state.bind_loop(loop)
+    servers: list[asyncio.AbstractServer] = []
+    unix_socket: tuple[str, int] | None = None
+    actual_port = 0
+    try:
+        if tcp:
+            server = await asyncio.start_server(
+                on_connect, host, port, limit=MAX_LINE_BYTES, backlog=4096, reuse_address=True
+            )
+            servers.append(server)
+            actual_host, actual_port = server.sockets[0].getsockname()[:2]
+            logging.info(f"KIRO_SWARM_HUB tcp://{actual_host}:{actual_port}")
+        if unix_path:
+            _clear_stale_socket(unix_path)
+            # Create the socket file with its final permissions, so there is no
+            # window in which it is reachable more widely than unix_mode allows
+            old_umask = os.umask(~unix_mode & 0o777)
+            try:
+                server = await asyncio.start_unix_server(on_connect, unix_path, limit=MAX_LINE_BYTES, backlog=4096)
+            finally:
+                os.umask(old_umask)
+            os.chmod(unix_path, unix_mode)
+            # Remembered so we never unlink a socket a successor hub has bound since
+            unix_socket = (unix_path, os.stat(unix_path).st_ino)
+            servers.append(server)
+            logging.info(f"KIRO_SWARM_HUB unix://{unix_path}")
+        if metrics_port is not None:
+            server = await asyncio.start_server(
+                functools.partial(_serve_metrics, state), metrics_host, metrics_port, reuse_address=True
+            )
+            servers.append(server)
+            bound_host, bound_port = server.sockets[0].getsockname()[:2]
+            logging.info(f"KIRO_SWARM_METRICS http://{bound_host}:{bound_port}/metrics")
+        if threading.current_thread() is threading.main_thread():
+            # SIGTERM (and Ctrl-C) drain like the shutdown RPC
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                loop.add_signal_handler(sig, state.request_shutdown)
+
+        if ready_callback:
+            ready_callback(actual_port)
+
+        await state.stopping
+        await _drain(servers, connections, unix_socket, drain_seconds)
+    finally:
+        state.unbind_loop()
+        if unix_socket:
+            _remove_socket(*unix_socket)
+    return actual_port
+
+
+async def _drain(
+    servers: list[asyncio.AbstractServer],
+    connections: set[HubConnection],
+    unix_socket: tuple[str, int] | None,
+    drain_seconds: float,
+) -> None:
+    """
+    Stop accepting, tell every client the hub is going away, and let
+    requests already read finish for up to ``drain_seconds`` before the
+    remaining connections are cut.
+    """
+    started = time.monotonic()
+    for server in servers:
+        server.close()
+    if unix_socket:
+        # Free the path right away, for the hub replacing this one
+        _remove_socket(*unix_socket)
+    notice = {"id": None, "event": "shutdown", "drain_seconds": drain_seconds}
+    for conn in list(connections):
+        conn.drain(notice)
+    serving = [conn.task for conn in connections if conn.task is not None]
+    if serving:
+        _, late = await asyncio.wait(serving, timeout=drain_seconds)
+        if late:
+            logging.warning(f"Drain deadline passed; cutting {len(late)} connection(s) with requests in flight")
+            for conn in list(connections):
+                conn.abort()
+            await asyncio.wait(late, timeout=1.0)
+    for server in servers:
+        await server.wait_closed()
+    logging.info(f"Drained {len(serving)} connection(s) in {time.monotonic() - started:.3f}s")
+
+
+def _remove_socket(path: str, inode: int) -> None:
+    try:
+        if os.stat(path).st_ino == inode:
+            os.unlink(path)
+    except FileNotFoundError:
+        pass
 
 
 def run_hub(
@@ -127,28 +1224,85 @@ def run_hub(
     port: int,
     lease_seconds: int,
     ready_callback: Any | None = None,
+    fts: bool = False,
+    checkpoint_interval: float = 5.0,
+    wal_truncate_bytes: int = 64 * 1024 * 1024,
+    schedule: str = "fifo",
+    session_affinity: float = 30.0,
+    idle_timeout: float | None = 600.0,
+    max_workers: int = 16,
+    max_in_flight: int = MAX_IN_FLIGHT,
+    unix_path: str | None = None,
+    unix_mode: int = 0o660,
+    tcp: bool = True,
+    max_queued_total: int | None = None,
+    metrics_host: str = "127.0.0.1",
+    metrics_port: int | None = None,
+    drain_seconds: float = 5.0,
+    backup_dir: str | None = None,
 ) -> int:
+    """
+    Serve the hub until a shutdown request (the ``shutdown`` RPC, SIGTERM or
+    SIGINT), then drain: stop accepting, tell clients, give requests in
+    flight up to ``drain_seconds`` to finish, and truncate the WAL.
+    ``idle_timeout`` closes connections that send nothing for that long
+    (subscribers excepted);
+    ``max_workers`` bounds concurrent storage calls and ``max_in_flight``
+    the pipelined requests per connection. ``unix_path`` also listens on a
+    Unix domain socket created with permissions ``unix_mode``; ``tcp=False``
+    serves on that socket only. ``max_queued_total`` caps queued tasks
+    hub-wide, on top of the ``[queue_limits]`` in config; enqueues past a
+    limit get a retryable busy error. ``metrics_port`` serves Prometheus
+    metrics over HTTP at ``/metrics``. The ``backup`` RPC writes only inside
+    ``backup_dir`` (default: ``backups/`` next to the database).
+    """
+    if not tcp and not unix_path:
+        raise ValueError("tcp=False needs a unix_path to listen on")
     logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
-    store = TaskStore(db_path)
-    state = _HubState(store, lease_seconds=lease_seconds)
-
-    with ThreadedTcpServer((host, port), JsonlHubHandler) as srv:
-        srv.state = state  # type: ignore[attr-defined]
-        actual_host, actual_port = srv.server_address
-        logging.info(f"KIRO_SWARM_HUB tcp://{actual_host}:{actual_port}")
-        
-        if ready_callback:
-            ready_callback(actual_port)
-
+    # checkpoint_interval <= 0 leaves checkpointing to SQLite's autocheckpoint
+    managed_wal = checkpoint_interval > 0
+    store = TaskStore(db_path, fts=fts, autocheckpoint=not managed_wal, schedule=schedule, session_affinity=session_affinity)
+    for key, max_queued in get_queue_limits().items():
+        store.admission.set_limit(key, max_queued)
+    if max_queued_total is not None:
+        store.admission.set_limit("hub", max_queued_total)
+    for key, limits in get_rate_limits().items():
+        store.rate_limiter.set_limit(
+            key,
+            requests_per_minute=limits.get("requests_per_minute"),
+            tokens_per_minute=limits.get("tokens_per_minute"),
+        )
+    state = _HubState(store, lease_seconds=lease_seconds, max_workers=max_workers, backup_dir=backup_dir)
+    background: list[threading.Thread] = [TaskReaper(state)]
+    if managed_wal:
+        background.append(WalCheckpointer(state, interval=checkpoint_interval, truncate_bytes=wal_truncate_bytes))
+    for thread in background:
+        thread.start()
 
+    try:
+        actual_port = asyncio.run(
+            _serve(
+                state, host, port, ready_callback, idle_timeout or None, max_in_flight,
+                unix_path=unix_path, unix_mode=unix_mode, tcp=tcp,
+                metrics_host=metrics_host, metrics_port=metrics_port, drain_seconds=drain_seconds,
+            )
+        )
+    finally:
+        state.request_shutdown()
+        # Storage calls of requests cut at the deadline still run to completion
+        state.executor.shutdown(wait=True)
+        for thread in background:
+            thread.join(timeout=5)
         try:
-            while not state.shutdown_requested():
-                srv.handle_request()
-        finally:
-            try:
-                store.close()
-            except Exception:
-                pass
+            # Leave no WAL behind for whatever opens the database next
+            with state.backup_lock:
+                result = store.checkpoint("TRUNCATE")
+            logging.info(f"Final WAL checkpoint: {result}")
+        except Exception as e:
+            logging.warning(f"Final WAL checkpoint failed: {e}")
+        try:
+            store.close()
+        except Exception:
+            pass
     time.sleep(0.05)
     return actual_port
-
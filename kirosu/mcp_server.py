@@ -40,17 +40,21 @@ def enqueue_task(prompt: str, system_prompt: str | None = None, task_type: str =
         return f"Error enqueuing task: {str(e)}"
 
 @mcp.tool()
-def list_tasks(status: str | None = None, limit: int = 10) -> str:
+def list_tasks(status: str | None = None, limit: int = 10, query: str | None = None) -> str:
     """
     List tasks in the swarm.
     
     Args:
         status: Filter by status (queued, leased, done, failed).
         limit: Max number of tasks to return.
+        query: Optional full-text search over prompts, results and errors.
     """
     client = get_client()
     try:
-        resp = client.call("list", {"status": status, "limit": limit})
+        if query:
+            resp = client.call("search", {"query": query, "status": status, "limit": limit})
+        else:
+            resp = client.call("list", {"status": status, "limit": limit})
         tasks = resp.get("tasks", [])
         if not tasks:
             return "No tasks found."
@@ -72,16 +76,12 @@ def get_task_status(task_id: int) -> str:
     """
     client = get_client()
     try:
-        # We don't have a direct get_task method, so we list with limit=100 and filter (inefficient but works for now)
-        # Or better, we can assume list returns recent ones. 
-        # Ideally we should add get_task to Hub, but for now let's use list.
-        # Actually, let's just implement a simple filter on the client side for now.
-        resp = client.call("list", {"limit": 100})
+        resp = client.call("get_tasks", {"task_ids": [task_id]})
         tasks = resp.get("tasks", [])
-        task = next((t for t in tasks if t["task_id"] == task_id), None)
+        task = tasks[0] if tasks else None
         
         if not task:
-            return f"Task {task_id} not found (or not in recent 100)."
+            return f"Task {task_id} not found."
             
         return (
             f"Task ID: {task['task_id']}\n"
@@ -0,0 +1,173 @@
+"""
+Hub telemetry in the Prometheus text exposition format.
+
+Counters, gauges and histograms are plain in-process objects, cheap enough
+to update on every request; ``HubMetrics.render`` formats them for a
+scrape. The hub serves them at ``GET /metrics`` on a small listener of its
+own (``kirosu hub --metrics-port``), so no web framework is needed.
+"""
+
+from __future__ import annotations
+
+import bisect
+import math
+import threading
+from typing import Any, Callable, Iterator
+
+# Request latencies: sub-millisecond pings up to parked leases and runs
+DURATION_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._lock = threading.Lock()
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        return "\n".join([f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self.samples()])
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, *labels: str, value: float) -> None:
+        with self._lock:
+            self._values[labels] = float(value)
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def replace(self, values: dict[tuple[str, ...], float]) -> None:
+        """Swap in a fresh set of samples, dropping label sets no longer present."""
+        with self._lock:
+            self._values = dict(values)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DURATION_BUCKETS
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: per-bucket (non-cumulative) counts, then sum and count
+        self._series: dict[tuple[str, ...], list[Any]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return series[2] if series else 0
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            items = sorted((labels, (list(s[0]), s[1], s[2])) for labels, s in self._series.items())
+        for labels, (counts, total, n) in items:
+            cumulative = 0
+            for bound, c in zip((*self.buckets, math.inf), counts):
+                cumulative += c
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labels, labels)} {n}"
+
+
+class HubMetrics:
+    """Everything the hub records; ``collect`` hooks refresh scrape-time gauges."""
+
+    def __init__(self) -> None:
+        self.requests = Counter(
+            "kirosu_requests_total", "Requests answered, by method and outcome (ok, error, busy).", ("method", "outcome")
+        )
+        self.request_duration = Histogram(
+            "kirosu_request_duration_seconds", "Time from reading a request to its reply, by method.", ("method",)
+        )
+        self.in_flight = Gauge("kirosu_requests_in_flight", "Requests read and not yet answered.")
+        self.executor_wait = Histogram(
+            "kirosu_executor_wait_seconds", "Time storage calls queue for a hub-store thread before running."
+        )
+        self.connections = Gauge("kirosu_connections", "Open client connections.")
+        self.connections_total = Counter("kirosu_connections_total", "Client connections accepted.")
+        self.sqlite_busy = Counter(
+            "kirosu_sqlite_busy_total", "Storage calls that failed with SQLITE_BUSY/locked after busy_timeout."
+        )
+        self.checkpoints = Counter(
+            "kirosu_wal_checkpoints_total",
+            "Hub-managed WAL checkpoints, by mode and whether readers kept it from finishing (busy, retried later).",
+            ("mode", "busy"),
+        )
+        self.tasks = Gauge("kirosu_tasks", "Active tasks by queue and status.", ("queue", "status"))
+        self.wal_size = Gauge("kirosu_wal_size_bytes", "Size of the SQLite write-ahead log.")
+        self._metrics: list[_Metric] = [
+            self.requests, self.request_duration, self.in_flight, self.executor_wait,
+            self.connections, self.connections_total, self.sqlite_busy, self.checkpoints,
+            self.tasks, self.wal_size,
+        ]
+        self._collectors: list[Callable[[], None]] = []
+
+    def add_collector(self, fn: Callable[[], None]) -> None:
+        """Register ``fn`` to refresh gauges before each scrape."""
+        self._collectors.append(fn)
+
+    def collect(self) -> None:
+        for fn in self._collectors:
+            fn()
+
+    def render(self) -> str:
+        return "\n".join(m.render() for m in self._metrics) + "\n"
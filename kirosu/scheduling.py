@@ -0,0 +1,325 @@
+from __future__ import annotations
+
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable
+
+from .backpressure import HubBusyError
+
+
+class FairShareScheduler:
+    """
+    Weighted deficit round robin over tenants that have queued work.
+
+    Only tenants with ready tasks sit in the ring, so picking the next tenant
+    is O(1) regardless of how many tenants have ever submitted. Each visit
+    tops a tenant's deficit up by its weight and lets it take that many tasks
+    before the ring moves on. The caller supplies the storage side:
+    ``take(tenant, k)`` claims up to ``k`` of that tenant's tasks and
+    ``has_work(tenant)`` says whether it has any queued task at all.
+    """
+
+    def __init__(self) -> None:
+        self._active: OrderedDict[str, float] = OrderedDict()
+        self._weights: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def weight(self, tenant: str) -> float:
+        return self._weights.get(tenant, 1.0)
+
+    def set_weight(self, tenant: str, weight: float) -> None:
+        if weight <= 0:
+            raise ValueError("weight must be positive")
+        with self._lock:
+            self._weights[tenant] = float(weight)
+
+    def weights(self) -> dict[str, float]:
+        return dict(self._weights)
+
+    def activate(self, tenant: str) -> None:
+        with self._lock:
+            self._active.setdefault(tenant, 0.0)
+
+    def active_tenants(self) -> list[str]:
+        with self._lock:
+            return list(self._active)
+
+    def pick(
+        self,
+        need: int,
+        take: Callable[[str, int], list[Any]],
+        has_work: Callable[[str], bool],
+    ) -> list[Any]:
+        out: list[Any] = []
+        with self._lock:
+            if not self._active:
+                return out
+            # Scale the quantum so a batch lease splits across tenants in one
+            # turn of the ring instead of one task per visit.
+            quantum = max(1, need // len(self._active))
+            # Every visit either claims a task or moves past a tenant, so the
+            # walk is bounded; fractional weights may need a few turns to earn
+            # a task, and tenants with nothing eligible are passed over.
+            min_weight = min([1.0, *self._weights.values()])
+            visits = need + len(self._active) * math.ceil(1 / min_weight)
+            while need > 0 and self._active and visits > 0:
+                visits -= 1
+                tenant, deficit = next(iter(self._active.items()))
+                if deficit < 1:
+                    deficit += self.weight(tenant) * quantum
+                k = min(int(deficit), need)
+                got = take(tenant, k) if k > 0 else []
+                out.extend(got)
+                need -= len(got)
+                deficit -= len(got)
+
+                if len(got) < k:
+                    if not has_work(tenant):
+                        del self._active[tenant]
+                        continue
+                    # Work exists but not for this caller; don't bank the quantum
+                    deficit = 0.0
+                self._active[tenant] = deficit
+                if deficit < 1 or len(got) < k:
+                    self._active.move_to_end(tenant)
+        return out
+
+
+class TokenBucket:
+    """Continuously refilling bucket holding at most ``per_minute`` units."""
+
+    def __init__(self, per_minute: float, clock: Callable[[], float] = time.monotonic):
+        self.per_minute = float(per_minute)
+        self._clock = clock
+        self._level = self.per_minute
+        self._stamp = clock()
+
+    def available(self) -> float:
+        now = self._clock()
+        self._level = min(self.per_minute, self._level + (now - self._stamp) * self.per_minute / 60.0)
+        self._stamp = now
+        return self._level
+
+    def take(self, amount: float) -> None:
+        self.available()
+        self._level -= amount
+
+
+# Rough prompt-size estimate used for tokens-per-minute budgets
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(*texts: str | None) -> int:
+    return sum(len(t) for t in texts if t) // CHARS_PER_TOKEN + 1
+
+
+class RateLimiter:
+    """
+    Requests/min and estimated tokens/min budgets keyed by ``provider`` or
+    ``provider/model``. A lease from a worker running ``codex`` with model
+    ``gpt-5.1-codex-mini`` is checked against both keys when configured.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic) -> None:
+        self._clock = clock
+        self._limits: dict[str, dict[str, float | None]] = {}
+        self._requests: dict[str, TokenBucket] = {}
+        self._tokens: dict[str, TokenBucket] = {}
+        self._throttled: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def keys_for(provider: str | None, model: str | None) -> list[str]:
+        keys = []
+        if provider and model:
+            keys.append(f"{provider}/{model}")
+        if provider:
+            keys.append(provider)
+        return keys
+
+    def set_limit(
+        self,
+        key: str,
+        requests_per_minute: float | None = None,
+        tokens_per_minute: float | None = None,
+    ) -> None:
+        """Set or replace a key's limits; with neither limit given the key is removed."""
+        with self._lock:
+            self._requests.pop(key, None)
+            self._tokens.pop(key, None)
+            if not requests_per_minute and not tokens_per_minute:
+                self._limits.pop(key, None)
+                return
+            self._limits[key] = {
+                "requests_per_minute": requests_per_minute,
+                "tokens_per_minute": tokens_per_minute,
+            }
+            if requests_per_minute:
+                self._requests[key] = TokenBucket(requests_per_minute, self._clock)
+            if tokens_per_minute:
+                self._tokens[key] = TokenBucket(tokens_per_minute, self._clock)
+
+    def allowance(self, keys: list[str], wanted: int) -> int:
+        """How many of ``wanted`` requests the request budgets allow right now."""
+        with self._lock:
+            allowed = wanted
+            for key in keys:
+                bucket = self._requests.get(key)
+                if bucket is not None:
+                    allowed = min(allowed, int(bucket.available()))
+                tokens = self._tokens.get(key)
+                if tokens is not None and tokens.available() < 1:
+                    allowed = 0
+            if allowed < wanted:
+                for key in keys:
+                    if key in self._limits:
+                        self._throttled[key] = self._throttled.get(key, 0) + 1
+            return max(allowed, 0)
+
+    def try_consume(self, keys: list[str], tokens: int) -> bool:
+        """
+        Charge one request and ``tokens`` estimated tokens to every key. A task
+        bigger than a whole minute's budget is let through once the bucket is
+        full, so it cannot starve forever.
+        """
+        with self._lock:
+            for key in keys:
+                bucket = self._tokens.get(key)
+                if bucket is None:
+                    continue
+                level = bucket.available()
+                if level < min(tokens, bucket.per_minute):
+                    self._throttled[key] = self._throttled.get(key, 0) + 1
+                    return False
+            for key in keys:
+                if key in self._requests:
+                    self._requests[key].take(1)
+                if key in self._tokens:
+                    self._tokens[key].take(tokens)
+            return True
+
+    def limited(self, keys: list[str]) -> bool:
+        return any(key in self._limits for key in keys)
+
+    def snapshot(self) -> dict[str, dict[str, Any]]:
+        with self._lock:
+            out = {}
+            for key, limits in self._limits.items():
+                entry: dict[str, Any] = dict(limits)
+                if key in self._requests:
+                    entry["requests_available"] = round(self._requests[key].available(), 2)
+                if key in self._tokens:
+                    entry["tokens_available"] = round(self._tokens[key].available(), 2)
+                entry["throttled"] = self._throttled.get(key, 0)
+                out[key] = entry
+            return out
+
+
+class AdmissionControl:
+    """
+    Queue-depth limits checked on enqueue: ``max_queued`` tasks waiting
+    hub-wide, per queue (``queue:<name>``) and per tenant (``tenant:<name>``).
+    An enqueue that would exceed any of them raises HubBusyError.
+
+    Depths are cached rather than counted per enqueue: ``refresh`` loads them
+    from one GROUP BY about every ``refresh_seconds`` (the hub does this off
+    the request path), and tasks admitted in between are added to the cache. Tasks leased in between only show up
+    at the next refresh, so the check errs on the side of refusing. The
+    retry-after hint is the time the key's recent drain rate needs to make
+    room, bounded by ``min_retry_after`` and ``max_retry_after``.
+    """
+
+    def __init__(
+        self,
+        refresh_seconds: float = 1.0,
+        min_retry_after: float = 1.0,
+        max_retry_after: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.refresh_seconds = refresh_seconds
+        self.min_retry_after = min_retry_after
+        self.max_retry_after = max_retry_after
+        self._clock = clock
+        self._limits: dict[str, int] = {}
+        self._depths: dict[str, int] = {}
+        self._drain_rates: dict[str, float] = {}
+        self._rejected: dict[str, int] = {}
+        self._stamp: float | None = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def keys_for(queue: str, tenant: str) -> list[str]:
+        return ["hub", f"queue:{queue}", f"tenant:{tenant}"]
+
+    def set_limit(self, key: str, max_queued: int | None) -> None:
+        """Set a key's limit (``hub``, ``queue:<name>`` or ``tenant:<name>``); None removes it."""
+        if key != "hub" and not key.startswith(("queue:", "tenant:")):
+            raise ValueError("key must be 'hub', 'queue:<name>' or 'tenant:<name>'")
+        with self._lock:
+            if max_queued is None:
+                self._limits.pop(key, None)
+            else:
+                self._limits[key] = int(max_queued)
+
+    def limited(self) -> bool:
+        return bool(self._limits)
+
+    def stale(self, max_age: float | None = None) -> bool:
+        """Whether the cached depths are older than ``max_age`` (default ``refresh_seconds``)."""
+        max_age = self.refresh_seconds if max_age is None else max_age
+        return self._stamp is None or self._clock() - self._stamp >= max_age
+
+    def refresh(self, rows: list[tuple[str, str, int]]) -> None:
+        """Replace cached depths with ``(queue, tenant, queued)`` counts."""
+        depths: dict[str, int] = {}
+        for queue, tenant, count in rows:
+            for key in self.keys_for(queue, tenant):
+                depths[key] = depths.get(key, 0) + count
+        with self._lock:
+            now = self._clock()
+            if self._stamp is not None and now > self._stamp:
+                elapsed = now - self._stamp
+                for key in self._limits:
+                    # The cache already counts tasks admitted since; what is gone was leased
+                    drained = self._depths.get(key, 0) - depths.get(key, 0)
+                    rate = max(drained, 0) / elapsed
+                    self._drain_rates[key] = 0.5 * self._drain_rates.get(key, rate) + 0.5 * rate
+            self._depths = depths
+            self._stamp = now
+
+    def admit(self, queue: str, tenant: str) -> None:
+        keys = self.keys_for(queue, tenant)
+        with self._lock:
+            for key in keys:
+                limit = self._limits.get(key)
+                if limit is not None and self._depths.get(key, 0) >= limit:
+                    self._rejected[key] = self._rejected.get(key, 0) + 1
+                    raise HubBusyError(
+                        f"Hub busy: {key} has {self._depths[key]} queued tasks (limit {limit})",
+                        self._retry_after(key, self._depths[key] - limit + 1),
+                    )
+            for key in keys:
+                self._depths[key] = self._depths.get(key, 0) + 1
+
+    def _retry_after(self, key: str, excess: int) -> float:
+        rate = self._drain_rates.get(key)
+        if rate is None:
+            wait = self.min_retry_after  # No drain measured yet
+        else:
+            wait = excess / rate if rate > 0 else self.max_retry_after
+        until_refresh = (self._stamp or 0.0) + self.refresh_seconds - self._clock()
+        return round(min(self.max_retry_after, max(self.min_retry_after, until_refresh, wait)), 2)
+
+    def snapshot(self) -> dict[str, dict[str, Any]]:
+        with self._lock:
+            return {
+                key: {
+                    "max_queued": limit,
+                    "queued": self._depths.get(key, 0),
+                    "drain_per_sec": round(self._drain_rates.get(key, 0.0), 2),
+                    "rejected": self._rejected.get(key, 0),
+                }
+                for key, limit in self._limits.items()
+            }
@@ -0,0 +1,49 @@
+"""
+Hub addresses. A host of the form ``unix:///path/to/hub.sock`` reaches a hub
+listening on a Unix domain socket (``kirosu hub --unix``), which skips the
+TCP stack for co-located agents and frontends and is access-controlled by
+the socket file's permissions; the port is then ignored. Any other host is
+TCP. ``KIRO_SWARM_HOST`` accepts either form.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import socket
+from typing import Any
+
+UNIX_SCHEME = "unix://"
+
+
+def unix_path(host: str) -> str | None:
+    """The socket path of a ``unix://`` host, None for a TCP host."""
+    return host[len(UNIX_SCHEME):] if host.startswith(UNIX_SCHEME) else None
+
+
+def describe(host: str, port: int) -> str:
+    return host if unix_path(host) is not None else f"{host}:{port}"
+
+
+def connect(host: str, port: int, timeout: float | None = None) -> socket.socket:
+    """A connected blocking socket to the hub at ``host``/``port``."""
+    path = unix_path(host)
+    if path is None:
+        return socket.create_connection((host, port), timeout)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(path)
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+async def open_connection(
+    host: str, port: int, **kwargs: Any
+) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    """``asyncio.open_connection`` that also understands ``unix://`` hosts."""
+    path = unix_path(host)
+    if path is None:
+        return await asyncio.open_connection(host, port, **kwargs)
+    return await asyncio.open_unix_connection(path, **kwargs)
@@ -1,60 +1,123 @@
+import logging
 import os
+import time
+import uuid
 from typing import Generator, Any
-from .hub import HubClient
+from .agent import HubClient
+from .backpressure import HubBusyError, Pacer
+from .db import TERMINAL_STATUSES
+
 
 class TaskSplitter:
-    """Helper to split large jobs into smaller tasks."""
+    """
+    Helper to split large jobs into smaller tasks.
+
+    When the hub refuses tasks as busy (queue-depth limits), enqueueing
+    slows down to the pace the hub can take, giving up with HubBusyError
+    once a single task has waited ``busy_timeout`` seconds.
+    """
     
-    def __init__(self, hub_host: str, hub_port: int):
+    def __init__(self, hub_host: str, hub_port: int, busy_timeout: float = 300.0):
         self.client = HubClient(hub_host, hub_port)
+        self.busy_timeout = busy_timeout
+        self.pacer = Pacer()
 
-    def split_and_enqueue(self, items: list[Any], prompt_template: str, batch_size: int = 1, task_type: str = "chat") -> list[int]:
+    def split_and_enqueue(
+        self,
+        items: list[Any],
+        prompt_template: str,
+        batch_size: int = 1,
+        task_type: str = "chat",
+        system_prompt: str | None = None,
+        tenant: str | None = None,
+        job: str | None = None,
+    ) -> list[int]:
         """
         Split a list of items into tasks and enqueue them.
         
+        The template is registered with the hub once and each task only
+        carries its {item}; the hub renders the prompt at lease time.
+
         Args:
             items: List of data items to process.
             prompt_template: String with {item} placeholder.
             batch_size: Number of items per task (simple concatenation).
             task_type: "chat" or "python".
+            system_prompt: Optional system prompt shared by every task.
+            tenant: Submitter used for fair-share scheduling
+                (defaults to $KIRO_SWARM_TENANT).
+            job: Job tag for every task (a fresh one is generated if omitted).
             
         Returns:
             List of enqueued task IDs.
         """
+        tenant = tenant or os.environ.get("KIRO_SWARM_TENANT", "default")
+        job = job or f"job-{uuid.uuid4().hex[:12]}"
+        template_id = self.client.call("register_template", {"template": prompt_template})["template_id"]
         task_ids = []
         for i in range(0, len(items), batch_size):
             batch = items[i:i + batch_size]
             # Simple joining for batching, can be customized
             batch_content = "\n---\n".join(str(item) for item in batch)
-            prompt = prompt_template.format(item=batch_content)
             
-            resp = self.client.call("enqueue", {
-                "prompt": prompt,
-                "type": task_type
+            resp = self._enqueue({
+                "template_id": template_id,
+                "variables": {"item": batch_content},
+                "system_prompt": system_prompt,
+                "type": task_type,
+                "tenant": tenant,
+                "job": job
             })
             task_ids.append(resp["task_id"])
             
         return task_ids
 
-    def wait_for_completion(self, task_ids: list[int], poll_interval: float = 1.0) -> dict[int, Any]:
-        """Wait for a specific set of tasks to complete."""
-        import time
+    def _enqueue(self, params: dict[str, Any]) -> dict[str, Any]:
+        deadline = time.monotonic() + self.busy_timeout
+        while True:
+            delay = self.pacer.wait()
+            if delay:
+                time.sleep(delay)
+            try:
+                resp = self.client.call("enqueue", params)
+            except HubBusyError as e:
+                self.pacer.busy(e.retry_after)
+                if time.monotonic() + e.retry_after > deadline:
+                    raise
+                logging.info(f"Hub busy, slowing down enqueues (retry in {e.retry_after}s)")
+                continue
+            self.pacer.ok()
+            return resp
+
+    def wait_for_completion(self, task_ids: list[int], poll_interval: float = 30.0) -> dict[int, Any]:
+        """
+        Wait for a specific set of tasks to finish. Tasks that fail or expire
+        count as finished; check each result's "status".
+
+        Completions are pushed by the hub as they happen; after
+        ``poll_interval`` quiet seconds the tasks are re-checked directly, in
+        case a change happened outside the hub (another process, lease reclaim).
+        """
         results = {}
         pending = set(task_ids)
-        
-        while pending:
-            # In a real massive system, we wouldn't poll list() like this, 
-            # but for <1000 tasks it's okay. Better would be get_task(id).
-            # We'll use list with a large limit for now.
-            resp = self.client.call("list", {"limit": 1000, "status": "done"})
-            done_tasks = {t["task_id"]: t for t in resp.get("tasks", [])}
-            
-            for tid in list(pending):
-                if tid in done_tasks:
-                    results[tid] = done_tasks[tid]
-                    pending.remove(tid)
-            
-            if pending:
-                time.sleep(poll_interval)
+        sub = self.client.subscribe(task_ids=sorted(pending), status=sorted(TERMINAL_STATUSES))
+        try:
+            while pending:
+                # Catches tasks that finished before (or while) we subscribed
+                resp = self.client.call("get_tasks", {"task_ids": sorted(pending)})
+                for t in resp.get("tasks", []):
+                    if t["status"] in TERMINAL_STATUSES:
+                        results[t["task_id"]] = t
+                        pending.discard(t["task_id"])
+                while pending:
+                    event = self.client.next_event(timeout=poll_interval)
+                    if event is None:
+                        break
+                    t = event["task"]
+                    if t["task_id"] in pending:
+                        results[t["task_id"]] = t
+                        pending.discard(t["task_id"])
+        finally:
+            self.client.unsubscribe(sub)
                 
         return results
@@ -1,31 +1,7 @@
 from __future__ import annotations
-import time
-import uuid
-import json
-import socket
-from typing import Any
 
-# --- Client Logic (Duplicated from agent.py for standalone usage) ---
-class HubClient:
-    def __init__(self, host: str, port: int):
-        self.host = host
-        self.port = port
-
-    def call(self, method: str, params: dict[str, Any] | None = None) -> Any:
-        req_id = str(uuid.uuid4())
-        req = {"id": req_id, "method": method, "params": params or {}}
-        
-        with socket.create_connection((self.host, self.port)) as sock:
-            sock.sendall((json.dumps(req) + "\n").encode("utf-8"))
-            f = sock.makefile("r")
-            line = f.readline()
-            if not line:
-                raise RuntimeError("Empty response from hub")
-            resp = json.loads(line)
-            
-        if resp.get("error"):
-            raise RuntimeError(f"Hub error: {resp['error']}")
-        return resp["result"]
+from kirosu.agent import HubClient
+from kirosu.utils import TERMINAL_STATUSES
 
 # --- Thinker Loop Logic ---
 
@@ -73,32 +49,36 @@ def run_thinker_loop(hub_host: str = "localhost", hub_port: int = 8766):
     
     print("--- Thinker Loop Complete ---")
 
-def wait_for_result(client: HubClient, task_id: int, poll_interval: float = 1.0) -> str:
+def wait_for_result(
+    client: HubClient, task_id: int, poll_interval: float = 1.0, recheck_interval: float = 30.0
+) -> str:
     print(f"Waiting for task {task_id}...", end="", flush=True)
-    while True:
-        # In a real app, we'd have a specific 'get_task' method, but 'list' works for now
-        # We filter by checking the list. This is inefficient for large DBs but fine for this demo.
-        # Actually, let's just poll list with a limit and check if our ID is there and done.
-        # A better way in the future would be `get_task(id)`.
-        
-        # For now, we just wait a bit and assume the agent picks it up.
-        # To be robust, we should implement `get_task` in Hub, but let's stick to existing methods.
-        # We can use `list` and filter client-side or just wait.
-        
-        # Let's implement a simple poller using `list`
-        tasks = client.call("list", {"limit": 100})["tasks"]
-        task = next((t for t in tasks if t["task_id"] == task_id), None)
-        
-        if task:
-            if task["status"] == "done":
-                print(" Done!")
-                return task["result"]
-            elif task["status"] == "failed":
-                print(" Failed!")
-                raise RuntimeError(f"Task {task_id} failed: {task.get('error')}")
-        
-        print(".", end="", flush=True)
-        time.sleep(poll_interval)
+    # The hub pushes the task's state changes; get_tasks covers a task that
+    # finished before the subscription was in place, and is repeated after
+    # recheck_interval quiet seconds in case the subscription was lost with
+    # a reconnect.
+    sub = client.subscribe(task_ids=[task_id], status=sorted(TERMINAL_STATUSES))
+    try:
+        task = client.call("get_tasks", {"task_ids": [task_id]})["tasks"][0]
+        quiet = 0.0
+        while task["status"] not in TERMINAL_STATUSES:
+            event = client.next_event(timeout=poll_interval)
+            if event is not None and event["task"]["task_id"] == task_id:
+                task = event["task"]
+                continue
+            print(".", end="", flush=True)
+            quiet += poll_interval
+            if quiet >= recheck_interval:
+                task = client.call("get_tasks", {"task_ids": [task_id]})["tasks"][0]
+                quiet = 0.0
+    finally:
+        client.unsubscribe(sub)
+
+    if task["status"] == "done":
+        print(" Done!")
+        return task["result"]
+    print(" Failed!")
+    raise RuntimeError(f"Task {task_id} {task['status']}: {task.get('error')}")
 
 if __name__ == "__main__":
     run_thinker_loop()
@@ -1,5 +1,5 @@
 import unittest
-from unittest.mock import MagicMock, patch
+from unittest.mock import ANY, MagicMock, patch
 import os
 import json
 from kirosu.agent import KiroAgent
@@ -54,7 +54,9 @@ class TestAgentIntegration(unittest.TestCase):
         self.agent.client.call.assert_any_call("ack", {
             "task_id": 123,
             "status": "done",
-            "result": "Optimized Code"
+            "result": "Optimized Code",
+            "started_at": ANY,
+            "provider_time_sec": ANY,
         })
 
     @patch("subprocess.run")
@@ -82,6 +84,119 @@ class TestAgentIntegration(unittest.TestCase):
         self.assertIn("python3", args)
         self.assertIn("print('hello')", args)
 
+    @patch("subprocess.run")
+    def test_tick_batch_uses_ack_many(self, mock_run):
+        self.agent.batch_size = 2
+        tasks = [
+            {"task_id": 1, "prompt": "print(1)", "type": "python"},
+            {"task_id": 2, "prompt": "print(2)", "type": "python"},
+        ]
+        self.agent.client.call.side_effect = [
+            {"tasks": tasks},
+            {"acked": 2},
+        ]
+
+        mock_process = MagicMock()
+        mock_process.returncode = 0
+        mock_process.stdout = "ok\n"
+        mock_run.return_value = mock_process
+
+        self.agent._tick()
+
+        method, params = self.agent.client.call.call_args_list[0][0]
+        self.assertEqual(method, "lease")
+        self.assertEqual(params["max_tasks"], 2)
+        self.assertEqual(params["model"], "test-model")
+        method, params = self.agent.client.call.call_args[0]
+        self.assertEqual(method, "ack_many")
+        self.assertEqual([a["task_id"] for a in params["acks"]], [1, 2])
+        self.assertTrue(all(a["status"] == "done" for a in params["acks"]))
+
+    @patch("subprocess.run")
+    def test_tick_batch_releases_unprocessed(self, mock_run):
+        self.agent.batch_size = 2
+        tasks = [
+            {"task_id": 1, "prompt": "print(1)", "type": "python"},
+            {"task_id": 2, "prompt": "print(2)", "type": "python"},
+        ]
+        self.agent.client.call.side_effect = [
+            {"tasks": tasks},
+            {"released": 2},
+        ]
+        mock_run.side_effect = KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            self.agent._tick()
+
+        self.agent.client.call.assert_called_with("release_many", {"task_ids": [1, 2], "worker_id": "test-worker"})
+
+    @patch("subprocess.run")
+    def test_tick_acks_finished_work_even_if_release_fails(self, mock_run):
+        self.agent.batch_size = 2
+        tasks = [
+            {"task_id": 1, "prompt": "print(1)", "type": "python"},
+            {"task_id": 2, "prompt": "print(2)", "type": "python"},
+        ]
+        self.agent.client.call.side_effect = [{"tasks": tasks}, {"ok": True}, ConnectionError("hub gone")]
+        done = MagicMock(returncode=0, stdout="1\n")
+        mock_run.side_effect = [done, KeyboardInterrupt]
+
+        with self.assertRaises(ConnectionError):
+            self.agent._tick()
+
+        methods = [c[0][0] for c in self.agent.client.call.call_args_list]
+        self.assertEqual(methods, ["lease", "ack", "release_many"])
+        self.assertEqual(self.agent.client.call.call_args_list[1][0][1]["task_id"], 1)
+
+    def test_session_turns_cached_between_tasks(self):
+        self.agent.provider = MagicMock()
+        self.agent.provider.run.side_effect = ["Hi Ann", "Your name is Ann"]
+        self.agent.client.call.side_effect = [
+            {"tasks": [{"task_id": 5, "prompt": "Hello", "type": "chat", "session_id": "s1", "session_turns": 1}]},
+            {"session_id": "s1", "tasks": [
+                {"task_id": 3, "prompt": "I am Ann", "status": "done", "result": "Noted"},
+                {"task_id": 5, "prompt": "Hello", "status": "leased", "result": None},
+            ]},
+            {"ok": True},
+            {"tasks": [{"task_id": 6, "prompt": "Who am I?", "type": "chat", "session_id": "s1", "session_turns": 2}]},
+            {"ok": True},
+        ]
+
+        self.agent._tick()
+        self.agent._tick()
+
+        # Only the cold first turn fetched history; the second reused the cache
+        methods = [c[0][0] for c in self.agent.client.call.call_args_list]
+        self.assertEqual(methods, ["lease", "session_history", "ack", "lease", "ack"])
+        last_prompt = self.agent.provider.run.call_args[0][0]
+        self.assertEqual(
+            last_prompt,
+            "User: I am Ann\nAssistant: Noted\nUser: Hello\nAssistant: Hi Ann\nUser: Who am I?\nAssistant:",
+        )
+
+    def test_session_cache_dropped_after_failover(self):
+        self.agent.provider = MagicMock()
+        self.agent.client.call.side_effect = [
+            {"tasks": [{"task_id": 5, "prompt": "Hello", "type": "chat", "session_id": "s1", "session_turns": 0}]},
+            {"session_id": "s1", "tasks": []},
+            {"ok": True},
+            # Another worker served turn 6 in between: the hub has finished 2 turns, not 1
+            {"tasks": [{"task_id": 7, "prompt": "Who am I?", "type": "chat", "session_id": "s1", "session_turns": 2}]},
+            {"session_id": "s1", "tasks": [
+                {"task_id": 5, "prompt": "Hello", "status": "done", "result": "Hi Ann"},
+                {"task_id": 6, "prompt": "Capital of France?", "status": "done", "result": "Paris"},
+            ]},
+            {"ok": True},
+        ]
+        self.agent.provider.run.side_effect = ["Hi Ann", "Your name is Ann"]
+
+        self.agent._tick()
+        self.agent._tick()
+
+        methods = [c[0][0] for c in self.agent.client.call.call_args_list]
+        self.assertEqual(methods, ["lease", "session_history", "ack", "lease", "session_history", "ack"])
+        self.assertIn("Capital of France?", self.agent.provider.run.call_args[0][0])
+
     @patch("time.sleep")
     def test_run_loop_single_iteration(self, mock_sleep):
         # Make sleep raise an exception to exit the infinite loop
@@ -96,5 +211,21 @@ class TestAgentIntegration(unittest.TestCase):
             
             mock_tick.assert_called_once()
 
+    @patch("time.sleep")
+    def test_run_loop_backs_off_on_early_empty_lease(self, mock_sleep):
+        # A hub that answers a long poll at once must not be hammered
+        mock_sleep.side_effect = KeyboardInterrupt
+        self.agent.lease_wait = 20.0
+        with patch.object(self.agent, "_tick", return_value=0):
+            with self.assertRaises(KeyboardInterrupt):
+                self.agent.run_loop(poll_interval=2.0)
+        mock_sleep.assert_called_once_with(2.0)
+
+        mock_sleep.reset_mock()
+        with patch.object(self.agent, "_tick", return_value=1):
+            with self.assertRaises(KeyboardInterrupt):
+                self.agent.run_loop(poll_interval=2.0)
+        mock_sleep.assert_called_once_with(0.0)
+
 if __name__ == "__main__":
     unittest.main()
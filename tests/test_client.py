@@ -0,0 +1,100 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+from kirosu.agent import HubClient
+from kirosu.backpressure import HubBusyError
+from kirosu.client import SwarmClient
+
+
+def _finish(hub_port, task_id, result="ok"):
+    leaser = HubClient("127.0.0.1", hub_port)
+    leaser.call("lease", {"worker_id": "w", "max_tasks": 100})
+    leaser.call("ack", {"task_id": task_id, "status": "done", "result": result})
+
+
+def test_gather_many_calls_on_one_connection(hub_port):
+    async def scenario():
+        async with SwarmClient(port=hub_port) as client:
+            ids = await asyncio.gather(*(client.add_task(f"task {i}") for i in range(300)))
+            tasks = await asyncio.gather(*(client.get_task(task_id) for task_id in ids))
+            return ids, tasks
+
+    ids, tasks = asyncio.run(scenario())
+    assert len(set(ids)) == 300
+    assert [t["prompt"] for t in tasks] == [f"task {i}" for i in range(300)]
+
+
+def test_concurrent_waits_each_get_their_task(hub_port):
+    async def scenario():
+        async with SwarmClient(port=hub_port) as client:
+            ids = [await client.add_task(f"t{i}") for i in range(3)]
+            for task_id in ids:
+                threading.Timer(0.2, _finish, args=(hub_port, task_id, f"r{task_id}")).start()
+            tasks = await asyncio.gather(*(client.wait_for_task(task_id, timeout=5) for task_id in ids))
+            return ids, tasks
+
+    ids, tasks = asyncio.run(scenario())
+    assert [t["result"] for t in tasks] == [f"r{i}" for i in ids]
+
+
+def test_busy_hub_paces_enqueues(hub_port):
+    admin = HubClient("127.0.0.1", hub_port)
+    admin.call("set_queue_limit", {"key": "hub", "max_queued": 4})
+    for i in range(4):
+        admin.call("enqueue", {"prompt": f"fill {i}"})
+    with pytest.raises(HubBusyError) as excinfo:
+        admin.call("enqueue", {"prompt": "refused"})
+    assert excinfo.value.retry_after >= 1
+
+    # A worker drains the queue while producers push more than fits
+    stop = threading.Event()
+
+    def drain():
+        worker = HubClient("127.0.0.1", hub_port)
+        while not stop.wait(0.2):
+            worker.call("lease", {"worker_id": "w", "max_tasks": 2})
+
+    threading.Thread(target=drain, daemon=True).start()
+
+    async def scenario():
+        async with SwarmClient(port=hub_port, busy_timeout=30) as client:
+            return await asyncio.gather(*(client.add_task(f"paced {i}") for i in range(6)))
+
+    try:
+        assert len(set(asyncio.run(scenario()))) == 6
+        # Or let the hub hold the request until there is room
+        assert admin.call("enqueue", {"prompt": "blocking", "wait_seconds": 30})["task_id"]
+    finally:
+        stop.set()
+    assert admin.call("stats")["stats"]["queue_limits"]["hub"]["rejected"] >= 1
+
+
+def test_idempotent_call_is_resent_after_reconnect():
+    async def scenario():
+        connections = []
+
+        async def handle(reader, writer):
+            connections.append(writer)
+            first = len(connections) == 1
+            while line := await reader.readline():
+                req = json.loads(line)
+                if first or req["method"] == "enqueue":
+                    writer.close()  # Drop the connection mid-request
+                    return
+                resp = {"id": req["id"], "result": {"method": req["method"]}, "error": None}
+                writer.write((json.dumps(resp) + "\n").encode())
+
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            async with SwarmClient(port=port, codec="jsonl") as client:
+                assert await client._send_request("stats", {}) == {"method": "stats"}
+                assert len(connections) == 2
+
+                with pytest.raises(ConnectionError):
+                    await client._send_request("enqueue", {"prompt": "not resent"})
+
+    asyncio.run(scenario())
@@ -0,0 +1,63 @@
+import asyncio
+import json
+import socket
+
+import pytest
+
+from kirosu.agent import HubClient
+from kirosu.client import SwarmClient
+from kirosu import codec as codec_module
+from kirosu.codec import CODECS, FRAME_HEADER, JSON_FRAMES, json_dumps, json_loads, negotiate
+
+BIG = "line with \"quotes\" and ünïcode\n" * 40000
+
+
+@pytest.mark.parametrize("codec", sorted(CODECS))
+def test_round_trip_over_each_codec(hub_port, codec):
+    client = HubClient("127.0.0.1", hub_port, codec=codec)
+    task_id = client.call("enqueue", {"prompt": BIG})["task_id"]
+    assert client.codec.name == codec
+
+    sub = client.subscribe(task_ids=[task_id])
+    client.call("cancel", {"task_ids": [task_id]})
+    assert client.next_event(timeout=2)["task"]["status"] == "cancelled"
+    client.unsubscribe(sub)
+
+    assert client.call("get_tasks", {"task_ids": [task_id]})["tasks"][0]["prompt"] == BIG
+
+
+def test_swarm_client_over_frames(hub_port):
+    async def scenario():
+        async with SwarmClient(port=hub_port, codec="json") as client:
+            task_id = await client.add_task(BIG)
+            assert client.codec.name == "json"
+            return (await client.get_task(task_id))["prompt"]
+
+    assert asyncio.run(scenario()) == BIG
+
+
+def test_hello_falls_back_to_jsonl(hub_port):
+    sock = socket.create_connection(("127.0.0.1", hub_port))
+    stream = sock.makefile("rwb")
+    stream.write(b'{"id": "h", "method": "hello", "params": {"codecs": ["cbor"]}}\n')
+    stream.write(b'{"id": "p", "method": "ping", "params": {}}\n')
+    stream.flush()
+    assert json.loads(stream.readline())["result"]["codec"] == "jsonl"
+    assert json.loads(stream.readline())["result"]["pong"] is True
+    sock.close()
+
+
+def test_frames_carry_raw_newlines():
+    payload = JSON_FRAMES.pack({"text": "a\nb"})
+    (size,) = FRAME_HEADER.unpack_from(payload)
+    assert size == len(payload) - FRAME_HEADER.size
+    assert JSON_FRAMES.loads(payload[FRAME_HEADER.size:]) == {"text": "a\nb"}
+    assert negotiate(["cbor", "json"]) is JSON_FRAMES
+
+
+def test_json_backends_agree():
+    obj = {"text": "naïve \"quote\"\n", "n": 3, "x": 1.5, "none": None, "list": [True, {"k": "v"}]}
+    assert json_loads(json_dumps(obj)) == obj
+    assert codec_module._stdlib_loads(json_dumps(obj)) == obj
+    assert json_loads(codec_module._stdlib_dumps(obj)) == obj
+    assert CODECS["jsonl"].pack(obj).endswith(b"\n") and b"\n" not in CODECS["jsonl"].pack(obj)[:-1]
@@ -1,4 +1,5 @@
 import pytest
+import threading
 import time
 from kirosu.db import TaskStore
 
@@ -49,3 +50,247 @@ def test_retry_failed(store):
     tasks = store.list(status="queued", limit=1)
     assert len(tasks) == 1
     assert tasks[0].prompt == "fail task"
+
+def test_lifecycle_timestamps(store):
+    tid = store.enqueue("timed task", queue="reports")
+    leased = store.lease("worker1", 1, 10)
+    assert leased[0].leased_at is not None
+    assert leased[0].queue == "reports"
+
+    store.ack(tid, "done", result="ok", error=None, provider_time_sec=0.25)
+    task = store.list(status="done", limit=1)[0]
+    assert task.started_at == task.leased_at
+    assert task.finished_at >= task.started_at
+    assert task.provider_time_sec == 0.25
+
+def test_lease_by_queue(store):
+    store.enqueue("default task")
+    store.enqueue("report task", queue="reports")
+
+    tasks = store.lease("worker1", max_tasks=5, lease_seconds=10, queue="reports")
+    assert [t.prompt for t in tasks] == ["report task"]
+
+def test_latency_report(store):
+    for i in range(4):
+        store.enqueue(f"task {i}", task_type="python" if i % 2 else "chat")
+    for t in store.lease("worker1", max_tasks=4, lease_seconds=10):
+        store.ack(t.task_id, "done", result="ok", error=None)
+    # Tasks that never ran stay out of the percentiles
+    store.cancel([store.enqueue("cancelled")])
+    store.enqueue("expired", ttl_seconds=-1)
+    store.expire_stale()
+
+    report = store.latency_report(group_by="type")
+    assert set(report["groups"]) == {"chat", "python"}
+    chat = report["groups"]["chat"]
+    assert chat["end_to_end"]["count"] == 2
+    assert chat["queue_wait"]["p99"] <= chat["end_to_end"]["p99"]
+
+    by_worker = store.latency_report(group_by="worker")
+    assert by_worker["groups"]["worker1"]["run_time"]["count"] == 4
+
+    with pytest.raises(ValueError):
+        store.latency_report(group_by="tenant")
+
+def test_ack_many(store):
+    ids = [store.enqueue(f"task {i}") for i in range(3)]
+    store.lease("worker1", 3, 10)
+
+    count = store.ack_many([
+        {"task_id": ids[0], "status": "done", "result": "a"},
+        {"task_id": ids[1], "status": "done", "result": "b"},
+        {"task_id": ids[2], "status": "failed", "error": "boom"},
+    ])
+    assert count == 3
+    stats = store.stats()
+    assert stats["done"] == 2
+    assert stats["failed"] == 1
+
+    with pytest.raises(ValueError):
+        store.ack_many([{"task_id": ids[0], "status": "bogus"}])
+
+def test_release_many(store):
+    ids = [store.enqueue(f"task {i}") for i in range(3)]
+    store.lease("worker1", 3, 300)
+
+    # Only the owning worker's leases are released
+    assert store.release_many(ids[:2], worker_id="worker2") == 0
+    assert store.release_many(ids[:2], worker_id="worker1") == 2
+
+    requeued = store.lease("worker2", 5, 300)
+    assert [t.task_id for t in requeued] == ids[:2]
+
+def test_search_fts(db_path):
+    store = TaskStore(db_path, fts=True)
+    try:
+        assert store.fts_enabled
+        a = store.enqueue("summarise the quarterly report", system_prompt="You are an accountant")
+        b = store.enqueue("translate the menu")
+        store.lease("worker1", 2, 10)
+        store.ack(b, "failed", result=None, error="quota exceeded for model")
+
+        tasks, cursor = store.search("quarterly")
+        assert [t.task_id for t in tasks] == [a]
+        assert cursor is None
+
+        # Results and errors are indexed as they are written
+        assert [t.task_id for t in store.search("quota")[0]] == [b]
+        assert store.search("quota", status="done")[0] == []
+        assert [t.task_id for t in store.search("accountant")[0]] == [a]
+
+        # Retrying clears the error from the index
+        store.retry_all_failed()
+        assert store.search("quota")[0] == []
+    finally:
+        store.close()
+
+def test_search_pagination(db_path):
+    store = TaskStore(db_path, fts=True)
+    try:
+        ids = [store.enqueue(f"invoice number {i}") for i in range(5)]
+        page1, cursor = store.search("invoice", limit=3)
+        assert [t.task_id for t in page1] == ids[:-4:-1]
+        page2, cursor2 = store.search("invoice", limit=3, cursor=cursor)
+        assert [t.task_id for t in page2] == ids[1::-1]
+        assert cursor2 is None
+    finally:
+        store.close()
+
+def test_search_backfills_and_falls_back(db_path):
+    plain = TaskStore(db_path)
+    tid = plain.enqueue("legacy prompt about llamas")
+    assert not plain.fts_enabled
+    # Without the index search is a substring scan
+    assert [t.task_id for t in plain.search("llama")[0]] == [tid]
+    # ...over interned system prompts and template variables too
+    pirate = plain.enqueue("ahoy", system_prompt="Talk like a pirate")
+    tpl = plain.register_template("Describe a {animal}")
+    zebra = plain.enqueue(template_id=tpl, variables={"animal": "zebra"})
+    assert [t.task_id for t in plain.search("pirate")[0]] == [pirate]
+    assert [t.task_id for t in plain.search("zebra")[0]] == [zebra]
+    plain.close()
+
+    indexed = TaskStore(db_path, fts=True)
+    try:
+        assert [t.task_id for t in indexed.search("llamas")[0]] == [tid]
+        with pytest.raises(ValueError):
+            indexed.search('"unbalanced')
+    finally:
+        indexed.close()
+
+def test_system_prompt_interned(store):
+    persona = "You are a meticulous reviewer. " * 50
+    a = store.enqueue("review A", system_prompt=persona)
+    b = store.enqueue("review B", system_prompt=persona)
+
+    conn = store._get_conn()
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM system_prompts").fetchone()[0] == 1
+        assert conn.execute("SELECT COUNT(*) FROM tasks WHERE system_prompt IS NOT NULL").fetchone()[0] == 0
+    finally:
+        store._return_conn(conn)
+
+    tasks = store.lease("worker1", 2, 10)
+    assert {t.task_id for t in tasks} == {a, b}
+    assert all(t.system_prompt == persona for t in tasks)
+
+def test_template_materialised_at_lease(store):
+    tpl = store.register_template("Summarise this chunk:\n{item}")
+    assert store.register_template("Summarise this chunk:\n{item}") == tpl
+    assert store.register_template("Fixed {item}", template_id="fixed") == "fixed"
+    assert store.register_template("Fixed {item}", template_id="fixed") == "fixed"
+    with pytest.raises(ValueError, match="different body"):
+        store.register_template("Rewritten {item}", template_id="fixed")
+
+    tid = store.enqueue(template_id=tpl, variables={"item": "chunk 7"})
+    leased = store.lease("worker1", 1, 10)
+    assert leased[0].task_id == tid
+    assert leased[0].prompt == "Summarise this chunk:\nchunk 7"
+
+    with pytest.raises(ValueError):
+        store.enqueue(template_id=tpl, variables={})
+    with pytest.raises(ValueError):
+        store.enqueue(template_id="tpl-missing", variables={"item": "x"})
+
+def test_expired_tasks_are_skipped_and_reaped(store):
+    stale = store.enqueue("stale signal", ttl_seconds=-1)
+    fresh = store.enqueue("fresh signal", ttl_seconds=60)
+    forever = store.enqueue("no ttl")
+
+    leased = store.lease("worker1", 5, 10)
+    assert {t.task_id for t in leased} == {fresh, forever}
+
+    assert store.expire_stale() == [stale]
+    assert store.expire_stale() == []
+    task = store.get_tasks([stale])[0]
+    assert task.status == "expired"
+    assert task.finished_at is not None
+    assert store.stats()["expired"] == 1
+
+def test_get_tasks(store):
+    a = store.enqueue("a")
+    b = store.enqueue("b")
+    assert [t.prompt for t in store.get_tasks([b, a, 999])] == ["a", "b"]
+    assert store.get_tasks([]) == []
+
+def test_get_tasks_chunks_large_id_lists(store, monkeypatch):
+    monkeypatch.setattr("kirosu.db._MAX_IDS_PER_QUERY", 3)
+    ids = [store.enqueue(f"t{i}") for i in range(10)]
+    assert [t.task_id for t in store.get_tasks(ids[::-1] + [999])] == ids
+
+def test_cancel_and_release_many_chunk_large_id_lists(store, monkeypatch):
+    monkeypatch.setattr("kirosu.db._MAX_IDS_PER_QUERY", 3)
+    ids = [store.enqueue(f"t{i}") for i in range(10)]
+    store.lease("worker1", 7, 300)
+
+    assert store.release_many(ids[:7][::-1], worker_id="worker1") == 7
+    assert store.cancel(ids[::-1] + [999]) == ids
+    assert store.stats()["cancelled"] == 10
+
+def test_batch_commits_together_and_savepoints_isolate(store):
+    with store.batch():
+        first = store.enqueue("kept")
+        with pytest.raises(ValueError):
+            with store.savepoint():
+                store.enqueue("undone")
+                raise ValueError("step failed")
+        store.enqueue("also kept")
+        # Nothing is visible to other connections until the batch commits
+        other = store._pool.get()
+        try:
+            assert other.execute("SELECT COUNT(*) FROM tasks").fetchone()[0] == 0
+        finally:
+            store._pool.put(other)
+    assert [t.prompt for t in store.list(status=None, limit=10)][::-1] == ["kept", "also kept"]
+    assert store.get_tasks([first])[0].status == "queued"
+
+    with pytest.raises(RuntimeError):
+        with store.batch():
+            store.enqueue("rolled back")
+            raise RuntimeError("abort")
+    assert len(store.list(status=None, limit=10)) == 2
+
+def test_rolled_back_batch_leaves_no_cached_prompts(store):
+    with pytest.raises(RuntimeError):
+        with store.batch():
+            store.enqueue("first", system_prompt="You are a pirate")
+            store.register_template("Hello {name}", template_id="greeting")
+            raise RuntimeError("abort")
+
+    # The interned prompt is written again instead of trusted from the cache
+    tid = store.enqueue("second", system_prompt="You are a pirate")
+    assert store.lease("w", 1, 300)[0].system_prompt == "You are a pirate"
+    assert store.get_tasks([tid])[0].system_prompt == "You are a pirate"
+    with pytest.raises(ValueError, match="Unknown template"):
+        store.enqueue(template_id="greeting", variables={"name": "x"})
+
+def test_batch_that_reads_first_survives_a_concurrent_write(store):
+    outside: list[int] = []
+    with store.batch():
+        assert store.get_tasks([1]) == []
+        writer = threading.Thread(target=lambda: outside.append(store.enqueue("outside")))
+        writer.start()
+        time.sleep(0.1)  # The outside write waits for the batch instead of invalidating its snapshot
+        inside = store.enqueue("inside")
+    writer.join(5)
+    assert {t.prompt for t in store.get_tasks([inside, *outside])} == {"inside", "outside"}
@@ -76,3 +76,98 @@ def test_dangerous_python(hub_port):
     
     assert result is not None
     assert "DANGEROUS EXECUTION SUCCESS" in result
+
+
+def test_auth_handshake_keeps_key_off_the_wire(db_path, monkeypatch):
+    import asyncio
+    import json
+    import socket
+    from kirosu.auth import sign
+    from kirosu.client import SwarmClient
+
+    monkeypatch.setenv("KIRO_SWARM_KEY", "secret123")
+    ready = threading.Event()
+    port_container = {}
+    threading.Thread(
+        target=run_hub,
+        args=(db_path, "127.0.0.1", 0, 300),
+        kwargs={"ready_callback": lambda port: (port_container.update(port=port), ready.set())},
+        daemon=True,
+    ).start()
+    assert ready.wait(5)
+    port = port_container["port"]
+
+    sock = socket.create_connection(("127.0.0.1", port))
+    stream = sock.makefile("rwb")
+
+    def rpc(method, params=None):
+        stream.write(json.dumps({"id": method, "method": method, "params": params or {}}).encode() + b"\n")
+        stream.flush()
+        return json.loads(stream.readline())
+
+    assert "Invalid KIRO_SWARM_KEY" in rpc("stats")["error"]["message"]
+    nonce = rpc("auth")["result"]["nonce"]
+    assert "Invalid KIRO_SWARM_KEY" in rpc("auth", {"mac": sign("wrong", nonce)})["error"]["message"]
+    # Each nonce is single use
+    assert rpc("auth", {"mac": sign("secret123", nonce)})["error"]
+    nonce = rpc("auth")["result"]["nonce"]
+    assert rpc("auth", {"mac": sign("secret123", nonce)})["result"]["authenticated"] is True
+    assert "stats" in rpc("stats")["result"]
+    sock.close()
+
+    # Hubs keep accepting the key itself on every request
+    legacy = socket.create_connection(("127.0.0.1", port))
+    stream = legacy.makefile("rwb")
+    assert "stats" in rpc("stats", {"auth_token": "secret123"})["result"]
+    legacy.close()
+
+    async def scenario():
+        async with SwarmClient(port=port) as client:
+            task_id = await client.add_task("authenticated once")
+            return (await client.get_task(task_id))["prompt"]
+
+    assert asyncio.run(scenario()) == "authenticated once"
+    HubClient("127.0.0.1", port).call("shutdown")
+
+
+def test_legacy_auth_fallback_is_opt_in(monkeypatch):
+    import json
+    import socket
+
+    # A hub from before the auth handshake: it knows neither hello nor auth
+    server = socket.create_server(("127.0.0.1", 0))
+    seen = []
+
+    def old_hub():
+        while True:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            stream = conn.makefile("rwb")
+            for line in stream:
+                req = json.loads(line)
+                seen.append(req["params"])
+                if req["method"] in ("hello", "auth"):
+                    resp = {"id": req["id"], "result": None, "error": "Unknown method"}
+                else:
+                    resp = {"id": req["id"], "result": {"ok": True}, "error": None}
+                stream.write(json.dumps(resp).encode() + b"\n")
+                stream.flush()
+            conn.close()
+
+    threading.Thread(target=old_hub, daemon=True).start()
+    port = server.getsockname()[1]
+    monkeypatch.setenv("KIRO_SWARM_KEY", "secret123")
+    monkeypatch.delenv("KIRO_SWARM_LEGACY_AUTH", raising=False)
+    try:
+        with pytest.raises(RuntimeError, match="KIRO_SWARM_LEGACY_AUTH"):
+            HubClient("127.0.0.1", port).call("stats")
+        assert not any("auth_token" in p for p in seen)
+
+        params = {"limit": 1}
+        assert HubClient("127.0.0.1", port, legacy_auth=True).call("stats", params) == {"ok": True}
+        assert seen[-1]["auth_token"] == "secret123"
+        assert params == {"limit": 1}  # The caller's dict is left alone
+    finally:
+        server.close()
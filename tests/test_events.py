@@ -0,0 +1,138 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from kirosu.agent import HubClient
+from kirosu.client import SwarmClient
+from kirosu.utils import TaskSplitter
+
+
+def _finish(port, task_id, result="ok"):
+    worker = HubClient("127.0.0.1", port)
+    worker.call("lease", {"worker_id": "w", "max_tasks": 1})
+    worker.call("ack", {"task_id": task_id, "status": "done", "result": result})
+
+
+def test_subscribe_pushes_state_changes(hub_port):
+    client = HubClient("127.0.0.1", hub_port)
+    client.subscribe(job="j1")
+    task_id = client.call("enqueue", {"prompt": "hi", "job": "j1"})["task_id"]
+    client.call("enqueue", {"prompt": "other job", "job": "j2"})
+    _finish(hub_port, task_id)
+
+    statuses = []
+    while len(statuses) < 3:
+        event = client.next_event(timeout=2)
+        assert event is not None
+        assert event["task"]["task_id"] == task_id
+        statuses.append(event["task"]["status"])
+    assert statuses == ["queued", "leased", "done"]
+    assert client.next_event(timeout=0.1) is None
+
+
+def test_status_filter_and_unsubscribe(hub_port):
+    client = HubClient("127.0.0.1", hub_port)
+    sub = client.subscribe(status=["done"])
+    task_id = client.call("enqueue", {"prompt": "hi"})["task_id"]
+    _finish(hub_port, task_id, result="42")
+
+    event = client.next_event(timeout=2)
+    assert event["task"]["status"] == "done"
+    assert event["task"]["result"] == "42"
+
+    client.unsubscribe(sub)
+    _finish(hub_port, client.call("enqueue", {"prompt": "again"})["task_id"])
+    assert client.next_event(timeout=0.2) is None
+
+
+def test_task_splitter_waits_on_events(hub_port):
+    splitter = TaskSplitter("127.0.0.1", hub_port)
+    ids = splitter.split_and_enqueue(["a", "b"], "say {item}")
+
+    def worker():
+        for task_id in ids:
+            _finish(hub_port, task_id, result=f"done {task_id}")
+
+    threading.Timer(0.2, worker).start()
+    results = splitter.wait_for_completion(ids, poll_interval=5)
+    assert {t["result"] for t in results.values()} == {f"done {i}" for i in ids}
+
+
+def test_swarm_client_wait_for_task(hub_port):
+    async def scenario():
+        async with SwarmClient(port=hub_port) as client:
+            task_id = await client.add_task("hi")
+            threading.Timer(0.2, _finish, args=(hub_port, task_id, "pong")).start()
+            task = await client.wait_for_task(task_id, timeout=5)
+            assert task["result"] == "pong"
+
+    asyncio.run(scenario())
+
+
+def test_run_returns_result_in_one_call(hub_port):
+    def worker():
+        leaser = HubClient("127.0.0.1", hub_port)
+        task = leaser.call("lease", {"worker_id": "w", "wait_seconds": 5})["tasks"][0]
+        leaser.call("ack", {"task_id": task["task_id"], "status": "done", "result": task["prompt"].upper()})
+
+    threading.Thread(target=worker, daemon=True).start()
+    assert HubClient("127.0.0.1", hub_port).run("ping", timeout=5) == "PING"
+
+
+def test_run_times_out_and_leaves_task(hub_port):
+    client = HubClient("127.0.0.1", hub_port)
+    with pytest.raises(RuntimeError, match="did not finish"):
+        client.run("nobody home", timeout=0.2)
+    assert client.call("stats")["stats"]["queued"] == 1
+
+
+def test_run_cancelled_when_caller_disconnects(hub_port):
+    client = HubClient("127.0.0.1", hub_port, codec="jsonl")
+    client._connect()
+    client.sock.sendall(b'{"id": "1", "method": "run", "params": {"prompt": "abandoned", "timeout": 30}}\n')
+    time.sleep(0.2)
+    client._disconnect()
+
+    observer = HubClient("127.0.0.1", hub_port)
+    deadline = time.time() + 3
+    while time.time() < deadline:
+        tasks = observer.call("list", {"limit": 1})["tasks"]
+        if tasks and tasks[0]["status"] == "cancelled":
+            break
+        time.sleep(0.1)
+    assert tasks[0]["status"] == "cancelled"
+
+
+def test_batch_answers_in_order_in_one_round_trip(hub_port):
+    client = HubClient("127.0.0.1", hub_port)
+    sub = client.subscribe(status=["queued"])
+    with client.batch() as batch:
+        queued = [batch.call("enqueue", {"prompt": f"p{i}"}) for i in range(3)]
+        pong = batch.call("ping")
+        bogus = batch.call("no_such_method")
+        stats = batch.call("stats")
+
+    ids = [f.result()["task_id"] for f in queued]
+    assert pong.result()["pong"] is True
+    with pytest.raises(RuntimeError, match="Unknown method"):
+        bogus.result()
+    assert stats.result()["stats"]["queued"] == 3
+    # Events go out once the batch's transaction has committed
+    events = [client.next_event(timeout=2) for _ in ids]
+    assert sorted(e["task"]["task_id"] for e in events) == ids
+    client.unsubscribe(sub)
+
+
+def test_swarm_client_batch(hub_port):
+    async def scenario():
+        async with SwarmClient(port=hub_port) as client:
+            async with client.batch() as batch:
+                queued = batch.call("enqueue", {"prompt": "batched"})
+                listed = batch.call("list", {"limit": 5})
+            task_id = (await queued)["task_id"]
+            return task_id, await listed
+
+    task_id, listed = asyncio.run(scenario())
+    assert [t["task_id"] for t in listed["tasks"]] == [task_id]
@@ -0,0 +1,95 @@
+import asyncio
+import json
+import socket
+import threading
+import time
+
+from kirosu.agent import HubClient
+from kirosu.hub import LeaseWaiters
+
+
+def test_long_poll_lease_returns_when_work_arrives(hub_port):
+    client = HubClient("127.0.0.1", hub_port)
+    result = {}
+
+    def lease():
+        start = time.monotonic()
+        tasks = HubClient("127.0.0.1", hub_port).call(
+            "lease", {"worker_id": "w", "max_tasks": 1, "lease_seconds": 60, "wait_seconds": 10}
+        )["tasks"]
+        result["tasks"] = tasks
+        result["waited"] = time.monotonic() - start
+
+    t = threading.Thread(target=lease, daemon=True)
+    t.start()
+    time.sleep(0.3)
+    task_id = client.call("enqueue", {"prompt": "wake up"})["task_id"]
+    t.join(timeout=5)
+
+    assert [task["task_id"] for task in result["tasks"]] == [task_id]
+    assert result["waited"] < 2
+
+
+def test_long_poll_lease_times_out_empty(hub_port):
+    client = HubClient("127.0.0.1", hub_port)
+    start = time.monotonic()
+    resp = client.call("lease", {"worker_id": "w", "max_tasks": 1, "wait_seconds": 0.2})
+    assert resp["tasks"] == []
+    assert time.monotonic() - start >= 0.2
+
+
+def test_pipelined_requests_answer_out_of_order(hub_port):
+    sock = socket.create_connection(("127.0.0.1", hub_port))
+    stream = sock.makefile("rwb")
+    requests = [
+        {"id": "slow", "method": "lease", "params": {"worker_id": "w", "wait_seconds": 10}},
+        {"id": "fast", "method": "ping", "params": {}},
+        {"id": "work", "method": "enqueue", "params": {"prompt": "unblock"}},
+    ]
+    for req in requests:
+        stream.write((json.dumps(req) + "\n").encode())
+    stream.flush()
+
+    replies = [json.loads(stream.readline()) for _ in requests]
+    sock.close()
+
+    # The ping overtakes the parked lease that was sent before it
+    order = [r["id"] for r in replies]
+    assert order.index("fast") < order.index("slow")
+    leased = next(r for r in replies if r["id"] == "slow")["result"]["tasks"]
+    work = next(r for r in replies if r["id"] == "work")["result"]["task_id"]
+    assert [t["task_id"] for t in leased] == [work]
+
+
+def test_parked_lease_of_departed_client_claims_nothing(hub_port):
+    sock = socket.create_connection(("127.0.0.1", hub_port))
+    req = {"id": "1", "method": "lease", "params": {"worker_id": "gone", "wait_seconds": 10}}
+    sock.sendall((json.dumps(req) + "\n").encode())
+    time.sleep(0.2)
+    sock.close()
+    time.sleep(0.2)
+
+    client = HubClient("127.0.0.1", hub_port)
+    task_id = client.call("enqueue", {"prompt": "for someone still here"})["task_id"]
+    time.sleep(0.2)
+    tasks = client.call("lease", {"worker_id": "present", "max_tasks": 1})["tasks"]
+    assert [t["task_id"] for t in tasks] == [task_id]
+
+
+def test_notify_wakes_one_matching_waiter():
+    async def scenario():
+        waiters = LeaseWaiters()
+        alice = waiters.park("alice", None, [])
+        bob = waiters.park("bob", "gpu", [])
+        carol = waiters.park("carol", None, ["ops"])
+
+        waiters.notify("gpu")
+        assert (alice.signalled, bob.signalled, carol.signalled) == (True, False, False)
+
+        waiters.notify("default", target_group="ops")
+        assert carol.signalled
+
+        waiters.notify("default", target_worker="bob")
+        assert not bob.signalled  # bob only serves the gpu queue
+
+    asyncio.run(scenario())
@@ -1,7 +1,16 @@
 import os
+import socket
+import threading
 import time
 import unittest
+import urllib.error
+import urllib.request
+
+import pytest
+
+from kirosu.agent import HubClient
 from kirosu.db import TaskStore
+from kirosu.hub import run_hub
 
 class TestDBMetrics(unittest.TestCase):
     def setUp(self):
@@ -48,5 +57,57 @@ class TestDBMetrics(unittest.TestCase):
         self.assertEqual(stats["error_rate_percent"], 50.0) # 1 done, 1 failed
         self.assertGreaterEqual(stats["completed_last_hour"], 1)
 
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_prometheus_endpoint(db_path):
+    metrics_port = _free_port()
+    ready = threading.Event()
+    port_container = {}
+    threading.Thread(
+        target=run_hub,
+        args=(db_path, "127.0.0.1", 0, 300),
+        kwargs={
+            "ready_callback": lambda port: (port_container.update(port=port), ready.set()),
+            "metrics_port": metrics_port,
+        },
+        daemon=True,
+    ).start()
+    assert ready.wait(5)
+
+    client = HubClient("127.0.0.1", port_container["port"])
+    client.call("enqueue", {"prompt": "a"})
+    client.call("enqueue", {"prompt": "b", "queue": "urgent"})
+    client.call("lease", {"worker_id": "w", "queue": "urgent"})
+    with pytest.raises(RuntimeError):
+        client.call("no_such_method")
+    with client.batch() as batch:
+        batch.call("stats")
+        batch.call("get_tasks", {"task_ids": [1]})
+
+    with urllib.request.urlopen(f"http://127.0.0.1:{metrics_port}/metrics", timeout=5) as resp:
+        assert resp.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+        body = resp.read().decode()
+    lines = set(body.splitlines())
+    assert 'kirosu_requests_total{method="enqueue",outcome="ok"} 2' in lines
+    assert 'kirosu_requests_total{method="unknown",outcome="error"} 1' in lines
+    assert 'kirosu_requests_total{method="get_tasks",outcome="ok"} 1' in lines
+    assert 'kirosu_request_duration_seconds_count{method="enqueue"} 2' in lines
+    assert 'kirosu_request_duration_seconds_bucket{method="enqueue",le="+Inf"} 2' in lines
+    assert 'kirosu_tasks{queue="default",status="queued"} 1' in lines
+    assert 'kirosu_tasks{queue="urgent",status="leased"} 1' in lines
+    assert "kirosu_connections 1" in lines
+    assert "# TYPE kirosu_executor_wait_seconds histogram" in lines
+
+    with pytest.raises(urllib.error.HTTPError) as excinfo:
+        urllib.request.urlopen(f"http://127.0.0.1:{metrics_port}/other", timeout=5)
+    assert excinfo.value.code == 404
+    client.call("shutdown")
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,322 @@
+import sqlite3
+import time
+
+import pytest
+
+from kirosu.backpressure import HubBusyError, Pacer
+from kirosu.db import TaskStore
+from kirosu.scheduling import AdmissionControl, FairShareScheduler, RateLimiter, TokenBucket
+
+
+def _lease_tenants(store, n, max_tasks=1):
+    out = []
+    for _ in range(n):
+        out.extend(t.tenant for t in store.lease("w", max_tasks, 300))
+    return out
+
+
+def test_round_robin_between_tenants(store):
+    for i in range(50):
+        store.enqueue(f"bulk {i}", tenant="alice")
+    for i in range(3):
+        store.enqueue(f"small {i}", tenant="bob")
+
+    # Bob's three tasks are not stuck behind Alice's backlog
+    assert _lease_tenants(store, 6) == ["alice", "bob"] * 3
+    assert _lease_tenants(store, 3) == ["alice"] * 3
+
+
+def test_fifo_within_tenant(store):
+    ids = [store.enqueue(f"t{i}", tenant="alice") for i in range(3)]
+    assert [store.lease("w", 1, 300)[0].task_id for _ in range(3)] == ids
+
+
+def test_weighted_share(store):
+    store.set_tenant_weight("gold", 3)
+    for i in range(40):
+        store.enqueue("g", tenant="gold")
+        store.enqueue("s", tenant="silver")
+
+    leased = _lease_tenants(store, 40)
+    assert leased.count("gold") == 30
+    assert leased.count("silver") == 10
+
+
+def test_batch_lease_splits_across_tenants(store):
+    for tenant in ("a", "b", "c", "d"):
+        for i in range(10):
+            store.enqueue(f"{tenant}{i}", tenant=tenant)
+
+    tasks = store.lease("w", 8, 300)
+    counts = {t: sum(1 for x in tasks if x.tenant == t) for t in "abcd"}
+    assert counts == {"a": 2, "b": 2, "c": 2, "d": 2}
+
+
+def test_weights_persist(db_path):
+    store = TaskStore(db_path)
+    store.set_tenant_weight("gold", 2.5)
+    store.close()
+
+    reopened = TaskStore(db_path)
+    try:
+        assert reopened.scheduler.weight("gold") == 2.5
+    finally:
+        reopened.close()
+
+
+def test_rows_inserted_elsewhere_are_found(store, db_path):
+    conn = sqlite3.connect(db_path)
+    now = time.time()
+    conn.execute(
+        "INSERT INTO tasks (prompt, status, created_at, updated_at, tenant) VALUES ('raw', 'queued', ?, ?, 'ext')",
+        (now, now),
+    )
+    conn.commit()
+    conn.close()
+
+    store._last_tenant_refresh = 0.0
+    tasks = store.lease("w", 1, 300)
+    assert [t.prompt for t in tasks] == ["raw"]
+
+
+def test_queue_filter_does_not_drop_tenant(store):
+    store.enqueue("report", tenant="alice", queue="reports")
+    assert store.lease("w", 1, 300, queue="default") == []
+    # Alice still has work in another queue and keeps her place
+    assert "alice" in store.scheduler.active_tenants()
+    assert store.lease("w", 1, 300, queue="reports")[0].prompt == "report"
+
+
+def test_scheduler_drops_idle_tenants():
+    sched = FairShareScheduler()
+    sched.activate("a")
+    sched.activate("b")
+    picked = sched.pick(2, lambda tenant, k: [tenant] * k if tenant == "a" else [], lambda tenant: tenant == "a")
+    assert picked == ["a", "a"]
+    assert sched.active_tenants() == ["a"]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_refills():
+    clock = FakeClock()
+    bucket = TokenBucket(60, clock)
+    bucket.take(60)
+    assert bucket.available() == 0
+    clock.now += 10
+    assert bucket.available() == 10
+    clock.now += 3600
+    assert bucket.available() == 60
+
+
+def test_rate_limiter_request_budget():
+    clock = FakeClock()
+    limiter = RateLimiter(clock)
+    limiter.set_limit("codex/mini", requests_per_minute=2)
+    keys = RateLimiter.keys_for("codex", "mini")
+    assert keys == ["codex/mini", "codex"]
+
+    assert limiter.allowance(keys, 5) == 2
+    assert limiter.try_consume(keys, 10)
+    assert limiter.try_consume(keys, 10)
+    assert limiter.allowance(keys, 5) == 0
+    assert limiter.snapshot()["codex/mini"]["throttled"] >= 1
+
+    clock.now += 30
+    assert limiter.allowance(keys, 5) == 1
+
+    limiter.set_limit("codex/mini")
+    assert not limiter.limited(keys)
+
+
+def test_queue_depth_limits_refuse_enqueue(store):
+    store.admission.set_limit("tenant:bulk", 3)
+    store.admission.set_limit("queue:urgent", 1)
+    for i in range(3):
+        store.enqueue(f"bulk {i}", tenant="bulk")
+    with pytest.raises(HubBusyError) as excinfo:
+        store.enqueue("one too many", tenant="bulk")
+    assert excinfo.value.retry_after >= store.admission.min_retry_after
+    store.enqueue("other tenants still get in", tenant="alice")
+    store.enqueue("first", queue="urgent")
+    with pytest.raises(HubBusyError):
+        store.enqueue("second", queue="urgent")
+
+    # Room made by leasing shows up once the cached depths refresh
+    store.lease("w", 2, 300)
+    store.admission.refresh_seconds = 0
+    store.enqueue("fits again", tenant="bulk")
+    snapshot = store.admission.snapshot()
+    assert snapshot["tenant:bulk"]["rejected"] == 1
+    assert snapshot["tenant:bulk"]["queued"] <= 3
+
+
+def test_admitted_tasks_do_not_count_as_drained():
+    clock = FakeClock()
+    admission = AdmissionControl(clock=clock)
+    admission.set_limit("queue:default", 1000)
+    admission.refresh([("default", "t", 100)])
+    for _ in range(50):
+        admission.admit("default", "t")
+    clock.now += 1
+    # Nothing was leased: the 50 admitted tasks are still queued
+    admission.refresh([("default", "t", 150)])
+    assert admission.snapshot()["queue:default"]["drain_per_sec"] == 0.0
+
+    clock.now += 1
+    admission.refresh([("default", "t", 130)])
+    assert admission.snapshot()["queue:default"]["drain_per_sec"] == 10.0
+
+def test_pacer_spaces_sends_after_busy():
+    clock = FakeClock()
+    pacer = Pacer(jitter=0, clock=clock)
+    assert pacer.wait() == 0
+    pacer.busy(2.0)
+    # Everyone holds off for the hint, then sends go out spaced apart
+    waits = [pacer.wait() for _ in range(3)]
+    assert waits[0] == 2.0 and waits[1] > waits[0] and waits[2] > waits[1]
+    for _ in range(30):
+        pacer.ok()
+    assert pacer.interval == 0
+
+
+def test_lease_respects_rate_limits(store):
+    for i in range(5):
+        store.enqueue(f"task {i}")
+    store.rate_limiter.set_limit("codex/mini", requests_per_minute=2)
+
+    assert len(store.lease("w1", 5, 300, provider="codex", model="mini")) == 2
+    assert store.lease("w1", 5, 300, provider="codex", model="mini") == []
+    # Other providers are unaffected, and throttled tasks simply stayed queued
+    assert len(store.lease("w2", 5, 300, provider="kiro", model="haiku")) == 3
+
+
+def test_lease_token_budget_puts_back_overflow(store):
+    store.enqueue("x" * 400)  # ~100 tokens
+    store.enqueue("y" * 400)
+    store.rate_limiter.set_limit("codex", tokens_per_minute=150)
+
+    leased = store.lease("w1", 2, 300, provider="codex", model="mini")
+    assert len(leased) == 1
+    assert store.stats()["queued"] == 1
+
+
+def test_edf_leases_deadline_tasks_first(tmp_path):
+    store = TaskStore(str(tmp_path / "edf.db"), schedule="edf")
+    now = time.time()
+    best_effort = store.enqueue("whenever")
+    late = store.enqueue("report b", deadline=now + 600)
+    soon = store.enqueue("report a", deadline=now + 60)
+
+    assert [t.task_id for t in store.lease("w", 2, 300)] == [soon, late]
+    assert [t.task_id for t in store.lease("w", 2, 300)] == [best_effort]
+
+    # Without a queue filter the claim still reads tasks in deadline order off an index
+    conn = store._get_conn()
+    try:
+        plan = " ".join(
+            str(r[3])
+            for r in conn.execute(
+                "EXPLAIN QUERY PLAN SELECT task_id FROM tasks WHERE status = 'queued' AND deadline IS NOT NULL "
+                "ORDER BY deadline ASC, task_id ASC LIMIT 1"
+            )
+        )
+    finally:
+        store._return_conn(conn)
+    assert "idx_deadline_order" in plan and "TEMP B-TREE" not in plan
+
+
+def test_fifo_ignores_deadlines(store):
+    first = store.enqueue("first")
+    store.enqueue("due", deadline=time.time() + 1)
+    assert store.lease("w", 1, 300)[0].task_id == first
+
+
+def test_deadline_report_projects_misses(tmp_path):
+    store = TaskStore(str(tmp_path / "edf.db"), schedule="edf")
+    tid = store.enqueue("measured")
+    store.lease("w", 1, 300)
+    store.ack(tid, "done", "ok", None, started_at=time.time() - 100)
+
+    now = time.time()
+    ok = store.enqueue("plenty of time", deadline=now + 1000)
+    tight = store.enqueue("too tight", deadline=now + 150)
+
+    report = store.deadline_report()
+    assert report["workers"] == 1
+    assert 99 < report["run_time_p50_sec"]["chat"] < 101
+    # EDF order: tight runs first (done ~now+100), then ok (~now+200)
+    assert report["projected_misses"] == 0
+
+    # An earlier deadline pushes everything behind it back by one run
+    urgent = store.enqueue("urgent", deadline=now + 50)
+    report = store.deadline_report()
+    assert [t["task_id"] for t in report["at_risk"]] == [urgent, tight]
+    assert ok not in {t["task_id"] for t in report["at_risk"]}
+
+
+def test_targeted_tasks_go_to_their_worker_or_group(store):
+    general = store.enqueue("anyone")
+    for_bob = store.enqueue("bob only", target_worker="bob")
+    for_gpu = store.enqueue("gpu group", target_group="gpu")
+
+    assert [t.task_id for t in store.lease("alice", 5, 300)] == [general]
+    assert [t.task_id for t in store.lease("carol", 5, 300, groups=["gpu"])] == [for_gpu]
+    assert [t.task_id for t in store.lease("bob", 5, 300)] == [for_bob]
+
+
+def test_targeted_task_served_before_general_queue(store):
+    store.enqueue("older general")
+    mine = store.enqueue("for bob", target_worker="bob")
+    assert store.lease("bob", 1, 300)[0].task_id == mine
+
+
+def test_targeted_task_falls_back_to_any_worker(store):
+    strict = store.enqueue("bob only", target_worker="bob")
+    lapsed = store.enqueue("bob preferred", target_worker="bob", fallback_seconds=-1)
+
+    assert [t.task_id for t in store.lease("alice", 5, 300)] == [lapsed]
+    assert store.get_tasks([strict])[0].status == "queued"
+
+
+def test_session_sticks_to_its_worker(store):
+    first = store.enqueue("turn 1", session_id="s1")
+    store.lease("alice", 1, 300)
+    store.ack(first, "done", "hi", None)
+
+    second = store.enqueue("turn 2", session_id="s1")
+    other = store.enqueue("unrelated")
+    assert [t.task_id for t in store.lease("bob", 5, 300)] == [other]
+    leased = store.lease("alice", 5, 300)
+    assert [t.task_id for t in leased] == [second]
+    assert leased[0].session_turns == 1
+
+    history = store.session_history("s1")
+    assert history["worker_id"] == "alice"
+    assert history["turns"] == 1
+    assert [t.prompt for t in history["tasks"]] == ["turn 1", "turn 2"]
+
+
+def test_session_fails_over_when_pin_lapses(tmp_path):
+    store = TaskStore(str(tmp_path / "s.db"), session_affinity=0)
+    first = store.enqueue("turn 1", session_id="s1")
+    store.lease("alice", 1, 300)
+    store.ack(first, "done", "hi", None)
+    time.sleep(0.01)
+
+    second = store.enqueue("turn 2", session_id="s1")
+    assert [t.task_id for t in store.lease("bob", 1, 300)] == [second]
+    assert store.session_history("s1")["worker_id"] == "bob"
+
+
+def test_session_fails_over_when_lease_expires(store):
+    store.enqueue("turn 1", session_id="s1")
+    store.lease("alice", 1, -1)
+    # alice's lease lapsed: the turn is requeued and the pin released
+    assert [t.worker_id for t in store.lease("bob", 1, 300)] == ["bob"]
@@ -0,0 +1,117 @@
+import asyncio
+import json
+import os
+import socket
+import stat
+import threading
+import time
+
+import pytest
+
+from kirosu.agent import HubClient, KiroAgent
+from kirosu.client import SwarmClient
+from kirosu.hub import run_hub
+
+
+def start_unix_hub(db_path, sock_path, **kwargs):
+    ready = threading.Event()
+    t = threading.Thread(
+        target=run_hub,
+        args=(db_path, "127.0.0.1", 0, 300),
+        kwargs=dict(ready_callback=lambda port: ready.set(), unix_path=sock_path, tcp=False, **kwargs),
+        daemon=True,
+    )
+    t.start()
+    assert ready.wait(5), "Hub failed to start"
+    return t
+
+
+def test_clients_reach_hub_over_unix_socket(db_path, tmp_path):
+    sock_path = str(tmp_path / "hub.sock")
+    hub = start_unix_hub(db_path, sock_path)
+    assert stat.S_IMODE(os.stat(sock_path).st_mode) == 0o660
+
+    client = HubClient(f"unix://{sock_path}", 0)
+    task_id = client.call("enqueue", {"prompt": "over unix"})["task_id"]
+
+    async def scenario():
+        async with SwarmClient(f"unix://{sock_path}", 0) as swarm:
+            return (await swarm.get_task(task_id))["prompt"]
+
+    assert asyncio.run(scenario()) == "over unix"
+
+    client.call("shutdown")
+    hub.join(5)
+    assert not os.path.exists(sock_path)
+
+
+def test_stale_socket_file_is_replaced(db_path, tmp_path):
+    sock_path = str(tmp_path / "hub.sock")
+    # A socket file left behind by a hub that died without cleaning up
+    dead = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    dead.bind(sock_path)
+    dead.close()
+
+    hub = start_unix_hub(db_path, sock_path, unix_mode=0o600)
+    assert stat.S_IMODE(os.stat(sock_path).st_mode) == 0o600
+    client = HubClient(f"unix://{sock_path}", 0)
+    assert client.call("ping")["pong"] is True
+
+    with pytest.raises(RuntimeError, match="already listening"):
+        run_hub(db_path, "127.0.0.1", 0, 300, unix_path=sock_path, tcp=False)
+
+    client.call("shutdown")
+    hub.join(5)
+
+
+def test_shutdown_drains_parked_requests(db_path, tmp_path):
+    sock_path = str(tmp_path / "hub.sock")
+    hub = start_unix_hub(db_path, sock_path)
+    client = HubClient(f"unix://{sock_path}", 0)
+    client.call("enqueue", {"prompt": "survives the restart"})
+    client.call("lease", {"worker_id": "w", "max_tasks": 1})
+
+    agent = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    agent.connect(sock_path)
+    stream = agent.makefile("rwb")
+    stream.write(b'{"id": "parked", "method": "lease", "params": {"worker_id": "w2", "wait_seconds": 30}}\n')
+    stream.flush()
+    time.sleep(0.2)
+
+    start = time.monotonic()
+    client.call("shutdown")
+    messages = [json.loads(stream.readline()) for _ in range(2)]
+    hub.join(5)
+    elapsed = time.monotonic() - start
+    agent.close()
+
+    assert not hub.is_alive() and elapsed < 1.0
+    assert {"id": None, "event": "shutdown", "drain_seconds": 5.0} in messages
+    # The parked lease is answered, empty, rather than cut off
+    assert next(m for m in messages if m["id"] == "parked")["result"]["tasks"] == []
+    assert not os.path.exists(sock_path)
+    wal = db_path + "-wal"
+    assert not os.path.exists(wal) or os.path.getsize(wal) == 0
+
+
+def test_agent_holds_results_across_a_hub_restart(db_path, tmp_path):
+    sock_path = str(tmp_path / "hub.sock")
+    hub = start_unix_hub(db_path, sock_path)
+    agent = KiroAgent(f"unix://{sock_path}", 0, lease_wait=0)
+    task_id = agent.client.call("enqueue", {"prompt": "print(1)", "type": "python"})["task_id"]
+    assert agent.client.call("lease", {"worker_id": agent.worker_id, "max_tasks": 1})["tasks"]
+
+    agent.client.call("shutdown")
+    hub.join(5)
+    # The replacement comes up while the result is being retried
+    holder: list[threading.Thread] = []
+    restarted = threading.Timer(0.5, lambda: holder.append(start_unix_hub(db_path, sock_path)))
+    restarted.start()
+    agent._flush_acks([{"task_id": task_id, "status": "done", "result": "1\n"}])
+
+    assert agent.unacked == []
+    client = HubClient(f"unix://{sock_path}", 0)
+    assert client.call("get_tasks", {"task_ids": [task_id]})["tasks"][0]["status"] == "done"
+    client.call("shutdown")
+    restarted.join()
+    holder[0].join(5)
@@ -0,0 +1,111 @@
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from kirosu.db import TaskStore
+from kirosu.hub import WalCheckpointer, _HubState, _backup_target
+
+
+def test_backup_is_consistent_under_writes(db_path, tmp_path):
+    store = TaskStore(db_path)
+    try:
+        for i in range(2000):
+            store.enqueue(f"task {i} " + "x" * 200)
+
+        stop = threading.Event()
+
+        def writer():
+            while not stop.is_set():
+                store.enqueue("concurrent write")
+
+        t = threading.Thread(target=writer, daemon=True)
+        t.start()
+        target = str(tmp_path / "backup.db")
+        info = store.backup(target, pages=16, sleep=0)
+        stop.set()
+        t.join()
+
+        assert info["steps"] > 1
+        copy = sqlite3.connect(target)
+        try:
+            assert copy.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+            assert copy.execute("SELECT COUNT(*) FROM tasks").fetchone()[0] >= 2000
+        finally:
+            copy.close()
+    finally:
+        store.close()
+
+
+def test_manual_checkpoint_truncates_wal(db_path):
+    store = TaskStore(db_path, autocheckpoint=False)
+    try:
+        for i in range(500):
+            store.enqueue("y" * 500)
+        assert store.wal_size_bytes() > 0
+
+        result = store.checkpoint("truncate")
+        assert result["mode"] == "TRUNCATE"
+        assert not result["busy"]
+        assert store.wal_size_bytes() == 0
+        assert store.stats()["total_tasks"] == 500
+    finally:
+        store.close()
+
+
+def test_checkpointer_policy(db_path):
+    store = TaskStore(db_path, autocheckpoint=False)
+    state = _HubState(store, lease_seconds=300)
+    try:
+        store.enqueue("z" * 500)
+        checkpointer = WalCheckpointer(state, idle_seconds=60, truncate_bytes=1 << 30)
+
+        # Busy hub, small WAL: leave it alone
+        state.touch()
+        assert checkpointer.tick() is None
+
+        # Idle hub: passive checkpoint
+        state.last_activity = time.monotonic() - 120
+        assert checkpointer.tick()["mode"] == "PASSIVE"
+
+        # Oversized WAL: truncate even while busy
+        state.touch()
+        checkpointer.truncate_bytes = 1
+        assert checkpointer.tick()["mode"] == "TRUNCATE"
+        assert store.wal_size_bytes() == 0
+
+        # A reader pinning the WAL makes the truncate give up at once, not stall writers
+        store.enqueue("y" * 500)
+        reader = sqlite3.connect(db_path)
+        try:
+            reader.execute("BEGIN")
+            reader.execute("SELECT COUNT(*) FROM tasks").fetchone()
+            store.enqueue("after the snapshot")
+            start = time.monotonic()
+            assert checkpointer.tick()["busy"] is True
+            assert time.monotonic() - start < 0.5
+        finally:
+            reader.close()
+    finally:
+        store.close()
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+
+
+def test_backup_destinations_are_confined(tmp_path):
+    backup_dir = str(tmp_path / "backups")
+    assert _backup_target(backup_dir, "nightly.db") == os.path.join(backup_dir, "nightly.db")
+    assert os.path.isdir(backup_dir)
+    for outside in ("../hub.db", str(tmp_path / "hub.db"), "/etc/passwd", "."):
+        with pytest.raises(ValueError):
+            _backup_target(backup_dir, outside)
+
+    store = TaskStore(str(tmp_path / "hub.db"))
+    try:
+        with pytest.raises(ValueError, match="over itself"):
+            store.backup(str(tmp_path / "hub.db"))
+    finally:
+        store.close()